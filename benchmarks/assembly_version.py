@@ -0,0 +1,150 @@
+"""Benchmark reading the build number from an assembly.
+
+Compares toriicli.build.assembly_version against parsing the whole file with
+pefile, which is how build numbers used to be read. Run from the repository
+root:
+
+    python benchmarks/assembly_version.py [ASSEMBLY...]
+
+If no assemblies are given, a small PE and a 50MB PE with a version resource
+are generated to benchmark with.
+"""
+import mmap
+import os
+from os import path
+import struct
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional, Tuple
+
+import pefile
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+from toriicli.build import assembly_version  # noqa: E402
+
+
+def make_pe(version: Tuple[int, int, int, int], padding: int = 0) -> bytes:
+    """Make a minimal PE32 file with a VS_VERSIONINFO resource, followed by
+    padding to make it bigger."""
+    version_ms = (version[0] << 16) | version[1]
+    version_ls = (version[2] << 16) | version[3]
+    fixed_file_info = struct.pack("<13I", 0xFEEF04BD, 0x00010000, version_ms,
+                                  version_ls, version_ms, version_ls, 0x3F, 0,
+                                  4, 2, 0, 0, 0)
+    key = "VS_VERSION_INFO\0".encode("utf-16-le")
+    body = struct.pack("<HHH", 0, len(fixed_file_info), 0) + key
+    body += b"\0" * ((4 - len(body) % 4) % 4) + fixed_file_info
+    version_info = struct.pack("<H", len(body)) + body[2:]
+
+    # the resource table: type -> name -> language -> data
+    resource_rva = 0x1000
+    data_entry_offset = 72
+    data_offset = 88
+
+    def directory(entries: List[Tuple[int, int]]) -> bytes:
+        return struct.pack("<IIHHHH", 0, 0, 0, 0, 0, len(entries)) + \
+            b"".join(struct.pack("<II", *entry) for entry in entries)
+
+    resources = directory([(16, 0x80000000 | 24)]) + \
+        directory([(1, 0x80000000 | 48)]) + \
+        directory([(0x409, data_entry_offset)])
+    resources += struct.pack("<IIII", resource_rva + data_offset,
+                             len(version_info), 0, 0)
+    resources += version_info
+    raw_size = (len(resources) + 0x1FF) & ~0x1FF
+    resources = resources.ljust(raw_size, b"\0")
+
+    dos_header = b"MZ" + b"\0" * 58 + struct.pack("<I", 0x40)
+    coff_header = struct.pack("<HHIIIHH", 0x14C, 1, 0, 0, 0, 224, 0x2102)
+    optional_header = struct.pack("<HBBIIIIIII", 0x10B, 0, 0, 0, raw_size, 0,
+                                  0, 0, 0, 0x10000000)
+    optional_header += struct.pack("<IIHHHHHHIIIIHHIIIIII", 0x1000, 0x200, 4,
+                                   0, 0, 0, 4, 0, 0, 0x2000, 0x200, 0, 3, 0,
+                                   0x100000, 0x1000, 0x100000, 0x1000, 0, 16)
+    data_directories = [(0, 0)] * 16
+    data_directories[2] = (resource_rva, data_offset + len(version_info))
+    optional_header += b"".join(
+        struct.pack("<II", *entry) for entry in data_directories)
+    section = b".rsrc\0\0\0" + struct.pack(
+        "<IIIIIIHHI", len(resources), resource_rva, raw_size, 0x200, 0, 0, 0,
+        0, 0x40000040)
+    headers = dos_header + b"PE\0\0" + coff_header + optional_header + section
+    return headers.ljust(0x200, b"\0") + resources + b"\0" * padding
+
+
+def read_version_pefile(assembly_path: str) -> Tuple[int, int, int, int]:
+    """Read the version like toriicli used to, parsing the whole file."""
+    pe = pefile.PE(assembly_path)
+    ver_info = pe.VS_FIXEDFILEINFO[0]
+    ver_ms = ver_info.ProductVersionMS
+    ver_ls = ver_info.ProductVersionLS
+    pe.close()
+    return (ver_ms >> 16, ver_ms & 0xFFFF, ver_ls >> 16, ver_ls & 0xFFFF)
+
+
+def read_version_uncached(
+        assembly_path: str) -> Optional[Tuple[int, int, int, int]]:
+    """Read the version like toriicli does, without the cache."""
+    with open(assembly_path, "rb") as assembly_file, \
+            mmap.mmap(assembly_file.fileno(), 0,
+                      access=mmap.ACCESS_READ) as data:
+        return assembly_version._read_product_version(data)
+
+
+def time_call(func: Callable[[str], object],
+              assembly_path: str,
+              min_seconds: float = 0.5) -> float:
+    """Get the average seconds a call takes, calling it for at least
+    min_seconds."""
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        func(assembly_path)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return elapsed / calls
+
+
+def format_time(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.1f}ms"
+    return f"{seconds * 1e6:.1f}us"
+
+
+def benchmark(assembly_path: str) -> None:
+    size_mb = os.stat(assembly_path).st_size / (1024 * 1024)
+    print(f"{assembly_path} ({size_mb:.1f}MB)")
+    expected = read_version_pefile(assembly_path)
+    actual = assembly_version.get_product_version(assembly_path)
+    if actual != expected:
+        print(f"  MISMATCH: pefile read {expected}, toriicli read {actual}")
+        return
+
+    readers = [("pefile, full parse", read_version_pefile),
+               ("toriicli, uncached", read_version_uncached),
+               ("toriicli, cached", assembly_version.get_product_version)]
+    for name, func in readers:
+        print(f"  {name:<20} {format_time(time_call(func, assembly_path))}")
+
+
+def main(assembly_paths: List[str]) -> None:
+    if len(assembly_paths) > 0:
+        for assembly_path in assembly_paths:
+            benchmark(assembly_path)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name, padding in [("small.dll", 0),
+                              ("large.dll", 50 * 1024 * 1024)]:
+            assembly_path = path.join(temp_dir, name)
+            with open(assembly_path, "wb") as assembly_file:
+                assembly_file.write(make_pe((1, 2, 3, 4), padding))
+            benchmark(assembly_path)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,24 +1,42 @@
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
+from datetime import datetime
 import logging
 import logging.config
 import os
 from os import path
+import queue
 import shutil
-from typing import List, Optional
+import sys
+import tempfile
+import threading
+from typing import List, Mapping, Optional
 
 import click
 import dotenv
 
-from .build import detect_unity, build_def, unity, build_data
-from . import steps, config
+from .build import detect_unity, build_def, unity, build_data, build_cache, \
+    library_cache
+from . import steps, config, cleanup, distributed, journal, limits, \
+    metrics, process, storage
+from . import batch as _batch
+from . import serve as _serve
+from .steps import pipeline
 from . import nuget as _nuget
+from . import nuget_cache
 
 VERSION = "#{TAG_NAME}#"
 
 
 class ToriiCliContext:
-    def __init__(self, cfg: config.ToriiCliConfig, project_path: str) -> None:
+    def __init__(self,
+                 cfg: config.ToriiCliConfig,
+                 project_path: str,
+                 config_path: str,
+                 in_job: bool = False) -> None:
         self.cfg = cfg
+        self.config_path = config_path
+        self.in_job = in_job
 
         # if the project path is not absolute, we need to make it so, as
         # Unity expects it to be absolute
@@ -31,7 +49,10 @@ class ToriiCliContext:
 
 pass_ctx = click.make_pass_decorator(ToriiCliContext)
 
-SUBCOMMANDS_DONT_LOAD_CONFIG = ["new"]
+IN_JOB = "in_job"
+"""The context object of commands run as jobs by 'serve' and 'batch'."""
+
+SUBCOMMANDS_DONT_LOAD_CONFIG = ["new", "serve", "batch", "worker"]
 """These subcommands shouldn't load config -- it may not exist beforehand."""
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
@@ -47,26 +68,88 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
               default=os.getcwd(),
               show_default=True,
               help="The project directory.")
+@click.option("--cleanup",
+              "cleanup_mode",
+              type=click.Choice(cleanup.MODES),
+              default=cleanup.WAIT,
+              show_default=True,
+              help="Whether to wait for build outputs and step workspaces to "
+              "be deleted before exiting, or leave a detached process to "
+              "delete them.")
+@click.option("--metrics",
+              "metrics_path",
+              type=click.Path(dir_okay=False, writable=True),
+              help="Write metrics of each step and child process to this "
+              "file, as JSON lines.")
+@click.option("--prometheus",
+              "prometheus_path",
+              type=click.Path(dir_okay=False, writable=True),
+              help="Write metrics to this file in the Prometheus textfile "
+              "format when finished.")
 @click.pass_context
-def toriicli(ctx, project_path):
+def toriicli(ctx, project_path, cleanup_mode, metrics_path, prometheus_path):
     """CLI utility for the Unity Torii library."""
     config.setup_logging()
+    # jobs run in the same process as 'serve' or 'batch', so they leave
+    # cleanup and metrics to it rather than changing them for every job
+    in_job = ctx.obj == IN_JOB
+    if not in_job:
+        cleanup.set_mode(cleanup_mode)
+        ctx.call_on_close(cleanup.finish)
+        if metrics_path is not None or prometheus_path is not None:
+            metrics.enable(metrics_path, prometheus_path,
+                           ctx.invoked_subcommand)
+            ctx.call_on_close(_finish_metrics)
     if ctx.invoked_subcommand not in SUBCOMMANDS_DONT_LOAD_CONFIG:
-        cfg = config.from_yaml(config.CONFIG_NAME)
+        # jobs can't change the working directory, so their paths are
+        # relative to their project instead
+        working_dir = project_path if in_job else ""
+        config_path = path.join(working_dir, config.CONFIG_NAME)
+        cfg = config.from_yaml(config_path)
         if cfg is None:
             raise SystemExit(1)
 
-        ctx.obj = ToriiCliContext(cfg, cfg.actual_project_dir or project_path)
+        if cfg.actual_project_dir is not None:
+            project_path = path.join(working_dir, cfg.actual_project_dir)
+        ctx.obj = ToriiCliContext(cfg, project_path, config_path, in_job)
+
+
+def _finish_metrics() -> None:
+    # this runs as the command exits, so an exception here means it failed
+    err = sys.exc_info()[1]
+    metrics.finish(err is None
+                   or isinstance(err, SystemExit) and err.code in (0, None))
 
 
 @toriicli.command()
 @click.argument("version", nargs=1, default=None, required=False)
+@click.option("--list",
+              "list_editors",
+              is_flag=True,
+              help="List every installed editor matching VERSION.")
+@click.option("--refresh",
+              is_flag=True,
+              help="Rescan Unity Hub's install locations for editors.")
 @pass_ctx
-def find(ctx: ToriiCliContext, version):
+def find(ctx: ToriiCliContext, version, list_editors, refresh):
     """Print the path to the Unity executable. You can optionally specify a
-    specific Unity VERSION to attempt to find."""
-    exe_path = detect_unity.find_unity_executable(
-        version or ctx.cfg.unity_preferred_version)
+    specific Unity VERSION to attempt to find, which can be a wildcard such as
+    '2019.4.*'. The newest matching version is used."""
+    query = version or ctx.cfg.unity_preferred_version
+    if refresh:
+        detect_unity.list_editors(refresh=True)
+    if list_editors:
+        matching = [
+            editor for editor in detect_unity.list_editors() if query is None
+            or detect_unity.version_matches(editor.version, query)
+        ]
+        for editor in matching:
+            logging.info(f"{editor.version}: {editor.path}")
+        if len(matching) == 0:
+            raise SystemExit(1)
+        return
+
+    exe_path = detect_unity.find_unity_executable(query)
     if exe_path is not None:
         logging.info(exe_path)
     else:
@@ -97,6 +180,20 @@ def new(project_path, force):
     logging.info(f"Created new Torii project: {out_file_path}")
 
 
+@dataclass
+class _BuildOptions:
+    exe_path: str
+    use_unity: bool
+    use_cache: bool
+    use_library_cache: bool
+
+
+CLONE_IGNORE_FOLDERS = [
+    "Temp", "Logs", "obj", ".git", cleanup.TRASH_FOLDER_NAME
+]
+"""Folders not copied when cloning a project to build targets concurrently."""
+
+
 @toriicli.command()
 @click.option(
     "--option",
@@ -105,11 +202,32 @@ def new(project_path, force):
     multiple=True)
 @click.option("--no-unity", is_flag=True, help="Don't run the Unity build.")
 @click.option("--no-clean", is_flag=True, help="Don't clean up afterwards.")
+@click.option("--no-cache",
+              is_flag=True,
+              help="Always run the Unity build, even if it was cached.")
+@click.option("--no-library-cache",
+              is_flag=True,
+              help="Don't restore or save the Library folder cache.")
+@click.option("--per-target",
+              is_flag=True,
+              help="Build each target with a separate Unity run, running its "
+              "post-steps while the next target builds.")
+@click.option("--unity-jobs",
+              type=click.IntRange(min=1),
+              default=1,
+              show_default=True,
+              help="Build this many targets at once, each in a copy of the "
+              "project. Implies --per-target.")
+@click.option("--distribute",
+              is_flag=True,
+              help="Run each target's post-steps on workers, see 'toriicli "
+              "worker'.")
 @pass_ctx
 def build(ctx: ToriiCliContext, option: List[str], no_unity: bool,
-          no_clean: bool):
+          no_clean: bool, no_cache: bool, no_library_cache: bool,
+          per_target: bool, unity_jobs: int, distribute: bool):
     """Build a Torii project."""
-    dotenv.load_dotenv()  # for loading credentials
+    _load_dotenv(ctx)
 
     # first, make sure we can find the Unity executable
     logging.info("Finding Unity executable...")
@@ -123,85 +241,220 @@ def build(ctx: ToriiCliContext, option: List[str], no_unity: bool,
         raise SystemExit(1)
     logging.info(f"Found Unity at: {exe_path}")
 
-    # now, generate the build_defs so Unity can build from them
-    logging.info(f"Generating {build_def.BUILD_DEFS_FILENAME}...")
-    success = build_def.generate_build_defs(ctx.project_path,
-                                            ctx.cfg.build_output_folder,
-                                            ctx.cfg.build_defs)
-    if not success:
+    output_folder = path.join(ctx.project_path, ctx.cfg.build_output_folder)
+    build_opts = _BuildOptions(exe_path, not no_unity, not no_cache,
+                               not no_library_cache)
+    coordinator = _start_coordinator(ctx, "build") if distribute else None
+    try:
+        if per_target or unity_jobs > 1:
+            _build_per_target(ctx, build_opts, option, unity_jobs, coordinator)
+        else:
+            _build_targets(ctx, build_opts, ctx.project_path,
+                           ctx.cfg.build_defs)
+
+            logging.info("Collecting completed builds...")
+
+            # now, collect info on the completed builds (build number etc.),
+            # and run post-steps
+            for bd in ctx.cfg.build_defs:
+                _run_post_steps(ctx, bd, output_folder, option, coordinator)
+    except BaseException:
+        if coordinator is not None:
+            coordinator.cancel()
+        raise
+    if coordinator is not None and not coordinator.wait():
         raise SystemExit(1)
 
-    # run Unity to build game
-    if not no_unity:
-        builder = unity.UnityBuilder(exe_path)
-        success, exit_code = builder.build(ctx.project_path,
-                                           ctx.cfg.unity_build_execute_method)
-        if not success:
-            logging.critical(f"Unity failed with exit code: {exit_code}")
+    # clean up after the build, remove build defs and build output folder
+    if not no_clean:
+        try:
+            build_def.remove_generated_build_defs(ctx.project_path)
+            cleanup.remove_tree(output_folder)
+        except OSError:
+            logging.exception("Unable to clean up after build")
             raise SystemExit(1)
 
-        logging.info("Build success")
 
-    logging.info("Collecting completed builds...")
+def _build_per_target(ctx: ToriiCliContext, build_opts: _BuildOptions,
+                      option: List[str], unity_jobs: int,
+                      coordinator: Optional[distributed.Coordinator]) -> None:
+    """Build each target with a separate run of Unity. As soon as a target is
+    built its post-steps start, while Unity builds the next target.
 
-    # now, collect info on the completed builds (build number etc.), and
-    # run post-steps
-    for bd in ctx.cfg.build_defs:
-        output_folder = path.join(ctx.project_path,
-                                  ctx.cfg.build_output_folder)
-        build_info = build_data.collect_finished_build(output_folder, bd)
-        if build_info is None:
-            logging.error(f"Unable to find build for target {bd.target}")
-            continue
+    With more than one Unity job, each concurrent Unity runs in its own copy
+    of the project, as Unity can only have a project open once.
+    """
+    output_folder = path.join(ctx.project_path, ctx.cfg.build_output_folder)
+    unity_jobs = min(unity_jobs, len(ctx.cfg.build_defs))
+    project_paths = queue.Queue()
+    project_paths.put(ctx.project_path)
+    clones = [_clone_project(ctx) for _ in range(unity_jobs - 1)]
+    [project_paths.put(clone) for clone in clones]
 
-        logging.info(f"Found version {build_info.build_number} for target "
-                     f"{build_info.build_def.target} at {build_info.path}")
-
-        # build steps implicitly have an import step as the first step, to
-        # import the files from the build directory into the workspace
-        steps_to_run = [
-            steps.import_step.ImportStep("**",
-                                         vars(build_info),
-                                         None,
-                                         backend="local",
-                                         container=build_info.path)
-        ]
+    # post-steps run one target at a time, in the order targets finish
+    post_step_executor = ThreadPoolExecutor(max_workers=1)
+
+    build_failed = threading.Event()
+
+    def build_target(bd: build_def.BuildDef) -> Future:
+        # don't start building any more targets if one failed
+        if build_failed.is_set():
+            raise SystemExit(1)
 
-        # get the steps we're running for this build def, based on the filters
+        project_path = project_paths.get()
         try:
-            logging.info("Collecting post-steps...")
-            for step in ctx.cfg.build_post_steps:
-                if step.filter is None or step.filter.match(bd, option):
-                    steps_to_run.append(
-                        step.get_implementation(vars(build_info)))
-
-            logging.info("Running post-steps for build...")
-            # now run each of the steps
-            for i, step in enumerate(steps_to_run):
-                # make sure we import the workspace of the step before this
-                if i != 0:
-                    step.use_workspace(steps_to_run[i - 1])
-
-                step.perform()
+            _build_targets(ctx, build_opts, project_path, [bd])
+            if project_path != ctx.project_path:
+                # move the build from the clone to where the post-steps
+                # expect to find it
+                target_folder = path.join(output_folder, bd.target)
+                cleanup.remove_tree(target_folder)
+                shutil.move(
+                    path.join(project_path, ctx.cfg.build_output_folder,
+                              bd.target), target_folder)
+        except BaseException:
+            build_failed.set()
+            raise
         finally:
-            # now clean up all the steps we ran
-            [step.cleanup() for step in steps_to_run]
-            logging.info("Finished running post steps! Build complete")
+            project_paths.put(project_path)
+        return post_step_executor.submit(_run_post_steps, ctx, bd,
+                                         output_folder, option, coordinator)
+
+    try:
+        with ThreadPoolExecutor(max_workers=unity_jobs) as unity_executor:
+            builds = [
+                unity_executor.submit(build_target, bd)
+                for bd in ctx.cfg.build_defs
+            ]
+            post_steps = [future.result() for future in builds]
+        [future.result() for future in post_steps]
+    finally:
+        post_step_executor.shutdown(wait=True)
+        [cleanup.remove_tree(path.dirname(clone)) for clone in clones]
+
+
+def _clone_project(ctx: ToriiCliContext) -> str:
+    """Copy the project to a temporary folder, including its Library folder
+    so the copy doesn't have to import every asset again."""
+    clone_path = path.join(tempfile.mkdtemp(), ctx.project_name)
+    logging.info(f"Cloning project to {clone_path}...")
+    ignored = [ctx.cfg.build_output_folder] + CLONE_IGNORE_FOLDERS
+
+    def ignore_top_level(directory: str, names: List[str]) -> List[str]:
+        if directory != ctx.project_path:
+            return []
+        return [name for name in names if name in ignored]
+
+    shutil.copytree(ctx.project_path, clone_path, ignore=ignore_top_level)
+    return clone_path
+
+
+def _build_targets(ctx: ToriiCliContext, build_opts: _BuildOptions,
+                   project_path: str,
+                   build_defs: List[build_def.BuildDef]) -> None:
+    """Generate the build defs for some targets in a project and build them,
+    using cached builds if nothing has changed."""
+    # generate the build_defs so Unity can build from them
+    logging.info(f"Generating {build_def.BUILD_DEFS_FILENAME}...")
+    success = build_def.generate_build_defs(project_path,
+                                            ctx.cfg.build_output_folder,
+                                            build_defs)
+    if not success:
+        raise SystemExit(1)
 
-    # clean up after the build, remove build defs and build output folder
-    if not no_clean:
-        try:
-            build_def.remove_generated_build_defs(ctx.project_path)
-            shutil.rmtree(path.join(ctx.project_path,
-                                    ctx.cfg.build_output_folder),
-                          ignore_errors=True)
-        except OSError:
-            logging.exception("Unable to clean up after build")
+    if not build_opts.use_unity:
+        return
+
+    # if nothing has changed since a cached build, use that instead
+    output_folder = path.join(project_path, ctx.cfg.build_output_folder)
+    cache = None
+    if ctx.cfg.build_cache is not None and build_opts.use_cache:
+        cache = build_cache.from_config(ctx.cfg.build_cache, project_path,
+                                        build_opts.exe_path,
+                                        ctx.cfg.unity_build_execute_method)
+
+    if cache is not None and cache.restore(output_folder, build_defs):
+        logging.info("Restored builds from cache, skipping Unity build")
+        return
+
+    _build_with_unity(ctx, build_opts, project_path, build_defs)
+    if cache is not None:
+        cache.save(output_folder, build_defs)
+
+
+def _build_with_unity(ctx: ToriiCliContext, build_opts: _BuildOptions,
+                      project_path: str,
+                      build_defs: List[build_def.BuildDef]) -> None:
+    """Run Unity to build the project, restoring and saving the Library
+    folder cache around it if it's configured."""
+    library = None
+    if ctx.cfg.library_cache is not None and build_opts.use_library_cache:
+        library = library_cache.from_config(ctx.cfg.library_cache,
+                                            project_path, build_opts.exe_path,
+                                            build_defs)
+        # only restore on a fresh checkout, the local Library folder is
+        # always at least as up to date as the cached one
+        library_path = path.join(project_path, library_cache.LIBRARY_FOLDER)
+        if not path.exists(library_path):
+            library.restore(project_path)
+
+    builder = unity.UnityBuilder(build_opts.exe_path)
+    targets = "+".join(bd.target for bd in build_defs)
+    log_path = path.join(ctx.project_path, "Logs", f"toriicli-{targets}.log")
+    with limits.hold(limits.UNITY, project_path), metrics.labels(targets):
+        success, exit_code = builder.build(
+            project_path, ctx.cfg.unity_build_execute_method, log_path,
+            ctx.cfg.unity_build_timeout,
+            _process_limits(ctx.cfg.unity_build_limits))
+    if not success:
+        logging.critical(f"Unity failed with exit code: {exit_code}")
+        raise SystemExit(1)
+
+    logging.info("Build success")
+    if library is not None:
+        library.save(project_path)
+
+
+def _run_post_steps(
+        ctx: ToriiCliContext,
+        bd: build_def.BuildDef,
+        output_folder: str,
+        option: List[str],
+        coordinator: Optional[distributed.Coordinator] = None) -> None:
+    """Collect info on a completed build (build number etc.), and run the
+    post-steps for it, or send it to a worker to run them if distributing."""
+    build_info = build_data.collect_finished_build(output_folder, bd)
+    if build_info is None:
+        logging.error(f"Unable to find build for target {bd.target}")
+        return
+
+    logging.info(f"Found version {build_info.build_number} for target "
+                 f"{build_info.build_def.target} at {build_info.path}")
+
+    if coordinator is not None:
+        coordinator.submit(distributed.BUILD, bd, vars(build_info), option,
+                           build_info.path)
+        return
+
+    # build steps implicitly have an import step as the first step, to
+    # import the files from the build directory into the workspace
+    import_step = steps.import_step.ImportStep("**",
+                                               vars(build_info),
+                                               None,
+                                               backend="local",
+                                               container=build_info.path)
+    logging.info(f"Running post-steps for target {bd.target}...")
+    try:
+        success = pipeline.run_steps(ctx.cfg.build_post_steps,
+                                     vars(build_info), bd, option, import_step)
+        if not success:
             raise SystemExit(1)
+    finally:
+        logging.info("Finished running post steps! Build complete")
 
 
 @toriicli.command()
-@click.argument("version", nargs=1, type=str)
+@click.argument("version", nargs=1, type=str, required=False)
 @click.option("--target",
               "-t",
               help="Only release specific targets. Allows multiple.",
@@ -211,13 +464,59 @@ def build(ctx: ToriiCliContext, option: List[str], no_unity: bool,
     "-o",
     help="Will run steps with this option in the filter. Allows multiple.",
     multiple=True)
+@click.option("--resume",
+              metavar="RUN_ID",
+              help="Resume a release that failed, from the first step that "
+              "didn't finish. Uses the version, targets and options it was "
+              "run with.")
+@click.option("--journal",
+              "keep_journal",
+              is_flag=True,
+              help="Keep a journal of the release as it runs, so it can be "
+              "resumed with '--resume' if it fails.")
+@click.option("--distribute",
+              is_flag=True,
+              help="Run each target's steps on workers, see 'toriicli "
+              "worker'.")
 @pass_ctx
-def release(ctx: ToriiCliContext, version: str, target: List[str],
-            option: List[str]):
+def release(ctx: ToriiCliContext, version: Optional[str], target: List[str],
+            option: List[str], resume: Optional[str], keep_journal: bool,
+            distribute: bool):
     """Release VERSION of Torii project."""
-    dotenv.load_dotenv()  # for loading credentials
+    _load_dotenv(ctx)
 
-    logging.info(f"Releasing version {version}")
+    if distribute:
+        if resume is not None or keep_journal:
+            logging.error("Distributed releases can't be resumed")
+            raise SystemExit(1)
+        if version is None:
+            logging.error("Missing VERSION to release")
+            raise SystemExit(1)
+        _release_distributed(ctx, version, target, option)
+        return
+
+    run = None
+    try:
+        if resume is not None:
+            run = journal.load(resume, "release", ctx.config_path)
+            version = run.args["version"]
+            target = run.args["targets"]
+            option = run.options
+        elif version is None:
+            raise ValueError("Missing VERSION to release")
+        elif keep_journal:
+            run = journal.create("release", {
+                "version": version,
+                "targets": list(target)
+            }, option, ctx.config_path)
+    except ValueError as err:
+        logging.error(err)
+        raise SystemExit(1)
+
+    if run is None:
+        logging.info(f"Releasing version {version}")
+    else:
+        logging.info(f"Releasing version {version} (run {run.run_id})")
 
     # we want to release each build definition defined
     for bd in ctx.cfg.build_defs:
@@ -225,29 +524,230 @@ def release(ctx: ToriiCliContext, version: str, target: List[str],
         if len(target) > 0 and bd.target not in target:
             continue
 
+        target_journal = None if run is None else run.target(bd.target)
+        if target_journal is not None and target_journal.done:
+            logging.info(f"Already released target {bd.target}, skipping")
+            continue
+
         logging.info(f"Running release for target {bd.target}")
 
         step_context = {"build_number": version, "build_def": bd}
-        steps_to_run = []
+        if target_journal is not None:
+            target_journal.restore_context(step_context)
+        success = False
         try:
-            logging.info("Collecting steps...")
+            success = pipeline.run_steps(ctx.cfg.release_steps,
+                                         step_context,
+                                         bd,
+                                         option,
+                                         journal=target_journal)
+            if not success:
+                raise SystemExit(1)
+        except ValueError as err:
+            logging.error(err)
+            raise SystemExit(1)
+        finally:
+            if not success and run is not None:
+                logging.error(f"Release failed, resume it with 'toriicli "
+                              f"release --resume {run.run_id}'")
+            logging.info("Finished running steps! Release complete")
 
-            for step in ctx.cfg.release_steps:
-                if step.filter is None or step.filter.match(bd, option):
-                    steps_to_run.append(step.get_implementation(step_context))
+    if run is not None:
+        run.finish()
 
-            logging.info("Running steps for release...")
-            # now run each of the steps
-            for i, step in enumerate(steps_to_run):
-                # make sure we import the workspace of the step before this
-                if i != 0:
-                    step.use_workspace(steps_to_run[i - 1])
 
-                step.perform()
-        finally:
-            # now clean up all the steps we ran
-            [step.cleanup() for step in steps_to_run]
-            logging.info("Finished running steps! Release complete")
+def _release_distributed(ctx: ToriiCliContext, version: str, target: List[str],
+                         option: List[str]) -> None:
+    """Release each target on a worker."""
+    coordinator = _start_coordinator(ctx, "release")
+    logging.info(f"Releasing version {version}")
+    try:
+        for bd in ctx.cfg.build_defs:
+            if len(target) > 0 and bd.target not in target:
+                continue
+            coordinator.submit(distributed.RELEASE, bd,
+                               {"build_number": version}, option)
+    except BaseException:
+        coordinator.cancel()
+        raise
+    if not coordinator.wait():
+        raise SystemExit(1)
+    logging.info("Finished running steps! Release complete")
+
+
+def _start_coordinator(ctx: ToriiCliContext,
+                       command: str) -> distributed.Coordinator:
+    if ctx.cfg.distributed is None:
+        logging.critical("Missing 'distributed' in config, needed to use "
+                         "--distribute")
+        raise SystemExit(1)
+    try:
+        transport = distributed.Transport(ctx.cfg.distributed)
+        coordinator = distributed.Coordinator(transport, command,
+                                              ctx.config_path)
+        coordinator.start()
+    except (ValueError, OSError) as err:
+        logging.critical(f"Unable to distribute {command}: {err}")
+        raise SystemExit(1)
+    return coordinator
+
+
+def _limit_options(func):
+    """Options for limiting resources across every job that's run."""
+    func = click.option("--transfer-limit",
+                        type=click.IntRange(min=1),
+                        help="The most uploads and downloads to run at "
+                        "once.")(func)
+    func = click.option("--compress-limit",
+                        type=click.IntRange(min=1),
+                        help="The most compress and delta steps to run at "
+                        "once.")(func)
+    func = click.option("--unity-limit",
+                        type=click.IntRange(min=1),
+                        help="The most Unity builds to run at once. Unity "
+                        "only ever builds one target of a project at a "
+                        "time.")(func)
+    return func
+
+
+@toriicli.command()
+@click.option("--host",
+              default="127.0.0.1",
+              show_default=True,
+              help="The address to serve the API on.")
+@click.option("--port",
+              default=8765,
+              type=int,
+              show_default=True,
+              help="The port to serve the API on.")
+@click.option("--socket",
+              "socket_path",
+              type=str,
+              help="Serve the API on a Unix socket at this path, instead of "
+              "over TCP.")
+@click.option("--workers",
+              "-j",
+              default=2,
+              type=click.IntRange(min=1),
+              show_default=True,
+              help="How many jobs to run at once.")
+@_limit_options
+def serve(host: str, port: int, socket_path: Optional[str], workers: int,
+          unity_limit: Optional[int], compress_limit: Optional[int],
+          transfer_limit: Optional[int]):
+    """Serve build, release and NuGet jobs over HTTP."""
+    dotenv.load_dotenv()  # for loading credentials, jobs share it
+    limits.set_limits({
+        limits.UNITY: unity_limit,
+        limits.COMPRESS: compress_limit,
+        limits.TRANSFER: transfer_limit
+    })
+    storage.share_providers()
+    _serve.serve(_serve.JobQueue(_run_job, workers), host, port, socket_path)
+
+
+@toriicli.command()
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("--workers",
+              "-j",
+              type=click.IntRange(min=1),
+              help="How many projects to run at once. Overrides the "
+              f"manifest, which defaults to {_batch.DEFAULT_WORKERS}.")
+@_limit_options
+def batch(manifest: str, workers: Optional[int], unity_limit: Optional[int],
+          compress_limit: Optional[int], transfer_limit: Optional[int]):
+    """Build or release every project in a MANIFEST."""
+    dotenv.load_dotenv()  # for loading credentials, jobs share it
+    batch_manifest = _batch.load_manifest(manifest)
+    if batch_manifest is None:
+        raise SystemExit(1)
+
+    # limits given on the command line override the manifest's
+    batch_limits = dict(batch_manifest.limits)
+    for resource, limit in [(limits.UNITY, unity_limit),
+                            (limits.COMPRESS, compress_limit),
+                            (limits.TRANSFER, transfer_limit)]:
+        if limit is not None:
+            batch_limits[resource] = limit
+    limits.set_limits(batch_limits)
+    storage.share_providers()
+
+    workers = workers or batch_manifest.workers or _batch.DEFAULT_WORKERS
+    jobs = _batch.run(batch_manifest, _run_job, workers)
+    _batch.log_summary(batch_manifest, jobs)
+    if len(jobs) < len(batch_manifest.projects) \
+            or any(job.status != _serve.SUCCEEDED for job in jobs):
+        raise SystemExit(1)
+
+
+@toriicli.command()
+@click.option("--using",
+              "-u",
+              "using",
+              metavar="KEY=VALUE",
+              multiple=True,
+              required=True,
+              help="Where to claim tasks from, the same as the 'distributed' "
+              "section of the coordinator's config, i.e. '-u backend=local "
+              "-u container=/mnt/farm'. Allows multiple.")
+@click.option("--workers",
+              "-j",
+              default=1,
+              type=click.IntRange(min=1),
+              show_default=True,
+              help="How many targets to run at once.")
+@click.option("--name",
+              help="The name of this worker in the coordinator's logs. "
+              "Defaults to the host name and process ID.")
+@click.option("--exit-when-idle",
+              is_flag=True,
+              help="Stop once there are no tasks left to claim.")
+@_limit_options
+def worker(using: List[str], workers: int, name: Optional[str],
+           exit_when_idle: bool, unity_limit: Optional[int],
+           compress_limit: Optional[int], transfer_limit: Optional[int]):
+    """Run the steps of targets for builds and releases run with
+    --distribute."""
+    dotenv.load_dotenv()  # for loading credentials
+    try:
+        transport_using = {}
+        for item in using:
+            key, sep, value = item.partition("=")
+            if not sep or not key:
+                raise ValueError(f"Invalid --using '{item}', must be "
+                                 "KEY=VALUE")
+            transport_using[key] = value
+        transport = distributed.Transport(transport_using)
+    except ValueError as err:
+        logging.error(err)
+        raise SystemExit(1)
+
+    limits.set_limits({
+        limits.UNITY: unity_limit,
+        limits.COMPRESS: compress_limit,
+        limits.TRANSFER: transfer_limit
+    })
+    storage.share_providers()
+    distributed.Worker(transport, workers, name).run(exit_when_idle)
+
+
+def _run_job(args: List[str]) -> int:
+    """Run toriicli in this process, returning its exit code."""
+    try:
+        exit_code = toriicli.main(args=args,
+                                  prog_name="toriicli",
+                                  standalone_mode=False,
+                                  obj=IN_JOB)
+    except SystemExit as err:
+        exit_code = err.code
+    except click.ClickException as err:
+        logging.error(err.format_message())
+        exit_code = err.exit_code
+    except click.Abort:
+        exit_code = 1
+    if exit_code is None:
+        return 0
+    return exit_code if isinstance(exit_code, int) else 1
 
 
 @toriicli.group()
@@ -261,12 +761,16 @@ def nuget(ctx: ToriiCliContext):
 def restore(ctx: ToriiCliContext):
     """Run a NuGet restore for this project."""
     success = _nuget.restore_packages(ctx.project_path, ctx.project_name,
-                                      ctx.cfg.nuget_package_install_path)
+                                      ctx.cfg.nuget_package_install_path,
+                                      ctx.cfg.unity_dotnet_framework_version,
+                                      ctx.cfg.nuget_local_feed,
+                                      _nuget_cache(ctx),
+                                      _process_limits(ctx.cfg.nuget_limits))
     raise SystemExit(0 if success else 1)
 
 
 @nuget.command()
-@click.argument("package", nargs=1, type=str)
+@click.argument("packages", nargs=-1, type=str)
 @click.option(
     "--version",
     "-v",
@@ -275,12 +779,44 @@ def restore(ctx: ToriiCliContext):
     default=None,
     help=
     "The version of the package to install. If not present, installs latest.")
+@click.option("--requirements",
+              "-r",
+              type=click.Path(exists=True, dir_okay=False),
+              default=None,
+              help="Install the packages listed in a file, one "
+              "PACKAGE[@VERSION] per line.")
+@click.option("--jobs",
+              "-j",
+              type=click.IntRange(min=1),
+              default=_nuget.INSTALL_JOBS,
+              show_default=True,
+              help="How many packages to install at once.")
 @pass_ctx
-def install(ctx: ToriiCliContext, package: str, version: Optional[str]):
-    """Install a NuGet package to this project."""
-    success = _nuget.install_package(ctx.project_path, package, version,
-                                     ctx.cfg.unity_dotnet_framework_version,
-                                     ctx.cfg.nuget_package_install_path)
+def install(ctx: ToriiCliContext, packages: List[str], version: Optional[str],
+            requirements: Optional[str], jobs: int):
+    """Install NuGet PACKAGES to this project. Each package can be given as
+    PACKAGE[@VERSION]."""
+    try:
+        requested = [_nuget.parse_package_spec(spec) for spec in packages]
+        if requirements is not None:
+            requested += _nuget.read_requirements(requirements)
+    except (ValueError, OSError) as err:
+        logging.error(err)
+        raise SystemExit(1)
+    if len(requested) == 0:
+        logging.error("No packages given to install")
+        raise SystemExit(1)
+    if version is not None:
+        if len(requested) > 1:
+            logging.error("--version can only be used with a single package")
+            raise SystemExit(1)
+        requested = [(requested[0][0], version)]
+
+    success = _nuget.install_packages(ctx.project_path, requested,
+                                      ctx.cfg.unity_dotnet_framework_version,
+                                      ctx.cfg.nuget_package_install_path, jobs,
+                                      _nuget_cache(ctx),
+                                      _process_limits(ctx.cfg.nuget_limits))
     raise SystemExit(0 if success else 1)
 
 
@@ -292,3 +828,74 @@ def uninstall(ctx: ToriiCliContext, package: str):
     success = _nuget.uninstall_package(ctx.project_path, package,
                                        ctx.cfg.nuget_package_install_path)
     raise SystemExit(0 if success else 1)
+
+
+@nuget.command()
+@click.option("--prune",
+              is_flag=True,
+              help="Remove the least recently used packages until the cache "
+              "is within its size limit.")
+@click.option("--max-size",
+              type=click.IntRange(min=0),
+              default=None,
+              help="The size in MB to prune the cache to, instead of its "
+              "size limit.")
+@pass_ctx
+def cache(ctx: ToriiCliContext, prune: bool, max_size: Optional[int]):
+    """Show the packages in the machine-wide NuGet package cache, or prune
+    it."""
+    try:
+        package_cache = nuget_cache.from_config(ctx.cfg.nuget_cache)
+    except ValueError as err:
+        logging.error(err)
+        raise SystemExit(1)
+
+    if prune:
+        removed = package_cache.prune(None if max_size is None else max_size *
+                                      1024 * 1024)
+        logging.info(f"Removed {len(removed)} package(s), freeing "
+                     f"{_megabytes(sum(e.size for e in removed))}")
+        return
+
+    entries = package_cache.entries()
+    for entry in entries:
+        last_used = datetime.fromtimestamp(entry.last_used)
+        logging.info(f"{entry.key}: {_megabytes(entry.size)}, last used "
+                     f"{last_used:%Y-%m-%d %H:%M}")
+    total_size = sum(entry.size for entry in entries)
+    logging.info(f"{len(entries)} package(s) in {package_cache.root}, using "
+                 f"{_megabytes(total_size)} of "
+                 f"{_megabytes(package_cache.max_size)}")
+
+
+def _load_dotenv(ctx: ToriiCliContext) -> None:
+    """Load environment variables from a .env file, i.e. for credentials.
+    Jobs use the environment of the process running them, which loaded it
+    when it started."""
+    if not ctx.in_job:
+        dotenv.load_dotenv()
+
+
+def _nuget_cache(ctx: ToriiCliContext) -> Optional[nuget_cache.PackageCache]:
+    """Get the NuGet package cache for the project, or None if it doesn't
+    use one."""
+    if ctx.cfg.nuget_cache is None:
+        return None
+    try:
+        return nuget_cache.from_config(ctx.cfg.nuget_cache)
+    except ValueError as err:
+        logging.error(err)
+        raise SystemExit(1)
+
+
+def _process_limits(using: Optional[Mapping]) -> process.ResourceLimits:
+    """Get the resource limits of a child process from the config."""
+    try:
+        return process.limits_from_config(using)
+    except ValueError as err:
+        logging.error(err)
+        raise SystemExit(1)
+
+
+def _megabytes(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f}MB"
@@ -0,0 +1,227 @@
+"""Running builds and releases of many projects from a single manifest.
+
+A manifest lists the projects to run, and the command and options to run in
+each. The jobs are scheduled over a pool of workers in this process, the same
+way 'serve' runs them, so limits on how many Unity builds, compressions and
+transfers happen at once apply across every project, and storage clients,
+configs and templates are shared between them.
+
+An example manifest:
+    workers: 4
+    limits:
+      unity: 2
+      transfer: 8
+    projects:
+      - path: games/first
+        options: [steam]
+      - path: games/second
+        command: release
+        args: ["1.2.3"]
+"""
+from dataclasses import dataclass, field
+import logging
+from os import path
+from typing import Dict, List, Optional
+
+from marshmallow import Schema, fields, post_load, pre_load, validate, \
+    validates_schema, ValidationError
+import yaml
+
+from . import limits, serve
+
+LIMITED_RESOURCES = [limits.UNITY, limits.COMPRESS, limits.TRANSFER]
+"""The resources a manifest can set limits on."""
+
+OPTION_COMMANDS = ["build", "release"]
+"""The commands that take '--option'."""
+
+DEFAULT_WORKERS = 2
+"""How many projects to run at once if the manifest doesn't say."""
+
+
+@dataclass
+class BatchProject:
+    """A project to run a command in.
+
+    Attributes:
+        path: The path of the project.
+        name: The name to show for the project in logs.
+        command: The command to run, i.e. 'build'.
+        options: The options to filter steps with.
+        args: Any other arguments to the command.
+    """
+    path: str
+    name: Optional[str] = None
+    command: str = "build"
+    options: List[str] = field(default_factory=list)
+    args: List[str] = field(default_factory=list)
+
+    def command_args(self) -> List[str]:
+        """Get the arguments to run the command with."""
+        option_args = []
+        for option in self.options:
+            option_args += ["--option", option]
+        return option_args + self.args
+
+
+@dataclass
+class BatchManifest:
+    """The projects to run, and how to run them.
+
+    Attributes:
+        projects: The projects to run, in the order to start them.
+        workers: How many projects to run at once.
+        limits: Limits on resources across every project, i.e. 'unity'.
+    """
+    projects: List[BatchProject]
+    workers: Optional[int] = None
+    limits: Dict[str, int] = field(default_factory=dict)
+
+
+class BatchProjectSchema(Schema):
+    path = fields.Str(required=True,
+                      allow_none=False,
+                      validate=validate.Length(min=1))
+    name = fields.Str(required=False, allow_none=False, missing=None)
+    command = fields.Str(required=False,
+                         allow_none=False,
+                         missing="build",
+                         validate=validate.OneOf(serve.JOB_COMMANDS))
+    options = fields.List(fields.Str(), required=False, missing=[])
+    args = fields.List(fields.Str(), required=False, missing=[])
+
+    @validates_schema
+    def validate_options(self, data, **kwargs):
+        if data.get("options") and data.get("command") not in OPTION_COMMANDS:
+            raise ValidationError(
+                f"Options can only be given to {', '.join(OPTION_COMMANDS)}",
+                "options")
+
+    @post_load
+    def make_batch_project(self, data, **kwargs):
+        return BatchProject(**data)
+
+
+class BatchManifestSchema(Schema):
+    projects = fields.List(fields.Nested(BatchProjectSchema),
+                           required=True,
+                           validate=validate.Length(min=1))
+    workers = fields.Int(required=False,
+                         allow_none=False,
+                         missing=None,
+                         validate=validate.Range(min=1))
+    limits = fields.Mapping(
+        keys=fields.Str(validate=validate.OneOf(LIMITED_RESOURCES)),
+        values=fields.Int(validate=validate.Range(min=1)),
+        required=False,
+        missing={})
+
+    @pre_load
+    def allow_list(self, data, **kwargs):
+        """A manifest can be just the list of projects."""
+        if isinstance(data, list):
+            return {"projects": data}
+        return data
+
+    @post_load
+    def make_batch_manifest(self, data, **kwargs):
+        return BatchManifest(**data)
+
+
+MANIFEST_SCHEMA = BatchManifestSchema()
+
+
+def load_manifest(manifest_path: str) -> Optional[BatchManifest]:
+    """Load a manifest. The paths of projects are relative to the manifest.
+
+    If an error occurred, it will print it and return None.
+    """
+    try:
+        with open(manifest_path, "r") as manifest_file:
+            manifest = MANIFEST_SCHEMA.load(
+                yaml.safe_load(manifest_file) or {})
+    except OSError as err:
+        logging.critical(f"Error opening manifest: {err}")
+        return None
+    except yaml.YAMLError as err:
+        logging.critical(f"Error in manifest: {err}")
+        return None
+    except ValidationError as err:
+        logging.critical(f"Error validating manifest '{manifest_path}': "
+                         f"{err.messages}")
+        return None
+
+    manifest_dir = path.dirname(path.abspath(manifest_path))
+    for project in manifest.projects:
+        project.path = path.normpath(path.join(manifest_dir, project.path))
+        if project.name is None:
+            project.name = path.basename(project.path)
+        if not path.isdir(project.path):
+            logging.critical(f"Project {project.path} in manifest doesn't "
+                             "exist")
+            return None
+    return manifest
+
+
+class _ProjectLogFilter(logging.Filter):
+    """Prefixes what's logged while a job runs with the name of its project,
+    so the output of projects running at once can be told apart."""
+    def __init__(self, job_queue: serve.JobQueue, names: Dict[str,
+                                                              str]) -> None:
+        super().__init__()
+        self.job_queue = job_queue
+        self.names = names
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        job = self.job_queue.current_job()
+        if job is not None and job.id in self.names \
+                and not getattr(record, "batch_prefixed", False):
+            record.msg = f"[{self.names[job.id]}] {record.getMessage()}"
+            record.args = None
+            record.batch_prefixed = True
+        return True
+
+
+def run(manifest: BatchManifest, run_job: serve.JobRunner,
+        workers: int) -> List[serve.Job]:
+    """Run the command of every project in a manifest, waiting for them all
+    to finish. Returns the job of each project, in the order of the
+    manifest."""
+    job_queue = serve.JobQueue(run_job, workers)
+    job_queue.ignore_thread()
+    log_filter = _ProjectLogFilter(job_queue, {})
+    handlers = list(logging.getLogger().handlers)
+    for handler in handlers:
+        handler.addFilter(log_filter)
+
+    jobs = []
+    try:
+        job_queue.start()
+        for project in manifest.projects:
+            job = job_queue.submit(project.command, project.path,
+                                   project.command_args())
+            log_filter.names[job.id] = project.name
+            jobs.append(job)
+        job_queue.join()
+    except KeyboardInterrupt:
+        logging.info("Stopping, waiting for running projects to finish...")
+    finally:
+        job_queue.stop()
+        for handler in handlers:
+            handler.removeFilter(log_filter)
+    return jobs
+
+
+def log_summary(manifest: BatchManifest, jobs: List[serve.Job]) -> None:
+    """Log how each project's job finished, and how long it took."""
+    width = max(len(project.name) for project in manifest.projects)
+    logging.info("Summary:")
+    for project, job in zip(manifest.projects, jobs):
+        line = f"  {project.name.ljust(width)}  {project.command:<7}  " \
+            f"{job.status}"
+        if job.started is not None and job.finished is not None:
+            line += f" in {job.finished - job.started:.1f}s"
+        if job.status == serve.FAILED:
+            logging.error(f"{line} (exit code {job.returncode})")
+        else:
+            logging.info(line)
@@ -0,0 +1,161 @@
+import functools
+import mmap
+import os
+import struct
+from typing import Optional, Tuple
+
+import pefile
+
+Version = Tuple[int, int, int, int]
+"""A version number, as (major, minor, build, patch)."""
+
+RT_VERSION = 16
+"""The resource type ID of version information in a PE file."""
+
+RESOURCE_DIRECTORY_INDEX = 2
+"""The index of the resource table in a PE file's data directories."""
+
+FIXED_FILE_INFO_SIGNATURE = struct.pack("<I", 0xFEEF04BD)
+"""The signature at the start of a VS_FIXEDFILEINFO structure."""
+
+
+def get_product_version(assembly_path: str) -> Optional[Version]:
+    """Get the product version of a PE file (i.e. a .NET assembly).
+
+    Results are cached by the path, size and modification time of the file,
+    so a file is only read again if it changed.
+
+    Returns None if the file didn't have a version.
+
+    Raises:
+        OSError: If the file couldn't be read.
+    """
+    st = os.stat(assembly_path)
+    return _get_product_version(assembly_path, st.st_size, st.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_product_version(assembly_path: str, size: int,
+                         mtime_ns: int) -> Optional[Version]:
+    if size == 0:
+        return None
+    with open(assembly_path, "rb") as assembly_file, \
+            mmap.mmap(assembly_file.fileno(), 0,
+                      access=mmap.ACCESS_READ) as data:
+        try:
+            version = _read_product_version(data)
+        except (struct.error, ValueError):
+            version = None
+
+    # if we couldn't find the version ourselves, let pefile have a go, only
+    # parsing what it needs to
+    if version is None:
+        version = _read_product_version_pefile(assembly_path)
+    return version
+
+
+def _read_product_version(data: mmap.mmap) -> Optional[Version]:
+    """Find the product version in the VS_FIXEDFILEINFO of a PE file by
+    walking straight to its version resource, without parsing the rest of the
+    file."""
+    if data[:2] != b"MZ":
+        return None
+    pe_offset = _u32(data, 0x3C)
+    if data[pe_offset:pe_offset + 4] != b"PE\0\0":
+        return None
+
+    coff_offset = pe_offset + 4
+    num_sections = _u16(data, coff_offset + 2)
+    optional_header_size = _u16(data, coff_offset + 16)
+    optional_offset = coff_offset + 20
+    magic = _u16(data, optional_offset)
+    if magic == 0x10B:  # PE32
+        num_dirs_offset = optional_offset + 92
+    elif magic == 0x20B:  # PE32+
+        num_dirs_offset = optional_offset + 108
+    else:
+        return None
+    if _u32(data, num_dirs_offset) <= RESOURCE_DIRECTORY_INDEX:
+        return None
+    resource_rva = _u32(data,
+                        num_dirs_offset + 4 + RESOURCE_DIRECTORY_INDEX * 8)
+    if resource_rva == 0:
+        return None
+
+    sections_offset = optional_offset + optional_header_size
+    sections = []
+    for i in range(num_sections):
+        section_offset = sections_offset + i * 40
+        vsize, vaddress, raw_size, raw_offset = struct.unpack_from(
+            "<IIII", data, section_offset + 8)
+        sections.append((vaddress, max(vsize, raw_size), raw_offset))
+
+    def rva_to_offset(rva: int) -> int:
+        for virtual_address, size, raw_offset in sections:
+            if virtual_address <= rva < virtual_address + size:
+                return rva - virtual_address + raw_offset
+        raise ValueError(f"RVA {rva:#x} not in any section")
+
+    # the resource table is a tree of type -> name -> language -> data
+    resource_offset = rva_to_offset(resource_rva)
+    entry = _find_resource_entry(data, resource_offset, RT_VERSION)
+    for _ in range(2):
+        if entry is None or not entry & 0x80000000:
+            return None
+        entry = _find_resource_entry(data,
+                                     resource_offset + (entry & 0x7FFFFFFF))
+    if entry is None or entry & 0x80000000:
+        return None
+
+    data_rva, data_size = struct.unpack_from("<II", data,
+                                             resource_offset + entry)
+    data_offset = rva_to_offset(data_rva)
+    info_offset = data.find(FIXED_FILE_INFO_SIGNATURE, data_offset,
+                            data_offset + data_size)
+    if info_offset == -1:
+        return None
+
+    version_ms, version_ls = struct.unpack_from("<II", data, info_offset + 16)
+    return (version_ms >> 16, version_ms & 0xFFFF, version_ls >> 16,
+            version_ls & 0xFFFF)
+
+
+def _find_resource_entry(data: mmap.mmap,
+                         directory_offset: int,
+                         entry_id: Optional[int] = None) -> Optional[int]:
+    """Find an entry in a resource directory, returning its OffsetToData. If
+    no ID is given, the first entry is returned."""
+    num_named, num_ids = struct.unpack_from("<HH", data, directory_offset + 12)
+    for i in range(num_named + num_ids):
+        name, offset = struct.unpack_from("<II", data,
+                                          directory_offset + 16 + i * 8)
+        if entry_id is None or name == entry_id:
+            return offset
+    return None
+
+
+def _read_product_version_pefile(assembly_path: str) -> Optional[Version]:
+    try:
+        pe = pefile.PE(assembly_path, fast_load=True)
+    except pefile.PEFormatError:
+        return None
+    try:
+        pe.parse_data_directories(directories=[
+            pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_RESOURCE"]
+        ])
+        if not hasattr(pe, "VS_FIXEDFILEINFO"):
+            return None
+        ver_info = pe.VS_FIXEDFILEINFO[0]
+        ver_ms = ver_info.ProductVersionMS
+        ver_ls = ver_info.ProductVersionLS
+        return (ver_ms >> 16, ver_ms & 0xFFFF, ver_ls >> 16, ver_ls & 0xFFFF)
+    finally:
+        pe.close()
+
+
+def _u16(data: mmap.mmap, offset: int) -> int:
+    return struct.unpack_from("<H", data, offset)[0]
+
+
+def _u32(data: mmap.mmap, offset: int) -> int:
+    return struct.unpack_from("<I", data, offset)[0]
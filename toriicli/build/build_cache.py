@@ -0,0 +1,137 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+from os import path
+import shutil
+import tempfile
+from typing import Any, List, Mapping
+
+from . import detect_unity
+from .build_def import BuildDef, BUILD_DEFS_FILENAME
+from .. import cleanup, hashing
+from ..storage import make_provider, provider
+
+FINGERPRINT_FOLDERS = ["Assets", "Packages", "ProjectSettings"]
+"""The folders in a Unity project that are inputs to a build."""
+
+ARCHIVE_FORMAT = "gztar"
+"""The shutil archive format cached builds are stored in. Tar keeps the
+permission bits of executables intact."""
+
+ARCHIVE_EXTENSION = ".tar.gz"
+"""The file extension of archives in ARCHIVE_FORMAT."""
+
+
+def fingerprint(project_path: str, executable_path: str,
+                execute_method: str) -> str:
+    """Hash everything that goes into a build of a project, so we can tell
+    when nothing has changed since a previous build.
+
+    This covers the contents of the project's input folders, the version of
+    Unity being used, the method being executed, and the generated build defs
+    (so it must be called after they are generated).
+    """
+    digest = hashlib.sha256()
+    unity_version = detect_unity.get_editor_version(executable_path) \
+        or detect_unity.get_project_version(project_path) or executable_path
+    digest.update(f"{unity_version}\0{execute_method}\0".encode("utf-8"))
+    with open(path.join(project_path, BUILD_DEFS_FILENAME),
+              "rb") as build_defs_file:
+        digest.update(build_defs_file.read())
+
+    input_files = _gather_input_files(project_path)
+    with ThreadPoolExecutor() as executor:
+        file_hashes = executor.map(
+            lambda rel_path: hashing.hash_file(
+                path.join(project_path, rel_path)), input_files)
+        for rel_path, file_hash in zip(input_files, file_hashes):
+            digest.update(f"{rel_path}\0{file_hash}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _gather_input_files(project_path: str) -> List[str]:
+    """Get the sorted paths of every input file, relative to the project."""
+    input_files = []
+    for folder in FINGERPRINT_FOLDERS:
+        for root, _, files in os.walk(path.join(project_path, folder)):
+            for file in files:
+                rel_path = path.relpath(path.join(root, file), project_path)
+                input_files.append(rel_path.replace(os.sep, "/"))
+    return sorted(input_files)
+
+
+class BuildCache:
+    """Caches the output folders of Unity builds in a storage provider, keyed
+    by a fingerprint of the build's inputs.
+
+    Attributes:
+        provider: Where the cached builds are stored.
+        fingerprint: The fingerprint of the inputs of the current build.
+    """
+    def __init__(self, provider: provider.StorageProvider,
+                 fingerprint: str) -> None:
+        self.provider = provider
+        self.fingerprint = fingerprint
+
+    def restore(self, output_folder: str, build_defs: List[BuildDef]) -> bool:
+        """Restore the output of each build def into the build output folder.
+
+        Returns False (and restores nothing) unless every target was cached.
+        """
+        keys = [self._key(bd) for bd in build_defs]
+        if not all(self.provider.exists(key) for key in keys):
+            logging.info(f"No cached build for fingerprint {self.fingerprint}")
+            return False
+
+        for bd, key in zip(build_defs, keys):
+            logging.info(f"Restoring cached build for target {bd.target}...")
+            target_folder = path.join(output_folder, bd.target)
+            cleanup.remove_tree(target_folder)
+            with tempfile.TemporaryDirectory() as temp_dir:
+                archive_path = path.join(temp_dir, path.basename(key))
+                self.provider.retrieve(key, archive_path)
+                shutil.unpack_archive(archive_path, target_folder,
+                                      ARCHIVE_FORMAT)
+        return True
+
+    def save(self, output_folder: str, build_defs: List[BuildDef]) -> None:
+        """Store the output of each build def in the cache."""
+        for bd in build_defs:
+            target_folder = path.join(output_folder, bd.target)
+            if not path.isdir(target_folder):
+                logging.warning(f"Not caching missing build for {bd.target}")
+                continue
+
+            logging.info(f"Caching build for target {bd.target}...")
+            with tempfile.TemporaryDirectory() as temp_dir:
+                archive_base = path.join(temp_dir, bd.target)
+                archive_path = shutil.make_archive(archive_base,
+                                                   ARCHIVE_FORMAT,
+                                                   root_dir=target_folder)
+                with open(archive_path, "rb") as archive_file:
+                    self.provider.store(archive_file, self._key(bd))
+
+    def _key(self, bd: BuildDef) -> str:
+        return f"{self.fingerprint}/{bd.target}{ARCHIVE_EXTENSION}"
+
+
+def from_config(using: Mapping[str, Any], project_path: str,
+                executable_path: str, execute_method: str) -> BuildCache:
+    """Make a BuildCache for a project from the 'build_cache' config section.
+
+    Raises:
+        ValueError: If the config had no backend, or an invalid backend.
+    """
+    using = dict(using)
+    backend = using.pop("backend", None)
+    if backend is None:
+        raise ValueError("Missing 'backend' in 'build_cache' config")
+    for k, v in using.items():
+        if isinstance(v, str):
+            using[k] = path.expandvars(v)
+
+    logging.info("Fingerprinting build inputs...")
+    return BuildCache(
+        make_provider(backend, **using),
+        fingerprint(project_path, executable_path, execute_method))
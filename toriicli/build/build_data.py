@@ -4,8 +4,7 @@ import os
 from os import path
 from typing import List, Optional
 
-import pefile
-
+from . import assembly_version
 from .build_def import BuildDef
 
 BUILD_NUMBER_FILENAME = "buildnumber.txt"
@@ -48,24 +47,21 @@ def _get_build_number(build_folder: str, build_def: BuildDef) -> Optional[str]:
 
     assembly_path = path.join(build_folder, assembly_path)
 
-    # we're going whole-hog here and loading the PE file itself to figure out
-    # the version number... writing it to a TXT file during the Unity build
-    # wasn't producing consistent version numbers as it seemed to be building
-    # the assembly twice and only writing the number after the first build
+    # we're reading the version number from the PE file itself... writing it
+    # to a TXT file during the Unity build wasn't producing consistent version
+    # numbers as it seemed to be building the assembly twice and only writing
+    # the number after the first build
     try:
-        pe = pefile.PE(assembly_path)
-        ver_info = pe.VS_FIXEDFILEINFO[0]
-        ver_ms = ver_info.ProductVersionMS
-        ver_ls = ver_info.ProductVersionLS
-        major = ver_ms >> 16  # version numbers are 2 bytes each - grab em like this
-        minor = ver_ms & 0xFFFF
-        build = ver_ls >> 16
-        patch = ver_ls & 0xFFFF
-        return f"{major}.{minor}.{build}.{patch}"
+        version = assembly_version.get_product_version(assembly_path)
     except OSError as err:
         logging.error(f"Could not open built assembly: {err}")
         return None
 
+    if version is None:
+        logging.error(f"Built assembly {assembly_path} had no version")
+        return None
+    return ".".join(str(part) for part in version)
+
 
 def collect_finished_build(build_folder: str,
                            build_def: BuildDef) -> Optional[BuildData]:
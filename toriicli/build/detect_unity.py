@@ -1,68 +1,280 @@
+from dataclasses import dataclass
+import fnmatch
 import json
+import logging
 import os
 from os import path
 import platform
+import re
 import shutil
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+
+from .. import config
 
 DEFAULT_EDITOR_INSTALL_PATH = "C:/Program Files/Unity/Hub/Editor"
 
+UNITY_VERSION_REGEX = re.compile(r"\d+\.\d+\.\d+[abfpx]\d+")
+"""Regex matching a Unity version string, i.e. '2019.4.4f1'."""
+
+VERSION_PARTS_REGEX = re.compile(r"(\d+)\.(\d+)\.(\d+)([abfpx])(\d+)")
+"""Regex for splitting a Unity version string into its parts."""
+
+RELEASE_TYPE_ORDER = {"x": 0, "a": 1, "b": 2, "f": 3, "p": 4}
+"""How Unity release types sort, experimental builds first and patch releases
+last."""
+
+PROJECT_VERSION_FILE = path.join("ProjectSettings", "ProjectVersion.txt")
+"""The file in a Unity project containing the editor version it uses."""
+
+INDEX_FILE_NAME = "unity_editors.json"
+"""The name of the file the editor index is cached in."""
+
+INDEX_VERSION = 1
+"""Bumped when the format of the cached index changes, to invalidate it."""
+
+VersionKey = Tuple[int, int, int, int, int]
+"""A parsed Unity version, as (year, minor, patch, release type, build)."""
+
+
+@dataclass
+class UnityEditor:
+    """An installed Unity editor.
+
+    Attributes:
+        version: The version of the editor, i.e. '2019.4.4f1'.
+        path: The path to the editor executable.
+    """
+    version: str
+    path: str
+
+    @property
+    def version_key(self) -> VersionKey:
+        return parse_version(self.version)
+
+
+def parse_version(version: str) -> VersionKey:
+    """Parse a Unity version string into a tuple that sorts in release order.
+
+    Raises:
+        ValueError: If the version string wasn't a Unity version.
+    """
+    match = VERSION_PARTS_REGEX.fullmatch(version)
+    if match is None:
+        raise ValueError(f"'{version}' is not a Unity version")
+    year, minor, patch, release_type, build = match.groups()
+    return (int(year), int(minor), int(patch),
+            RELEASE_TYPE_ORDER[release_type], int(build))
+
+
+def version_matches(version: str, query: str) -> bool:
+    """Check whether a version matches a version query. A query can be an
+    exact version ('2019.4.4f1'), a prefix of one ('2019.4'), or a wildcard
+    pattern ('2019.4.*', '2020.*')."""
+    if any(c in query for c in "*?["):
+        return fnmatch.fnmatchcase(version, query)
+    if not version.startswith(query):
+        return False
+    # make sure '2019.4.1' doesn't match '2019.4.10f1'
+    rest = version[len(query):]
+    return rest == "" or not (rest[0].isdigit() and query[-1].isdigit())
+
 
 def find_unity_executable(
         preferred_version: Optional[str] = None) -> Optional[str]:
     """Find the path to the unity executable.
 
     Args:
-        preferred_version: The preferred version of Unity to use.
+        preferred_version: The preferred version of Unity to use. Can be a
+            version query, in which case the newest matching version is used.
 
     Returns:
         str: The path to the Unity executable if it was found.
         None: if an executable could not be found.
     """
+    editor = find_editor(preferred_version)
+    if editor is not None:
+        return editor.path
+
+    # fall back to whatever is on the PATH if nothing is installed via Unity
+    # Hub, as long as we weren't asked for a specific version
+    if preferred_version is None:
+        return shutil.which("unity") or shutil.which("Unity")
+    return None
+
+
+def find_editor(query: Optional[str] = None) -> Optional[UnityEditor]:
+    """Find the newest installed Unity editor matching a version query. See
+    version_matches for the format of queries. If no query is given, the
+    newest installed editor is returned.
+
+    Returns None if no installed editors matched.
+    """
+    editors = [
+        editor for editor in list_editors()
+        if query is None or version_matches(editor.version, query)
+    ]
+    if len(editors) == 0:
+        return None
+    return max(editors, key=lambda editor: editor.version_key)
+
+
+def list_editors(refresh: bool = False) -> List[UnityEditor]:
+    """List the Unity editors installed in Unity Hub's install locations,
+    oldest first.
+
+    The list is cached, and only rescanned when an install location changes.
+
+    Args:
+        refresh: Rescan the install locations even if they haven't changed.
+    """
+    folders = _install_folders()
+    mtimes = {folder: _mtime(folder) for folder in folders}
+    index_path = path.join(config.user_cache_dir(), INDEX_FILE_NAME)
+
+    if not refresh:
+        editors = _load_index(index_path, mtimes)
+        if editors is not None:
+            return editors
+
+    editors = []
+    for folder in folders:
+        editors.extend(_scan_unity_versions(folder))
+    editors.sort(key=lambda editor: editor.version_key)
+    _save_index(index_path, mtimes, editors)
+    return editors
+
+
+def get_editor_version(executable_path: str) -> Optional[str]:
+    """Get the version of a Unity editor from the path to its executable.
+    Unity Hub installs each editor in a folder named after its version.
+
+    Returns None if the path did not contain a version.
+    """
+    versions = UNITY_VERSION_REGEX.findall(executable_path)
+    return versions[-1] if len(versions) > 0 else None
+
+
+def get_project_version(project_path: str) -> Optional[str]:
+    """Get the version of Unity a project was last opened with.
+
+    Returns None if the project didn't have a version file.
+    """
+    try:
+        with open(path.join(project_path, PROJECT_VERSION_FILE),
+                  "r") as version_file:
+            versions = UNITY_VERSION_REGEX.findall(version_file.read())
+            return versions[0] if len(versions) > 0 else None
+    except OSError:
+        return None
+
+
+def _install_folders() -> List[str]:
+    """Get the folders Unity Hub might have installed editors in on this
+    platform."""
     system = platform.system()
     if system == "Windows":
-        return _find_unity_windows(preferred_version)
+        default_folder = DEFAULT_EDITOR_INSTALL_PATH
+        hub_data = path.join(os.getenv("APPDATA", ""), "UnityHub")
+    elif system == "Darwin":
+        default_folder = "/Applications/Unity/Hub/Editor"
+        hub_data = path.expanduser("~/Library/Application Support/UnityHub")
     else:
-        return _find_unity_posix()
+        default_folder = path.expanduser("~/Unity/Hub/Editor")
+        hub_data = path.join(
+            os.getenv("XDG_CONFIG_HOME") or path.expanduser("~/.config"),
+            "UnityHub")
 
+    folders = [default_folder]
+    secondary_folder = _read_secondary_install_path(
+        path.join(hub_data, "secondaryInstallPath.json"))
+    if secondary_folder is not None and secondary_folder not in folders:
+        folders.append(secondary_folder)
+    return folders
 
-def _find_unity_windows(
-        preferred_version: Optional[str] = None) -> Optional[str]:
-    appdata_path = os.getenv("APPDATA")
-    path_to_unity_hub_data = path.join(appdata_path, "UnityHub")
-    secondary_install_loc = path.join(path_to_unity_hub_data,
-                                      "secondaryInstallPath.json")
-
-    # check to see if we've configged a secondary install location, if we have
-    # then use that to find editor versions
-    has_secondary_install = os.stat(secondary_install_loc).st_size > 0
-    editor_install_path = DEFAULT_EDITOR_INSTALL_PATH
-    if has_secondary_install:
-        with open(secondary_install_loc, 'r') as f_handle:
+
+def _read_secondary_install_path(file_path: str) -> Optional[str]:
+    """Read the secondary install location configured in Unity Hub, if there
+    is one."""
+    try:
+        with open(file_path, "r") as f_handle:
             secondary_install_path = json.load(f_handle)
-            if isinstance(secondary_install_path,
-                          str) and len(secondary_install_path) > 0:
-                editor_install_path = secondary_install_path
+    except (OSError, ValueError):
+        return None
+    if isinstance(secondary_install_path,
+                  str) and len(secondary_install_path) > 0:
+        return secondary_install_path
+    return None
 
-    return _scan_unity_versions(editor_install_path, preferred_version)
 
+def _editor_executable(editor_folder: str) -> str:
+    """Get the path to the executable of an editor installed in a folder."""
+    system = platform.system()
+    if system == "Windows":
+        return path.join(editor_folder, "Editor", "Unity.exe")
+    elif system == "Darwin":
+        return path.join(editor_folder, "Unity.app", "Contents", "MacOS",
+                         "Unity")
+    return path.join(editor_folder, "Editor", "Unity")
 
-def _scan_unity_versions(folder: str,
-                         preferred_version: Optional[str] = None
-                         ) -> Optional[str]:
-    """Scan a folder of unity versions for a specific version."""
-    subdirs = [
-        path.join(folder, name) for name in os.listdir(folder)
-        if path.isdir(path.join(folder, name))
-    ]
-    if preferred_version is None:
-        return path.join(subdirs[0], "Editor", "Unity.exe")
-    for editor in subdirs:
-        if preferred_version in editor:
-            return path.join(editor, "Editor", "Unity.exe")
-    return None
+
+def _scan_unity_versions(folder: str) -> List[UnityEditor]:
+    """Scan a folder of unity versions for installed editors."""
+    editors = []
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return editors
+    for entry in entries:
+        if not entry.is_dir() or \
+                VERSION_PARTS_REGEX.fullmatch(entry.name) is None:
+            continue
+        executable = _editor_executable(entry.path)
+        if path.isfile(executable):
+            editors.append(UnityEditor(entry.name, executable))
+    return editors
+
+
+def _mtime(folder: str) -> Optional[int]:
+    try:
+        return os.stat(folder).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _load_index(
+        index_path: str,
+        mtimes: Dict[str, Optional[int]]) -> Optional[List[UnityEditor]]:
+    """Load the cached editor index. Returns None if there wasn't one, or it
+    was out of date."""
+    try:
+        with open(index_path, "r") as index_file:
+            index = json.load(index_file)
+        if index.get("version") != INDEX_VERSION \
+                or index.get("folders") != mtimes:
+            return None
+        editors = [
+            UnityEditor(version, exe) for version, exe in index["editors"]
+        ]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    # an editor could have been removed without its install location changing
+    if not all(path.isfile(editor.path) for editor in editors):
+        return None
+    return editors
 
 
-def _find_unity_posix() -> Optional[str]:
-    # very very naive solution...
-    return shutil.which("unity")
\ No newline at end of file
+def _save_index(index_path: str, mtimes: Dict[str, Optional[int]],
+                editors: List[UnityEditor]) -> None:
+    index = {
+        "version": INDEX_VERSION,
+        "folders": mtimes,
+        "editors": [[editor.version, editor.path] for editor in editors]
+    }
+    try:
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(tmp_path, index_path)
+    except OSError as err:
+        logging.debug(f"Unable to cache Unity editor index: {err}")
@@ -0,0 +1,203 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+from os import path
+import tarfile
+import tempfile
+from typing import Any, List, Mapping, Optional
+
+from . import detect_unity
+from .build_def import BuildDef
+from .. import hashing
+from ..storage import make_provider, provider
+
+LIBRARY_FOLDER = "Library"
+"""The folder Unity keeps its imported assets in."""
+
+LOOSE_FILES_PART = "_files"
+"""The name of the archive part holding files directly inside Library."""
+
+COMPRESSION_EXTENSIONS = {"gz": ".tar.gz", "bz2": ".tar.bz2", "xz": ".tar.xz"}
+"""Map tarfile compression names to the extension of the archive."""
+
+
+def fingerprint(project_path: str) -> str:
+    """Hash the things that decide what ends up in the Library folder: the
+    project's package manifest, and the metadata of every asset."""
+    digest = hashlib.sha256()
+    for file_name in ["manifest.json", "packages-lock.json"]:
+        manifest_path = path.join(project_path, "Packages", file_name)
+        if path.exists(manifest_path):
+            digest.update(hashing.hash_file(manifest_path).encode("utf-8"))
+
+    # use the same paths on every OS, so they sort and hash the same
+    meta_files = []
+    for root, _, files in os.walk(path.join(project_path, "Assets")):
+        meta_files += [
+            path.relpath(path.join(root, f),
+                         project_path).replace(os.sep, "/") for f in files
+            if f.endswith(".meta")
+        ]
+    meta_files.sort()
+    meta_paths = [path.join(project_path, f) for f in meta_files]
+    with ThreadPoolExecutor() as executor:
+        for rel_path, meta_hash in zip(
+                meta_files, executor.map(hashing.hash_file, meta_paths)):
+            digest.update(f"{rel_path}\0{meta_hash}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class LibraryCache:
+    """Saves and restores a project's Library folder to and from a storage
+    provider, so fresh checkouts don't have to reimport every asset.
+
+    The Library folder is split into parts (one per top-level folder) that
+    are compressed and transferred in parallel. Saved caches are keyed by the
+    Unity version, build targets, and a fingerprint of the project. If there
+    is no cache for the exact fingerprint, the most recently saved cache for
+    the same Unity version and targets is restored instead.
+
+    Attributes:
+        provider: Where the cached Library folders are stored.
+        prefix: The key prefix for this Unity version and set of targets.
+        fingerprint: The fingerprint of the project.
+        compression: The tarfile compression to use ('gz', 'bz2', 'xz', or
+            '' for none).
+    """
+    def __init__(self,
+                 provider: provider.StorageProvider,
+                 prefix: str,
+                 fingerprint: str,
+                 compression: str = "gz") -> None:
+        self.provider = provider
+        self.prefix = prefix
+        self.fingerprint = fingerprint
+        self.compression = compression
+
+    def restore(self, project_path: str) -> bool:
+        """Restore the Library folder into a project. Returns whether a
+        cache was found to restore."""
+        fingerprint = self.fingerprint
+        if not self.provider.exists(self._index_key(fingerprint)):
+            fingerprint = self._latest_fingerprint()
+            if fingerprint is None:
+                logging.info("No cached Library folder found")
+                return False
+            logging.info("No cached Library folder for this project, "
+                         "restoring the latest one")
+
+        index = json.loads(self._retrieve_text(self._index_key(fingerprint)))
+        library_path = path.join(project_path, LIBRARY_FOLDER)
+        os.makedirs(library_path, exist_ok=True)
+        logging.info(f"Restoring {len(index['parts'])} parts of Library "
+                     f"folder from cache {fingerprint}...")
+        with ThreadPoolExecutor() as executor:
+            list(
+                executor.map(lambda key: self._restore_part(key, library_path),
+                             index["parts"]))
+        return True
+
+    def save(self, project_path: str) -> None:
+        """Save the Library folder of a project to the cache, if it hasn't
+        been saved with this fingerprint already."""
+        if self.provider.exists(self._index_key(self.fingerprint)):
+            logging.info("Library folder already cached")
+            return
+
+        library_path = path.join(project_path, LIBRARY_FOLDER)
+        if not path.isdir(library_path):
+            logging.warning("Not caching missing Library folder")
+            return
+
+        parts = {}
+        for entry in os.scandir(library_path):
+            part = entry.name if entry.is_dir() else LOOSE_FILES_PART
+            parts.setdefault(part, []).append(entry.name)
+
+        logging.info(f"Caching {len(parts)} parts of Library folder...")
+        with ThreadPoolExecutor() as executor:
+            keys = list(
+                executor.map(
+                    lambda part: self._save_part(part, parts[part],
+                                                 library_path), parts))
+
+        # write the index, then point to it as the latest, so neither can
+        # refer to parts that haven't been uploaded yet
+        self.provider.store(json.dumps({"parts": keys}),
+                            self._index_key(self.fingerprint))
+        self.provider.store(self.fingerprint, self._latest_key())
+
+    def _save_part(self, part: str, names: List[str],
+                   library_path: str) -> str:
+        extension = COMPRESSION_EXTENSIONS.get(self.compression, ".tar")
+        key = f"{self.prefix}/{self.fingerprint}/{part}{extension}"
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive_path = path.join(temp_dir, part + extension)
+            with tarfile.open(archive_path,
+                              f"w:{self.compression}") as archive:
+                for name in names:
+                    archive.add(path.join(library_path, name), arcname=name)
+            with open(archive_path, "rb") as archive_file:
+                self.provider.store(archive_file, key)
+        return key
+
+    def _restore_part(self, key: str, library_path: str) -> None:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive_path = path.join(temp_dir, key.rsplit("/", 1)[-1])
+            self.provider.retrieve(key, archive_path)
+            with tarfile.open(archive_path, "r:*") as archive:
+                if hasattr(tarfile, "data_filter"):
+                    archive.extractall(library_path, filter="data")
+                else:
+                    archive.extractall(library_path)
+
+    def _latest_fingerprint(self) -> Optional[str]:
+        if not self.provider.exists(self._latest_key()):
+            return None
+        return self._retrieve_text(self._latest_key()).strip()
+
+    def _retrieve_text(self, key: str) -> str:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = path.join(temp_dir, "blob")
+            self.provider.retrieve(key, file_path)
+            with open(file_path, "r") as file_handle:
+                return file_handle.read()
+
+    def _index_key(self, fingerprint: str) -> str:
+        return f"{self.prefix}/{fingerprint}/index.json"
+
+    def _latest_key(self) -> str:
+        return f"{self.prefix}/latest"
+
+
+def from_config(using: Mapping[str,
+                               Any], project_path: str, executable_path: str,
+                build_defs: List[BuildDef]) -> LibraryCache:
+    """Make a LibraryCache for a project from the 'library_cache' config
+    section.
+
+    Raises:
+        ValueError: If the config had no backend, or an invalid backend or
+            compression.
+    """
+    using = dict(using)
+    backend = using.pop("backend", None)
+    if backend is None:
+        raise ValueError("Missing 'backend' in 'library_cache' config")
+    compression = using.pop("compression", "gz") or ""
+    if compression != "" and compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(
+            f"Invalid 'compression' in 'library_cache' config: {compression}")
+    for k, v in using.items():
+        if isinstance(v, str):
+            using[k] = path.expandvars(v)
+
+    unity_version = detect_unity.get_editor_version(executable_path) \
+        or detect_unity.get_project_version(project_path) or "unknown"
+    targets = "+".join(sorted(bd.target for bd in build_defs))
+    logging.info("Fingerprinting project for Library cache...")
+    return LibraryCache(make_provider(backend, **using),
+                        f"library/{unity_version}/{targets}",
+                        fingerprint(project_path), compression)
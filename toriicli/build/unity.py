@@ -1,13 +1,18 @@
 import logging
 from os import path
-import subprocess
-from typing import Tuple
+from typing import Optional, Tuple
+
+from . import unity_log
+from .. import process
 
 UNITY_ARGS = "-batchmode -nographics -quit -logFile - " + \
     "-executeMethod {execute_method} -projectPath {project_path}"
 """The args to give to Unity to build from the command line. Needs execute_method
 and project_path to be substituted in via a .format()."""
 
+DEFAULT_LOG_PATH = path.join("Logs", "toriicli-build.log")
+"""Where to write Unity's log to by default, relative to the project."""
+
 
 def build_args(execute_method: str, project_path: str) -> str:
     """Build the command-line args to supply to Unity."""
@@ -20,29 +25,55 @@ class UnityBuilder:
 
     Attributes:
         executable_path (str): The path to the Unity executable.
+        log (UnityLogCapture): The captured log of the last build.
+        result (ProcessResult): The result of running Unity for the last
+            build.
     """
     def __init__(self, executable_path: str) -> None:
         self._ensure_executable_exists(executable_path)
         self.executable_path = executable_path
+        self.log = None
+        self.result = None
 
-    def build(self, project_path: str,
-              execute_method: str) -> Tuple[bool, int]:
+    def build(self,
+              project_path: str,
+              execute_method: str,
+              log_path: Optional[str] = None,
+              timeout: Optional[float] = None,
+              limits: process.ResourceLimits = None) -> Tuple[bool, int]:
         """Attempt to build a project at a given path.
 
+        Unity's output is written to log_path (by default in the project's
+        Logs folder), and only progress and errors are logged. If the build
+        fails, the last lines of the output are logged too. If timeout is
+        given, Unity is killed if it runs for longer than that many seconds,
+        and if limits are given, they're applied to Unity.
+
         Returns a 2-tuple indicating whether the build was a success, and the
         exit code of Unity.
         """
         unity_args = build_args(execute_method, project_path)
+        log_path = log_path or path.join(project_path, DEFAULT_LOG_PATH)
         logging.info(f"Running Unity with args: '{unity_args}'")
-        proc = subprocess.Popen([self.executable_path] + unity_args.split(" "),
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-        for line in iter(proc.stdout.readline, b""):
-            logging.info(f"--> {line.decode('utf-8').rstrip()}")
+        logging.info(f"Writing Unity log to {log_path}")
+        with unity_log.UnityLogCapture(log_path) as capture:
+            result = process.run([self.executable_path] +
+                                 unity_args.split(" "),
+                                 on_output=capture.feed,
+                                 timeout=timeout,
+                                 limits=limits)
+        self.log = capture
+        self.result = result
 
-        proc.wait()
+        timings = ", ".join(f"{timing.phase} {timing.duration:.1f}s"
+                            for timing in capture.phase_totals())
+        if timings:
+            logging.info(f"Unity phase timings: {timings}")
+        if not result.success:
+            logging.error("Unity build failed, last lines of log:\n" +
+                          "\n".join(capture.tail()))
 
-        return proc.returncode == 0, proc.returncode
+        return result.success, result.returncode
 
     def _ensure_executable_exists(self, executable_path: str):
         if not path.exists(executable_path):
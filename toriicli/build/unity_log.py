@@ -0,0 +1,151 @@
+from collections import deque
+from dataclasses import dataclass
+import logging
+import os
+from os import path
+import time
+from typing import Callable, List, Optional
+
+LOG_BUFFER_SIZE = 1024 * 1024
+"""How many bytes of Unity's log to buffer before writing to the log file."""
+
+DEFAULT_TAIL_LINES = 200
+"""How many of the most recent lines of the log to keep in memory."""
+
+PHASE_MARKERS = [
+    ("import", (b"Start importing ", b"Refreshing native plugins",
+                b"Asset Pipeline Refresh")),
+    ("compile", (b"- Starting compile ", b"[ScriptCompilation]",
+                 b"CompileScripts")),
+    ("build", (b"Building Player", b"Building player",
+               b"DisplayProgressbar: Building")),
+]
+"""Prefixes of lines in Unity's log that mark the start of each build phase.
+Unity goes back and forth between phases (i.e. importing assets again after
+compiling scripts), so phases can occur more than once."""
+
+NOTABLE_MARKERS = (b"error CS", b"Build Finished, Result:",
+                   b"*** Completed 'Build.Player")
+"""Substrings of lines in Unity's log that should always be shown."""
+
+ALL_MARKERS = [m for _, markers in PHASE_MARKERS
+               for m in markers] + list(NOTABLE_MARKERS)
+
+
+@dataclass
+class ProgressEvent:
+    phase: str
+    elapsed: float
+
+
+@dataclass
+class PhaseTiming:
+    phase: str
+    started: float
+    duration: Optional[float]
+
+
+class UnityLogCapture:
+    """Captures the output of Unity without logging every line of it.
+
+    The raw output is written to a log file with large buffered writes, and
+    only the most recent lines are kept in memory to report when a build
+    fails. Lines marking a new build phase (importing, compiling, building)
+    are turned into progress events, and the time spent in each phase is
+    recorded.
+
+    Use as a context manager, calling feed() with output as it arrives.
+
+    Attributes:
+        log_path: The file the raw output is written to.
+        phases: How long was spent in each phase, in the order they happened.
+        on_progress: Called with a ProgressEvent whenever a phase starts.
+    """
+    def __init__(
+            self,
+            log_path: str,
+            tail_lines: int = DEFAULT_TAIL_LINES,
+            on_progress: Optional[Callable[[ProgressEvent],
+                                           None]] = None) -> None:
+        self.log_path = log_path
+        self.phases: List[PhaseTiming] = []
+        self.on_progress = on_progress or _log_progress
+        self._tail = deque(maxlen=tail_lines)
+        self._partial_line = b""
+        self._log_file = None
+        self._start_time = None
+
+    def __enter__(self) -> "UnityLogCapture":
+        os.makedirs(path.dirname(self.log_path), exist_ok=True)
+        self._log_file = open(self.log_path, "wb", buffering=LOG_BUFFER_SIZE)
+        self._start_time = time.monotonic()
+        return self
+
+    def __exit__(self, *args) -> None:
+        if self._partial_line:
+            self._process_lines([self._partial_line])
+            self._partial_line = b""
+        self._end_phase()
+        self._log_file.close()
+
+    def feed(self, chunk: bytes) -> None:
+        """Process a chunk of output from Unity."""
+        self._log_file.write(chunk)
+        lines = (self._partial_line + chunk).split(b"\n")
+        self._partial_line = lines.pop()
+        self._process_lines(lines)
+
+    def tail(self) -> List[str]:
+        """Get the most recent lines of output."""
+        return [
+            line.decode("utf-8", errors="replace").rstrip()
+            for line in self._tail
+        ]
+
+    def phase_totals(self) -> List[PhaseTiming]:
+        """Get the total time spent in each phase, summing up every time the
+        phase occurred."""
+        totals = {}
+        for timing in self.phases:
+            if timing.phase not in totals:
+                totals[timing.phase] = PhaseTiming(timing.phase,
+                                                   timing.started, 0)
+            totals[timing.phase].duration += timing.duration or 0
+        return list(totals.values())
+
+    def _process_lines(self, lines: List[bytes]) -> None:
+        self._tail.extend(lines)
+
+        # only look at individual lines if the chunk has anything of interest
+        joined = b"\n".join(lines)
+        if not any(marker in joined for marker in ALL_MARKERS):
+            return
+
+        for line in lines:
+            stripped = line.strip()
+            if any(marker in stripped for marker in NOTABLE_MARKERS):
+                logging.info(f"--> {stripped.decode('utf-8', 'replace')}")
+            for phase, markers in PHASE_MARKERS:
+                if stripped.startswith(markers):
+                    self._start_phase(phase)
+                    break
+
+    def _start_phase(self, phase: str) -> None:
+        if len(self.phases) > 0 and self.phases[-1].duration is None \
+                and self.phases[-1].phase == phase:
+            return
+
+        self._end_phase()
+        elapsed = time.monotonic() - self._start_time
+        self.phases.append(PhaseTiming(phase, elapsed, None))
+        self.on_progress(ProgressEvent(phase, elapsed))
+
+    def _end_phase(self) -> None:
+        if len(self.phases) > 0 and self.phases[-1].duration is None:
+            current = self.phases[-1]
+            elapsed = time.monotonic() - self._start_time
+            current.duration = elapsed - current.started
+
+
+def _log_progress(event: ProgressEvent) -> None:
+    logging.info(f"--> [{event.elapsed:.1f}s] Unity phase: {event.phase}")
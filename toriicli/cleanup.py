@@ -0,0 +1,203 @@
+"""Deleting folders without waiting for them to be deleted.
+
+A folder is first renamed into a trash folder next to it, which is instant as
+it's on the same filesystem, so its path can be reused straight away. The
+renamed folder is then deleted in the background, with its files deleted in
+parallel, or by a detached reaper process that outlives toriicli.
+
+Run as 'python -m toriicli.cleanup FOLDER...' to delete folders in the
+foreground, which is how the reaper process is started.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import functools
+import logging
+import os
+from os import path
+import shutil
+import subprocess
+import sys
+import threading
+from typing import List, Optional
+import uuid
+
+TRASH_FOLDER_NAME = ".toriicli-trash"
+"""The name of the folder that folders are moved into to be deleted."""
+
+DELETE_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+"""How many files to delete at once. Deleting is mostly waiting on the
+filesystem, so more threads than cores helps."""
+
+WAIT = "wait"
+"""Cleanup mode where folders are deleted in the background while toriicli
+runs, and toriicli waits for them to be deleted before exiting."""
+
+DETACH = "detach"
+"""Cleanup mode where folders are deleted by a detached process once
+toriicli exits, so toriicli doesn't wait for them."""
+
+MODES = [WAIT, DETACH]
+
+_mode = WAIT
+_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_pending: List[Future] = []
+_detached: List[str] = []
+
+
+def set_mode(mode: str) -> None:
+    """Set how folders are deleted. See WAIT and DETACH."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown cleanup mode '{mode}'")
+    global _mode
+    _mode = mode
+
+
+def remove_tree(folder: str) -> None:
+    """Delete a folder without waiting for it to be deleted. Once this
+    returns, the folder no longer exists at its path."""
+    if not path.lexists(folder):
+        return
+    if path.islink(folder) or not path.isdir(folder):
+        os.remove(folder)
+        return
+
+    trash_path = _move_to_trash(folder)
+    if trash_path is None:
+        # if we couldn't move it, delete it where it is instead
+        trash_path = folder
+
+    with _lock:
+        if _mode == DETACH and trash_path != folder:
+            _detached.append(trash_path)
+            return
+    _delete_in_background(trash_path)
+
+
+def finish() -> None:
+    """Finish cleaning up. Waits for folders being deleted in the background,
+    and hands any folders left to delete over to a reaper process."""
+    with _lock:
+        detached = list(_detached)
+        _detached.clear()
+    if len(detached) > 0 and not _start_reaper(detached):
+        [_delete_in_background(folder) for folder in detached]
+
+    with _lock:
+        pending = list(_pending)
+        _pending.clear()
+    if len(pending) > 0:
+        logging.info("Waiting for cleanup to finish...")
+        # any errors are logged as each folder finishes deleting
+        wait(pending)
+
+
+def delete_tree(folder: str) -> None:
+    """Delete a folder, deleting its files in parallel."""
+    folders = []
+    with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as executor:
+        for root, dir_names, file_names in os.walk(folder):
+            folders.append(root)
+            # os.walk doesn't follow symlinks to folders, so they need to be
+            # deleted like files
+            links = [
+                name for name in dir_names
+                if path.islink(path.join(root, name))
+            ]
+            if len(file_names) > 0 or len(links) > 0:
+                executor.submit(_remove_files, root, file_names + links)
+
+    # delete the folders deepest first, now they're empty
+    for empty_folder in reversed(folders):
+        try:
+            os.rmdir(empty_folder)
+        except OSError:
+            pass
+
+    # get anything we couldn't delete first time round, i.e. read-only files
+    shutil.rmtree(folder, ignore_errors=True)
+    _remove_empty_trash(path.dirname(folder))
+
+
+def _remove_files(folder: str, names: List[str]) -> None:
+    for name in names:
+        try:
+            os.remove(path.join(folder, name))
+        except OSError:
+            pass
+
+
+def _move_to_trash(folder: str) -> Optional[str]:
+    """Move a folder into the trash folder next to it. Returns the path it was
+    moved to, or None if it couldn't be moved."""
+    folder = path.abspath(folder)
+    trash_folder = path.join(path.dirname(folder), TRASH_FOLDER_NAME)
+    trash_path = path.join(trash_folder,
+                           f"{path.basename(folder)}-{uuid.uuid4().hex}")
+    try:
+        os.makedirs(trash_folder, exist_ok=True)
+        os.rename(folder, trash_path)
+        return trash_path
+    except OSError as err:
+        logging.debug(f"Unable to move {folder} to trash: {err}")
+        _remove_empty_trash(trash_folder)
+        return None
+
+
+def _remove_empty_trash(trash_folder: str) -> None:
+    if path.basename(trash_folder) != TRASH_FOLDER_NAME:
+        return
+    try:
+        os.rmdir(trash_folder)
+    except OSError:
+        pass  # something else is still being deleted
+
+
+def _delete_in_background(folder: str) -> None:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=2)
+        future = _executor.submit(delete_tree, folder)
+        _pending.append(future)
+    future.add_done_callback(functools.partial(_deleted, folder))
+
+
+def _deleted(folder: str, future: Future) -> None:
+    """Forget a folder once it's deleted, so long-running processes (i.e.
+    when serving jobs) don't keep every folder they ever deleted."""
+    with _lock:
+        if future in _pending:
+            _pending.remove(future)
+    err = future.exception()
+    if err is not None:
+        logging.error(f"Unable to delete {folder}: {err}")
+
+
+def _start_reaper(folders: List[str]) -> bool:
+    """Start a detached process to delete folders. Returns False if it
+    couldn't be started."""
+    if getattr(sys, "frozen", False):
+        return False  # can't run a module from a frozen executable
+
+    kwargs = {}
+    if os.name == "nt":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS \
+            | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        subprocess.Popen([sys.executable, "-m", __name__] + folders,
+                         stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL,
+                         close_fds=True,
+                         **kwargs)
+        return True
+    except OSError as err:
+        logging.warning(f"Unable to start cleanup process: {err}")
+        return False
+
+
+if __name__ == "__main__":
+    for folder_to_delete in sys.argv[1:]:
+        delete_tree(folder_to_delete)
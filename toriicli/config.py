@@ -4,7 +4,9 @@ import logging.config
 import os
 from os import path
 import pkg_resources
-from typing import Optional, List
+import platform
+import threading
+from typing import Optional, List, Mapping, Any, Dict, Tuple
 
 from marshmallow import Schema, fields, post_load, ValidationError, validate
 import yaml
@@ -18,6 +20,10 @@ EXAMPLE_CONFIG_FILE = "example_config.yml"
 CONFIG_NAME = "toriiproject.yml"
 """The name of the project config file to look for."""
 
+_config_lock = threading.Lock()
+_config_cache: Dict[Tuple[str, int, int], "ToriiCliConfig"] = {}
+_logging_configured = False
+
 
 class ToriiCliConfigSchema(Schema):
     """Marshmallow schema for app config."""
@@ -31,12 +37,33 @@ class ToriiCliConfigSchema(Schema):
         required=False,
         missing="Torii.Build.BuildScript.Build",
         allow_none=False)
+    unity_build_timeout = fields.Float(required=False,
+                                       missing=None,
+                                       allow_none=False)
+    unity_build_limits = fields.Mapping(keys=fields.Str,
+                                        values=fields.Raw,
+                                        required=False,
+                                        allow_none=False,
+                                        missing=None)
     unity_dotnet_framework_version = fields.Str(required=False,
                                                 missing="462",
                                                 allow_none=False)
     nuget_package_install_path = fields.Str(required=False,
                                             missing="NuGetPackages",
                                             allow_none=False)
+    nuget_local_feed = fields.Str(required=False,
+                                  missing=None,
+                                  allow_none=False)
+    nuget_limits = fields.Mapping(keys=fields.Str,
+                                  values=fields.Raw,
+                                  required=False,
+                                  allow_none=False,
+                                  missing=None)
+    nuget_cache = fields.Mapping(keys=fields.Str,
+                                 values=fields.Raw,
+                                 required=False,
+                                 allow_none=False,
+                                 missing=None)
     actual_project_dir = fields.Str(required=False,
                                     missing=None,
                                     allow_none=False)
@@ -54,6 +81,21 @@ class ToriiCliConfigSchema(Schema):
     release_steps = fields.List(fields.Nested(schemas.StepSchema),
                                 required=True,
                                 allow_none=False)
+    build_cache = fields.Mapping(keys=fields.Str,
+                                 values=fields.Raw,
+                                 required=False,
+                                 allow_none=False,
+                                 missing=None)
+    library_cache = fields.Mapping(keys=fields.Str,
+                                   values=fields.Raw,
+                                   required=False,
+                                   allow_none=False,
+                                   missing=None)
+    distributed = fields.Mapping(keys=fields.Str,
+                                 values=fields.Raw,
+                                 required=False,
+                                 allow_none=False,
+                                 missing=None)
 
     @post_load
     def make_torii_cli_config(self, data, **kwargs):
@@ -71,13 +113,21 @@ class ToriiCliConfig:
     unity_executable_path: str
     unity_preferred_version: str
     unity_build_execute_method: str
+    unity_build_timeout: float
+    unity_build_limits: Mapping[str, Any]
     unity_dotnet_framework_version: str
     nuget_package_install_path: str
+    nuget_local_feed: str
+    nuget_limits: Mapping[str, Any]
+    nuget_cache: Mapping[str, Any]
     actual_project_dir: str
     build_defs: List[build_def.BuildDef]
     build_output_folder: str
     build_post_steps: List[schemas.Step]
     release_steps: List[schemas.Step]
+    build_cache: Mapping[str, Any]
+    library_cache: Mapping[str, Any]
+    distributed: Mapping[str, Any]
 
 
 def create_config(config_path: str, exist_ok: bool = False) -> str:
@@ -100,6 +150,22 @@ def create_config(config_path: str, exist_ok: bool = False) -> str:
     return out_file_path
 
 
+def user_cache_dir() -> str:
+    """Get the folder toriicli caches things in for the current user, creating
+    it if it didn't exist."""
+    system = platform.system()
+    if system == "Windows":
+        cache_root = os.getenv("LOCALAPPDATA") or path.expanduser(
+            "~/AppData/Local")
+    elif system == "Darwin":
+        cache_root = path.expanduser("~/Library/Caches")
+    else:
+        cache_root = os.getenv("XDG_CACHE_HOME") or path.expanduser("~/.cache")
+    cache_dir = path.join(cache_root, "toriicli")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
 class ErrorFilter:
     """Filter error logs out of log statements."""
     def filter(self, record):
@@ -107,7 +173,15 @@ class ErrorFilter:
 
 
 def setup_logging() -> logging.Logger:
+    """Set up logging to stdout and stderr. Only does anything the first
+    time it's called, so commands run in the same process (i.e. by 'serve')
+    don't reset it."""
+    global _logging_configured
     logger = logging.getLogger("toriicli")
+    with _config_lock:
+        if _logging_configured:
+            return logger
+        _logging_configured = True
     logging.config.dictConfig({
         "version": 1,
         "formatters": {
@@ -147,11 +221,18 @@ def setup_logging() -> logging.Logger:
 
 
 def from_yaml(config_path: str) -> Optional[ToriiCliConfig]:
-    """Load config file from given path.
+    """Load config file from given path. The config is cached until the
+    file changes, so loading it again in the same process is free.
 
     If an error occurred, it will print it and return None.
     """
     try:
+        stat = os.stat(config_path)
+        cache_key = (path.abspath(config_path), stat.st_mtime_ns, stat.st_size)
+        with _config_lock:
+            if cache_key in _config_cache:
+                return _config_cache[cache_key]
+
         with open(config_path, 'r') as config_file:
             raw_config = yaml.safe_load(config_file)
 
@@ -160,6 +241,8 @@ def from_yaml(config_path: str) -> Optional[ToriiCliConfig]:
                 raw_config = {}
 
             loaded_config = CONFIG_SCHEMA.load(raw_config)
+            with _config_lock:
+                _config_cache[cache_key] = loaded_config
             return loaded_config
     except OSError as err:
         # if there was an error opening the file
@@ -190,4 +273,4 @@ def _print_validation_err(err: ValidationError, name: str) -> None:
         log_str.append(f"{field_name}: {err_msgs}")
 
     # print the joined up string
-    logging.critical(" ".join(log_str))
\ No newline at end of file
+    logging.critical(" ".join(log_str))
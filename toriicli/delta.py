@@ -0,0 +1,537 @@
+"""Binary deltas between two versions of a file, and patches between two
+versions of a build.
+
+A delta is made like rsync does it: the old file is split into blocks, which
+are indexed by a rolling hash and a strong hash, then the new file is scanned
+for blocks that appear anywhere in the old file. The delta is the new file
+written as copies from the old file, and literal data that wasn't in it. Only
+the index of the old file's blocks is held in memory, so files of any size can
+be diffed.
+
+Most of a new version of a file usually lines up with the old one, shifted by
+whatever was inserted or removed before it, so the new file is first compared
+in large spans with where it's expected to be in the old file. Together with
+finding where an insertion ends with a plain substring search, this covers
+unchanged data, data changed in place, and data shifted by an insertion or
+deletion, at about the speed of reading and hashing the files (around
+100MB/s). Only where that fails does the scan roll byte by byte, which is pure
+Python and runs at a few MB/s, so it's limited to MAX_ROLL_SIZE bytes for each
+stretch of the new file that isn't in the old file. Past that, the stretch is
+only checked a block at a time.
+
+A patch folder holds a delta for each changed file of a build, any new files
+in full, and a manifest saying what to do with each file.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+from dataclasses import dataclass
+import gzip
+import hashlib
+import json
+import math
+import mmap
+import os
+from os import path
+import shutil
+import struct
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import hashing, matcher
+
+MAGIC = b"TDLT"
+"""The first bytes of a delta file."""
+
+FORMAT_VERSION = 1
+"""The version of the delta file format."""
+
+HEADER = struct.Struct("<4sBIQ32s")
+"""A delta file's header: magic, format version, block size, size of the new
+file, and SHA256 of the new file."""
+
+COPY_OP = struct.Struct("<QI")
+"""Copy bytes from the old file: offset, length."""
+
+LITERAL_OP = struct.Struct("<I")
+"""Literal bytes follow: length."""
+
+COPY, LITERAL, END = b"C", b"L", b"E"
+
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 64 * 1024
+
+ROLLING_MODULUS = 2**31 - 1
+"""The modulus of the rolling hash (a Rabin-Karp hash in base 256)."""
+
+MATCH_SPAN_SIZE = 1024 * 1024
+"""How many bytes to compare at once with where they're expected to be in the
+old file."""
+
+MAX_ROLL_SIZE = 1024 * 1024
+"""The most bytes to search byte by byte for each stretch of the new file that
+isn't in the old file, as that's slow."""
+
+MAX_LITERAL_RATIO = 0.5
+"""If more than this much of the new file isn't in the old file, a delta
+isn't worth making and we give up."""
+
+LITERAL_FLUSH_SIZE = 1024 * 1024
+"""The most literal bytes to buffer before writing them to the delta."""
+
+MANIFEST_NAME = "manifest.json"
+"""The name of the manifest in a patch folder."""
+
+DELTA_EXTENSION = ".tdelta"
+"""The extension of delta files in a patch folder."""
+
+
+@dataclass
+class DeltaResult:
+    """What making a delta did.
+
+    Attributes:
+        patch_size: The size of the delta file.
+        copied_bytes: How many bytes of the new file were in the old file.
+        literal_bytes: How many bytes of the new file had to be stored.
+    """
+    patch_size: int
+    copied_bytes: int
+    literal_bytes: int
+
+
+@dataclass
+class PatchResult:
+    """What making a patch between two builds did.
+
+    Attributes:
+        patched: The files that changed, which have deltas.
+        added: The files stored in full, as they were new or a delta wasn't
+            worth making.
+        removed: The files that are gone from the new build.
+        unchanged: How many files were the same.
+        patch_size: The total size of the deltas and files in the patch.
+    """
+    patched: List[str]
+    added: List[str]
+    removed: List[str]
+    unchanged: int
+    patch_size: int
+
+
+def block_size_for(size: int) -> int:
+    """Choose the block size for diffing a file of a certain size. Like
+    rsync, this is around the square root of the size, so bigger files don't
+    have huge indexes."""
+    block_size = 1 << int(math.sqrt(size)).bit_length()
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block_size))
+
+
+def make_delta(old_path: str, new_path: str,
+               delta_path: str) -> Optional[DeltaResult]:
+    """Make a delta that turns an old file into a new one.
+
+    Returns None if too little of the new file was in the old file for a
+    delta to be worthwhile, in which case no delta file is left behind.
+    """
+    new_size = os.path.getsize(new_path)
+    block_size = block_size_for(os.path.getsize(old_path))
+    weak_index, strong_index = _index_blocks(old_path, block_size)
+    new_digest = bytes.fromhex(hashing.hash_file(new_path))
+
+    with gzip.open(delta_path, "wb", compresslevel=6) as delta_file:
+        delta_file.write(
+            HEADER.pack(MAGIC, FORMAT_VERSION, block_size, new_size,
+                        new_digest))
+        writer = _DeltaWriter(delta_file)
+        with open(new_path, "rb") as new_file, \
+                open(old_path, "rb") as old_file:
+            found = new_size == 0 or _write_delta(new_file, old_file, new_size,
+                                                  block_size, weak_index,
+                                                  strong_index, writer)
+        writer.close()
+
+    if not found:
+        os.remove(delta_path)
+        return None
+    return DeltaResult(os.path.getsize(delta_path), writer.copied_bytes,
+                       writer.literal_bytes)
+
+
+def apply_delta(old_path: str, delta_path: str, new_path: str) -> None:
+    """Apply a delta to an old file, writing the new file.
+
+    Raises:
+        ValueError: If the delta was invalid, or the file it made didn't
+            match the file it was made from.
+    """
+    temp_path = f"{new_path}.{os.getpid()}.tmp"
+    try:
+        with gzip.open(delta_path, "rb") as delta_file, \
+                open(old_path, "rb") as old_file, \
+                open(temp_path, "wb") as new_file:
+            magic, version, _, new_size, new_digest = HEADER.unpack(
+                _read_exactly(delta_file, HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"'{delta_path}' is not a delta file")
+
+            digest = hashlib.sha256()
+            while True:
+                op = _read_exactly(delta_file, 1)
+                if op == END:
+                    break
+                if op == COPY:
+                    offset, length = COPY_OP.unpack(
+                        _read_exactly(delta_file, COPY_OP.size))
+                    old_file.seek(offset)
+                    source = old_file
+                elif op == LITERAL:
+                    length, = LITERAL_OP.unpack(
+                        _read_exactly(delta_file, LITERAL_OP.size))
+                    source = delta_file
+                else:
+                    raise ValueError(f"Invalid operation in '{delta_path}'")
+
+                while length > 0:
+                    chunk = _read_exactly(
+                        source, min(length, hashing.HASH_BUFFER_SIZE))
+                    new_file.write(chunk)
+                    digest.update(chunk)
+                    length -= len(chunk)
+
+        if os.path.getsize(temp_path) != new_size \
+                or digest.digest() != new_digest:
+            raise ValueError(
+                f"Applying '{delta_path}' didn't make the expected file")
+        os.replace(temp_path, new_path)
+    finally:
+        if path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def make_patch(old_root: str,
+               new_root: str,
+               patch_root: str,
+               max_workers: Optional[int] = None) -> PatchResult:
+    """Make a patch folder that turns one version of a build into another.
+    Deltas of changed files are made in parallel, in separate processes.
+
+    Args:
+        old_root: The folder of the old build.
+        new_root: The folder of the new build.
+        patch_root: The folder to write the patch to.
+        max_workers: How many deltas to make at once. Defaults to the number
+            of CPUs.
+    """
+    os.makedirs(patch_root, exist_ok=True)
+    old_files = set(matcher.Matcher("**").walk(old_root).files)
+    new_files = set(matcher.Matcher("**").walk(new_root).files)
+    common = sorted(old_files & new_files)
+
+    # find which of the files in both builds changed
+    old_digests = hashing.hash_files([path.join(old_root, f) for f in common])
+    new_digests = hashing.hash_files(
+        [path.join(new_root, f) for f in sorted(new_files)])
+
+    def digest(root: str, digests: Dict[str, str], rel_path: str) -> str:
+        return digests[path.join(root, rel_path)]
+
+    changed = [
+        f for f in common
+        if digest(old_root, old_digests, f) != digest(new_root, new_digests, f)
+    ]
+
+    entries = {}
+    result = PatchResult([], [], sorted(old_files - new_files),
+                         len(common) - len(changed), 0)
+    for rel_path in result.removed:
+        entries[rel_path] = {"action": "remove"}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for rel_path in changed:
+            delta_path = path.join(patch_root, "deltas",
+                                   rel_path + DELTA_EXTENSION)
+            os.makedirs(path.dirname(delta_path), exist_ok=True)
+            futures.append(
+                executor.submit(make_delta, path.join(old_root, rel_path),
+                                path.join(new_root, rel_path), delta_path))
+        deltas = [future.result() for future in futures]
+
+    new_file_size = {
+        f: os.path.getsize(path.join(new_root, f))
+        for f in changed
+    }
+    to_add = sorted(new_files - old_files)
+    for rel_path, delta in zip(changed, deltas):
+        # if the delta is no smaller than the file, just use the file
+        if delta is None or delta.patch_size >= new_file_size[rel_path]:
+            if delta is not None:
+                os.remove(
+                    path.join(patch_root, "deltas",
+                              rel_path + DELTA_EXTENSION))
+            to_add.append(rel_path)
+            continue
+        entries[rel_path] = {
+            "action": "patch",
+            "delta": f"deltas/{rel_path}{DELTA_EXTENSION}",
+            "old_sha256": digest(old_root, old_digests, rel_path),
+            "sha256": digest(new_root, new_digests, rel_path)
+        }
+        result.patched.append(rel_path)
+        result.patch_size += delta.patch_size
+
+    for rel_path in sorted(to_add):
+        dst_path = path.join(patch_root, "files", rel_path)
+        os.makedirs(path.dirname(dst_path), exist_ok=True)
+        shutil.copy2(path.join(new_root, rel_path), dst_path)
+        entries[rel_path] = {
+            "action": "add",
+            "file": f"files/{rel_path}",
+            "sha256": digest(new_root, new_digests, rel_path)
+        }
+        result.added.append(rel_path)
+        result.patch_size += os.path.getsize(dst_path)
+
+    with open(path.join(patch_root, MANIFEST_NAME), "w") as manifest_file:
+        json.dump({
+            "version": FORMAT_VERSION,
+            "files": entries
+        },
+                  manifest_file,
+                  indent=2,
+                  sort_keys=True)
+    return result
+
+
+def apply_patch(patch_root: str, target_root: str) -> None:
+    """Apply a patch folder to a build, updating it in place.
+
+    Raises:
+        ValueError: If the patch was invalid, or a file in the build wasn't
+            the version the patch was made from.
+    """
+    with open(path.join(patch_root, MANIFEST_NAME), "r") as manifest_file:
+        entries = json.load(manifest_file)["files"]
+
+    for rel_path, entry in sorted(entries.items()):
+        target_path = path.join(target_root, *rel_path.split("/"))
+        action = entry["action"]
+        if action == "remove":
+            if path.exists(target_path):
+                os.remove(target_path)
+        elif action == "add":
+            os.makedirs(path.dirname(target_path), exist_ok=True)
+            shutil.copy2(path.join(patch_root, *entry["file"].split("/")),
+                         target_path)
+        elif action == "patch":
+            if hashing.hash_file(target_path) != entry["old_sha256"]:
+                raise ValueError(
+                    f"'{rel_path}' isn't the version the patch was made from")
+            apply_delta(target_path,
+                        path.join(patch_root, *entry["delta"].split("/")),
+                        target_path)
+        else:
+            raise ValueError(f"Invalid action '{action}' for '{rel_path}'")
+
+
+class _DeltaWriter:
+    """Writes the operations of a delta, merging adjacent copies and
+    buffering literal data."""
+    def __init__(self, delta_file) -> None:
+        self.delta_file = delta_file
+        self.copy_offset = 0
+        self.copy_length = 0
+        self.literal = bytearray()
+        self.copied_bytes = 0
+        self.literal_bytes = 0
+
+    def copy(self, offset: int, length: int) -> None:
+        self._flush_literal()
+        if self.copy_length > 0 \
+                and self.copy_offset + self.copy_length == offset:
+            self.copy_length += length
+        else:
+            self._flush_copy()
+            self.copy_offset, self.copy_length = offset, length
+        self.copied_bytes += length
+
+    def write_literal(self, data: bytes) -> None:
+        if len(data) == 0:
+            return
+        self._flush_copy()
+        self.literal += data
+        self.literal_bytes += len(data)
+        if len(self.literal) >= LITERAL_FLUSH_SIZE:
+            self._flush_literal()
+
+    def close(self) -> None:
+        self._flush_copy()
+        self._flush_literal()
+        self.delta_file.write(END)
+
+    def _flush_copy(self) -> None:
+        if self.copy_length > 0:
+            self.delta_file.write(
+                COPY + COPY_OP.pack(self.copy_offset, self.copy_length))
+            self.copy_length = 0
+
+    def _flush_literal(self) -> None:
+        if len(self.literal) > 0:
+            self.delta_file.write(LITERAL + LITERAL_OP.pack(len(self.literal)))
+            self.delta_file.write(self.literal)
+            self.literal = bytearray()
+
+
+def _index_blocks(old_path: str,
+                  block_size: int) -> Tuple[Set[int], Dict[bytes, int]]:
+    """Index the blocks of the old file by their rolling hash, and by their
+    strong hash to the offset of the block."""
+    weak_index = set()
+    strong_index = {}
+    with open(old_path, "rb") as old_file:
+        offset = 0
+        for block in iter(lambda: old_file.read(block_size), b""):
+            if len(block) < block_size:
+                break  # a partial block at the end can't be matched
+            weak_index.add(int.from_bytes(block, "big") % ROLLING_MODULUS)
+            strong_index.setdefault(_strong_hash(block), offset)
+            offset += block_size
+    return weak_index, strong_index
+
+
+def _write_delta(new_file, old_file, new_size: int, block_size: int,
+                 weak_index: Set[int], strong_index: Dict[bytes, int],
+                 writer: _DeltaWriter) -> bool:
+    """Scan the new file for blocks of the old file, writing the delta.
+    Returns False if we gave up as too little of it was in the old file."""
+    max_literal = int(new_size * MAX_LITERAL_RATIO)
+    last_start = new_size - block_size
+    with _map(new_file) as data, _map(old_file) as old:
+        pos = 0
+        literal_start = 0
+        # how far the new file is shifted from the old one, going by the last
+        # block that matched
+        shift = 0
+        searched = False
+        while pos <= last_start:
+            length = _match_length(data, old, pos, pos + shift, block_size)
+            if length == 0:
+                length = block_size
+                offset = strong_index.get(
+                    _strong_hash(data[pos:pos + block_size]))
+                if offset is None and not searched:
+                    # only search once for each stretch that isn't in the old
+                    # file, as searching byte by byte is slow
+                    searched = True
+                    budget = max_literal - writer.literal_bytes \
+                        - (pos - literal_start)
+                    pos, offset = _search(data, old, pos + 1,
+                                          min(last_start, pos + budget), shift,
+                                          block_size, weak_index, strong_index)
+                if offset is None:
+                    # leave the rest of the stretch to be checked a block at
+                    # a time
+                    pos += block_size
+                    if writer.literal_bytes + (pos - literal_start) \
+                            > max_literal:
+                        return False  # ran out of budget
+                    continue
+                shift = offset - pos
+
+            writer.write_literal(data[literal_start:pos])
+            writer.copy(pos + shift, length)
+            pos += length
+            literal_start = pos
+            searched = False
+
+        # the end is too short to be a block, but may still line up
+        old_pos = pos + shift
+        if pos < new_size and old_pos >= 0 \
+                and old[old_pos:old_pos + new_size - pos] == data[pos:]:
+            writer.write_literal(data[literal_start:pos])
+            writer.copy(old_pos, new_size - pos)
+            literal_start = new_size
+        writer.write_literal(data[literal_start:new_size])
+    return writer.literal_bytes <= max_literal
+
+
+def _match_length(data: mmap.mmap, old: mmap.mmap, pos: int, old_pos: int,
+                  block_size: int) -> int:
+    """Get how many whole blocks from a position in the new file are the
+    same as from a position in the old file. Compares large spans at once,
+    and only goes block by block once a span differs."""
+    if old_pos < 0:
+        return 0
+    limit = min(len(data) - pos, len(old) - old_pos) // block_size \
+        * block_size
+    span = max(block_size, MATCH_SPAN_SIZE // block_size * block_size)
+    matched = 0
+    while matched < limit:
+        length = min(span, limit - matched)
+        start = pos + matched
+        old_start = old_pos + matched
+        if data[start:start + length] == old[old_start:old_start + length]:
+            matched += length
+        elif span > block_size:
+            span = block_size  # find which block differs
+        else:
+            break
+    return matched
+
+
+def _search(data: mmap.mmap, old: mmap.mmap, pos: int, end: int, shift: int,
+            block_size: int, weak_index: Set[int],
+            strong_index: Dict[bytes, int]) -> Tuple[int, Optional[int]]:
+    """Search the new file from a position for a block that's in the old
+    file. Returns the position of the block and its offset in the old file,
+    or the last position it checked and None if it didn't find one."""
+    if pos > end:
+        return pos - 1, None
+
+    # if something was inserted, the block expected next in the old file
+    # comes after it, and we can find it without rolling
+    old_pos = pos - 1 + shift
+    if 0 <= old_pos <= len(old) - block_size:
+        found = data.find(old[old_pos:old_pos + block_size], pos,
+                          end + block_size)
+        if found != -1:
+            return found, old_pos
+
+    # otherwise roll through the new file looking at every position, which
+    # is slow, so only up to a limit
+    end = min(end, pos + MAX_ROLL_SIZE)
+    modulus = ROLLING_MODULUS
+    out_factor = pow(256, block_size - 1, modulus)
+    # indexing bytes is quicker than indexing the mmap
+    window = data[pos:end + block_size]
+    last = end - pos
+    weak = int.from_bytes(window[:block_size], "big") % modulus
+    i = 0
+    while True:
+        if weak in weak_index:
+            offset = strong_index.get(_strong_hash(window[i:i + block_size]))
+            if offset is not None:
+                return pos + i, offset
+        if i >= last:
+            return end, None
+        weak = ((weak - window[i] * out_factor) * 256 +
+                window[i + block_size]) % modulus
+        i += 1
+
+
+def _strong_hash(block: bytes) -> bytes:
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def _map(file_handle):
+    """Memory-map a file to read it, or get it as bytes if it's empty, as
+    empty files can't be mapped."""
+    if os.fstat(file_handle.fileno()).st_size == 0:
+        return contextlib.nullcontext(b"")
+    return mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _read_exactly(file_handle, size: int) -> bytes:
+    data = file_handle.read(size)
+    if len(data) != size:
+        raise ValueError("Unexpected end of delta file")
+    return data
@@ -0,0 +1,614 @@
+"""Running the steps of targets on remote workers.
+
+A coordinator (a build or release run with '--distribute') hands the pipeline
+of each target to workers ('toriicli worker') rather than running it itself.
+Tasks, workspaces, logs and results are exchanged through a storage provider
+that the coordinator and the workers can all reach, i.e. an S3 bucket or a
+shared folder, so nothing else has to connect them and workers can come and
+go at any time.
+
+Keys, under the transport's prefix:
+    queue/RUN_ID: The runs with tasks to claim.
+    runs/RUN_ID/toriiproject.yml: The config of the coordinator's project.
+    runs/RUN_ID/tasks/N.json: The target, context and options of each task.
+    runs/RUN_ID/workspaces/N.tar.gz: The files a task starts with, if any.
+    runs/RUN_ID/claims/N.json: The worker that claimed each task. Claims are
+        stored with StorageProvider.store_if_absent, so only one worker can
+        claim a task.
+    runs/RUN_ID/heartbeats/N.json: Updated by the worker while a task runs.
+    runs/RUN_ID/logs/N/SEQ.log: What a task logged, in chunks.
+    runs/RUN_ID/results/N.json: Whether a task succeeded.
+"""
+from __future__ import annotations
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from datetime import datetime
+import json
+import logging
+import os
+from os import path
+import signal
+import socket
+import tarfile
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+import uuid
+
+from . import cleanup, config, limits
+from .build import build_def
+from .steps import pipeline
+from .steps.extract_step import ExtractStep
+from .storage import make_provider
+
+BUILD = "build"
+"""A task running a target's build post-steps, starting with its build."""
+
+RELEASE = "release"
+"""A task running a target's release steps."""
+
+DEFAULT_PREFIX = "toriicli"
+"""The prefix of keys in the transport, if it isn't given."""
+
+POLL_SECONDS = 2.0
+"""How often the coordinator and workers check the transport."""
+
+LOG_FLUSH_SECONDS = 2.0
+"""How often workers send what tasks logged, and their heartbeats."""
+
+LEASE_SECONDS = 120.0
+"""How long a worker can go without a heartbeat before its task fails."""
+
+WORKSPACE_COMPRESSLEVEL = 1
+"""How much to compress workspaces sent to workers. Builds are mostly
+compressed already, so it's not worth spending time on."""
+
+
+@dataclass
+class Task:
+    """The steps of a target, to run on a worker.
+
+    Attributes:
+        index: The position of the task in its run.
+        kind: Whether to run the build post-steps or the release steps.
+        target: The target to run the steps for.
+        context: The context to template the steps with.
+        options: The options used to filter steps.
+        workspace: The key of the files the task starts with, if any.
+    """
+    index: int
+    kind: str
+    target: str
+    context: Dict[str, Any]
+    options: List[str]
+    workspace: Optional[str] = None
+
+
+class Transport:
+    """The storage tasks, workspaces, logs and results are exchanged through.
+
+    Args:
+        using: The 'distributed' section of the config, or the worker's
+            '--using' options. Takes the same values as the 'using' section
+            of an import/export step, as well as 'prefix'.
+
+    Raises:
+        ValueError: If there was no backend, or an invalid backend.
+    """
+    def __init__(self, using: Mapping[str, Any]) -> None:
+        using = dict(using)
+        if using.get("backend") is None:
+            raise ValueError("Missing 'backend' for distributed transport")
+        prefix = str(using.pop("prefix", DEFAULT_PREFIX)).strip("/")
+        for k, v in using.items():
+            if isinstance(v, str):
+                using[k] = path.expandvars(v)
+        self.using = using
+        self.prefix = f"{prefix}/" if prefix else ""
+        provider_kwargs = dict(using)
+        self.provider = make_provider(provider_kwargs.pop("backend"),
+                                      **provider_kwargs)
+
+    def key(self, *parts: Any) -> str:
+        return self.prefix + "/".join(str(part) for part in parts)
+
+    def ls(self, *parts: Any) -> List[str]:
+        """List the names of the blobs under a key."""
+        prefix = self.key(*parts) + "/"
+        return [key[len(prefix):] for key in self.provider.ls(prefix)]
+
+    def exists(self, *parts: Any) -> bool:
+        return self.provider.exists(self.key(*parts))
+
+    def read(self, *parts: Any) -> str:
+        with closing(self.provider.open(self.key(*parts))) as stream:
+            return stream.read().decode("utf-8")
+
+    def read_json(self, *parts: Any) -> Any:
+        return json.loads(self.read(*parts))
+
+    def write_json(self, data: Any, *parts: Any) -> None:
+        self.provider.store(json.dumps(data), self.key(*parts))
+
+    def claim(self, data: Any, *parts: Any) -> bool:
+        """Store some JSON at a key, if nothing was there already."""
+        return self.provider.store_if_absent(json.dumps(data),
+                                             self.key(*parts))
+
+    def remove(self, *parts: Any) -> None:
+        """Delete every blob under a key, and the key itself."""
+        key = self.key(*parts)
+        for blob in list(self.provider.ls(key + "/")):
+            self.provider.delete(blob)
+        self.provider.delete(key)
+
+
+@dataclass
+class _TaskState:
+    """What the coordinator knows about a task."""
+    task: Task
+    worker: Optional[str] = None
+    log_chunks: int = 0
+    heartbeat: Any = None
+    heartbeat_time: float = 0.0
+    result: Optional[Dict[str, Any]] = None
+
+
+class Coordinator:
+    """Hands the pipelines of targets to workers, and waits for them to
+    finish, logging what they log as it streams back.
+
+    Args:
+        transport: Where to put the tasks.
+        command: The command being run, i.e. 'build'.
+        config_path: The path of the project's config, which workers load the
+            steps from.
+    """
+    def __init__(self, transport: Transport, command: str,
+                 config_path: str) -> None:
+        self.transport = transport
+        self.command = command
+        self.config_path = config_path
+        self.run_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-" \
+            f"{uuid.uuid4().hex[:6]}"
+        self._states: List[_TaskState] = []
+        self._next_index = 0
+        self._lock = threading.Lock()
+        self._submitted = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Put the run in the queue for workers, and start following its
+        tasks."""
+        with open(self.config_path, "rb") as config_file:
+            self.transport.provider.store(
+                config_file,
+                self.transport.key("runs", self.run_id, config.CONFIG_NAME))
+        self.transport.write_json(
+            {
+                "command": self.command,
+                "coordinator": socket.gethostname(),
+                "created": time.time()
+            }, "queue", self.run_id)
+        logging.info(f"Distributing {self.command} as run {self.run_id}")
+        self._thread = threading.Thread(target=self._poll,
+                                        name="toriicli-coordinator",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self,
+               kind: str,
+               bd: build_def.BuildDef,
+               context: dict,
+               options: List[str],
+               workspace: Optional[str] = None) -> Task:
+        """Queue the steps of a target for a worker to run.
+
+        Args:
+            kind: Whether to run the build post-steps or the release steps.
+            bd: The build def of the target.
+            context: The context to template the steps with. The build def is
+                added back by the worker.
+            options: The options used to filter steps.
+            workspace: A folder of files to start the steps with.
+        """
+        with self._lock:
+            index = self._next_index
+            self._next_index += 1
+        workspace_key = None
+        if workspace is not None:
+            workspace_key = self.transport.key("runs", self.run_id,
+                                               "workspaces", f"{index}.tar.gz")
+            self._upload_workspace(workspace, workspace_key)
+
+        context = {k: v for k, v in context.items() if k != "build_def"}
+        task = Task(index, kind, bd.target, context, list(options),
+                    workspace_key)
+        self.transport.write_json(asdict(task), "runs", self.run_id, "tasks",
+                                  f"{index}.json")
+        with self._lock:
+            self._states.append(_TaskState(task))
+        logging.info(f"Queued {kind} of target {bd.target} for a worker")
+        return task
+
+    def wait(self) -> bool:
+        """Wait for every task to finish, then remove the run from the
+        transport. Returns False if any of them failed."""
+        self._submitted.set()
+        try:
+            # join in a loop so Ctrl+C still works
+            while self._thread.is_alive():
+                self._thread.join(0.5)
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+
+        self.transport.remove("queue", self.run_id)
+        self.transport.remove("runs", self.run_id)
+        failed = [
+            state.task.target for state in self._states
+            if not state.result.get("success", False)
+        ]
+        if len(failed) > 0:
+            logging.error(f"Failed on workers: {', '.join(failed)}")
+        return len(failed) == 0
+
+    def cancel(self) -> None:
+        """Stop workers claiming any more of the run's tasks. Tasks already
+        claimed keep running on their workers."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.transport.remove("queue", self.run_id)
+        unfinished = [
+            state.task.target for state in self._states
+            if state.worker is not None and state.result is None
+        ]
+        if len(unfinished) > 0:
+            logging.warning(f"Cancelled run {self.run_id}, "
+                            f"{', '.join(unfinished)} will keep running on "
+                            "their workers")
+
+    def _upload_workspace(self, folder: str, key: str) -> None:
+        fd, archive_path = tempfile.mkstemp(suffix=".tar.gz")
+        os.close(fd)
+        try:
+            with limits.hold(limits.COMPRESS), \
+                    tarfile.open(archive_path, "w:gz",
+                                 compresslevel=WORKSPACE_COMPRESSLEVEL) \
+                    as archive:
+                for entry in sorted(os.listdir(folder)):
+                    archive.add(path.join(folder, entry), arcname=entry)
+            with limits.hold(limits.TRANSFER), \
+                    open(archive_path, "rb") as archive_file:
+                self.transport.provider.store(archive_file, key)
+        finally:
+            os.remove(archive_path)
+
+    def _poll(self) -> None:
+        while not self._stop.is_set():
+            # check before polling, so the last poll sees every task
+            submitted = self._submitted.is_set()
+            with self._lock:
+                pending = [s for s in self._states if s.result is None]
+            for state in pending:
+                try:
+                    self._poll_task(state)
+                except Exception as err:
+                    # the transport may be briefly unreachable, try again on
+                    # the next poll
+                    logging.warning(f"Unable to check on target "
+                                    f"{state.task.target}: {err}")
+            if submitted and all(s.result is not None for s in pending):
+                return
+            self._stop.wait(POLL_SECONDS)
+
+    def _poll_task(self, state: _TaskState) -> None:
+        index = state.task.index
+        if state.worker is None:
+            if not self.transport.exists("runs", self.run_id, "claims",
+                                         f"{index}.json"):
+                return
+            claim = self.transport.read_json("runs", self.run_id, "claims",
+                                             f"{index}.json")
+            state.worker = claim["worker"]
+            state.heartbeat_time = time.monotonic()
+            logging.info(f"Worker {state.worker} is running target "
+                         f"{state.task.target}")
+
+        result = None
+        if self.transport.exists("runs", self.run_id, "results",
+                                 f"{index}.json"):
+            result = self.transport.read_json("runs", self.run_id, "results",
+                                              f"{index}.json")
+        self._read_logs(state,
+                        None if result is None else result["log_chunks"])
+        if result is not None:
+            state.result = result
+            if result["success"]:
+                logging.info(f"Target {state.task.target} finished on "
+                             f"{state.worker} in {result['wall_time']:.1f}s")
+            else:
+                logging.error(f"Target {state.task.target} failed on "
+                              f"{state.worker}")
+            return
+
+        # go by when we saw the heartbeat change, so the clocks of the
+        # coordinator and workers don't have to agree
+        heartbeat = None
+        if self.transport.exists("runs", self.run_id, "heartbeats",
+                                 f"{index}.json"):
+            heartbeat = self.transport.read_json("runs", self.run_id,
+                                                 "heartbeats", f"{index}.json")
+        if heartbeat != state.heartbeat:
+            state.heartbeat = heartbeat
+            state.heartbeat_time = time.monotonic()
+        elif time.monotonic() - state.heartbeat_time > LEASE_SECONDS:
+            logging.error(f"Lost worker {state.worker} running target "
+                          f"{state.task.target}, no heartbeat for "
+                          f"{LEASE_SECONDS:.0f}s")
+            state.result = {"success": False, "log_chunks": state.log_chunks}
+
+    def _read_logs(self, state: _TaskState, count: Optional[int]) -> None:
+        """Log the chunks of a task's log we haven't yet, up to a count if we
+        know how many there are."""
+        index = state.task.index
+        while count is None or state.log_chunks < count:
+            chunk = ("runs", self.run_id, "logs", index,
+                     f"{state.log_chunks:06d}.log")
+            if count is None and not self.transport.exists(*chunk):
+                return
+            for line in self.transport.read(*chunk).splitlines():
+                if line.startswith("ERROR: "):
+                    logging.error(f"[{state.task.target}] {line[7:]}")
+                else:
+                    logging.info(f"[{state.task.target}] {line}")
+            state.log_chunks += 1
+
+
+class _TaskLog:
+    """What a task has logged, sent to the coordinator in chunks along with
+    the worker's heartbeat."""
+    def __init__(self, transport: Transport, run_id: str, index: int,
+                 worker: str) -> None:
+        self.transport = transport
+        self.run_id = run_id
+        self.index = index
+        self.worker = worker
+        self.chunks = 0
+        self._beats = 0
+        self._closed = False
+        self._lines: List[str] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def add(self, message: str) -> None:
+        with self._lock:
+            self._lines.extend(message.splitlines() or [""])
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            if self._closed:
+                return
+            with self._lock:
+                lines, self._lines = self._lines, []
+            if len(lines) > 0:
+                self.transport.provider.store(
+                    "\n".join(lines) + "\n",
+                    self.transport.key("runs", self.run_id, "logs", self.index,
+                                       f"{self.chunks:06d}.log"))
+                self.chunks += 1
+            self._beats += 1
+            self.transport.write_json(
+                {
+                    "worker": self.worker,
+                    "beat": self._beats
+                }, "runs", self.run_id, "heartbeats", f"{self.index}.json")
+
+    def close(self) -> None:
+        """Send the rest of the log. Nothing is sent after this, as the
+        coordinator may have removed the run once it has the result."""
+        self.flush()
+        with self._flush_lock:
+            self._closed = True
+
+
+class _TaskLogHandler(logging.Handler):
+    """Adds what's logged while a task runs to the task's log."""
+    def __init__(self, worker: Worker) -> None:
+        super().__init__(logging.INFO)
+        self.worker = worker
+
+    def emit(self, record: logging.LogRecord) -> None:
+        task_log = self.worker.current_log()
+        if task_log is None:
+            return
+        # format it so tracebacks are sent too
+        message = self.format(record)
+        if record.levelno >= logging.ERROR:
+            message = f"ERROR: {message}"
+        task_log.add(message)
+
+
+class Worker:
+    """Claims tasks from the transport and runs them.
+
+    Args:
+        transport: Where to claim tasks from.
+        workers: How many tasks to run at once.
+        name: The name of the worker, defaults to the host name and PID.
+    """
+    def __init__(self,
+                 transport: Transport,
+                 workers: int = 1,
+                 name: Optional[str] = None) -> None:
+        self.transport = transport
+        self.workers = workers
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._running: Dict[Tuple[str, int], _TaskLog] = {}
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+
+    def current_log(self) -> Optional[_TaskLog]:
+        """Get the log of the task running on this thread. Falls back to the
+        only task running, so things logged by threads a task started go to
+        it too."""
+        task_log = getattr(self._local, "log", None)
+        if task_log is None and not getattr(self._local, "ignored", False):
+            with self._lock:
+                if len(self._running) == 1:
+                    task_log = next(iter(self._running.values()))
+        return task_log
+
+    def run(self, exit_when_idle: bool = False) -> None:
+        """Claim and run tasks until interrupted, or until there are none
+        left if exit_when_idle is set."""
+        self._local.ignored = True
+        log_handler = _TaskLogHandler(self)
+        logging.getLogger().addHandler(log_handler)
+        flusher = threading.Thread(target=self._flush_logs,
+                                   name="toriicli-worker-logs",
+                                   daemon=True)
+        flusher.start()
+        logging.info(f"Worker {self.name} waiting for tasks with "
+                     f"{self.workers} slot(s)")
+
+        # stop the same way on SIGTERM as on Ctrl+C
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            while True:
+                self._threads = [t for t in self._threads if t.is_alive()]
+                claimed = False
+                while len(self._threads) < self.workers:
+                    next_task = self._claim_next()
+                    if next_task is None:
+                        break
+                    claimed = True
+                    thread = threading.Thread(target=self._run_task,
+                                              args=next_task,
+                                              daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+                if exit_when_idle and not claimed \
+                        and len(self._threads) == 0:
+                    logging.info("No tasks left, stopping")
+                    return
+                time.sleep(POLL_SECONDS)
+        except KeyboardInterrupt:
+            logging.info("Stopping, waiting for running tasks to finish...")
+            for thread in self._threads:
+                thread.join()
+        finally:
+            self._stop.set()
+            flusher.join()
+            logging.getLogger().removeHandler(log_handler)
+
+    def _claim_next(self) -> Optional[Tuple[str, Task]]:
+        """Claim the first task nobody has claimed, from the oldest run."""
+        try:
+            for run_id in sorted(self.transport.ls("queue")):
+                claimed = set(self.transport.ls("runs", run_id, "claims"))
+                tasks = sorted(
+                    int(name.split(".")[0])
+                    for name in self.transport.ls("runs", run_id, "tasks"))
+                for index in tasks:
+                    if f"{index}.json" in claimed:
+                        continue
+                    if not self.transport.claim(
+                        {
+                            "worker": self.name,
+                            "claimed": time.time()
+                        }, "runs", run_id, "claims", f"{index}.json"):
+                        continue
+                    task = Task(**self.transport.read_json(
+                        "runs", run_id, "tasks", f"{index}.json"))
+                    return run_id, task
+        except Exception as err:
+            logging.warning(f"Unable to claim a task: {err}")
+        return None
+
+    def _run_task(self, run_id: str, task: Task) -> None:
+        task_log = _TaskLog(self.transport, run_id, task.index, self.name)
+        self._local.log = task_log
+        with self._lock:
+            self._running[(run_id, task.index)] = task_log
+        logging.info(f"Running {task.kind} of target {task.target} from run "
+                     f"{run_id}")
+        start_time = time.monotonic()
+        success = False
+        temp_dir = tempfile.mkdtemp()
+        try:
+            config_path = path.join(temp_dir, config.CONFIG_NAME)
+            self.transport.provider.retrieve(
+                self.transport.key("runs", run_id, config.CONFIG_NAME),
+                config_path)
+            cfg = config.from_yaml(config_path)
+            if cfg is not None:
+                success = run_task(self.transport, cfg, task)
+        except Exception:
+            logging.exception(f"Target {task.target} failed")
+        finally:
+            wall_time = time.monotonic() - start_time
+            status = "finished" if success else "failed"
+            logging.info(f"Target {task.target} {status} in {wall_time:.1f}s")
+            self._local.log = None
+            with self._lock:
+                del self._running[(run_id, task.index)]
+            cleanup.remove_tree(temp_dir)
+            try:
+                task_log.close()
+                self.transport.write_json(
+                    {
+                        "success": success,
+                        "worker": self.name,
+                        "wall_time": wall_time,
+                        "log_chunks": task_log.chunks
+                    }, "runs", run_id, "results", f"{task.index}.json")
+            except Exception as err:
+                logging.error(f"Unable to send result of target "
+                              f"{task.target}: {err}")
+
+    def _flush_logs(self) -> None:
+        self._local.ignored = True
+        while not self._stop.wait(LOG_FLUSH_SECONDS):
+            with self._lock:
+                task_logs = list(self._running.values())
+            for task_log in task_logs:
+                try:
+                    task_log.flush()
+                except Exception as err:
+                    logging.warning(f"Unable to send log: {err}")
+
+
+def run_task(transport: Transport, cfg: config.ToriiCliConfig,
+             task: Task) -> bool:
+    """Run the steps of a task. Returns False if a step failed."""
+    bd = next((bd for bd in cfg.build_defs if bd.target == task.target), None)
+    if bd is None:
+        logging.error(f"No build def for target {task.target}")
+        return False
+
+    context = dict(task.context, build_def=bd)
+    step_defs = cfg.build_post_steps if task.kind == BUILD \
+        else cfg.release_steps
+
+    # the workspace the coordinator sent is extracted by an implicit first
+    # step, like builds are imported when running post-steps locally
+    first_step = None
+    if task.workspace is not None:
+        first_step = ExtractStep("**",
+                                 context,
+                                 None,
+                                 key=task.workspace,
+                                 format="tar",
+                                 **transport.using)
+        context["path"] = first_step.workspace
+    return pipeline.run_steps(step_defs, context, bd, task.options, first_step)
+
+
+def _interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt()
@@ -0,0 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+from typing import Dict, List, Optional
+
+HASH_BUFFER_SIZE = 1024 * 1024
+"""How many bytes to read from a file at a time when hashing it."""
+
+
+def hash_file(file_path: str, algorithm: str = "sha256") -> str:
+    """Hash the contents of a file.
+
+    Args:
+        file_path: The path to the file to hash.
+        algorithm: The name of the hashlib algorithm to use.
+
+    Returns:
+        str: The hex digest of the file's contents.
+    """
+    digest = hashlib.new(algorithm)
+    # read into the same buffer each time, rather than allocating a new one
+    # for every chunk
+    buffer = bytearray(HASH_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as file_handle:
+        for size in iter(lambda: file_handle.readinto(buffer), 0):
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+def hash_files(file_paths: List[str],
+               algorithm: str = "sha256",
+               max_workers: Optional[int] = None) -> Dict[str, str]:
+    """Hash the contents of files concurrently. hashlib releases the GIL
+    while hashing, so this uses multiple cores.
+
+    Returns:
+        Dict[str, str]: The hex digest of each file, keyed by its path.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        digests = executor.map(lambda p: hash_file(p, algorithm), file_paths)
+        return dict(zip(file_paths, digests))
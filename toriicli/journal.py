@@ -0,0 +1,301 @@
+"""Journals of pipeline runs, so a failed run can be resumed.
+
+As each step of a run finishes, the journal records it, along with the
+context the steps after it will be templated with. A snapshot of the step's
+workspace is hardlinked next to the workspace until the next step finishes, so
+a resumed run can carry on from the first step that didn't finish, with the
+same files and context as if it had never stopped. Snapshots are kept on the
+same filesystem as the workspaces so they never copy the files, and if they
+can't be hardlinked the step isn't recorded.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import logging
+import os
+from os import path
+import re
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional, TYPE_CHECKING
+import uuid
+
+from . import cleanup, config, hashing
+
+if TYPE_CHECKING:
+    from .steps.base_step import BaseStep
+
+JOURNAL_FILE_NAME = "journal.json"
+"""The name of the journal file in a run's folder."""
+
+MAX_AGE_DAYS = 14
+"""How long to keep the journals of runs that didn't finish."""
+
+UNSAVED_CONTEXT_KEYS = ["build_def"]
+"""Context keys that aren't saved, as they're recreated from the config when
+resuming."""
+
+
+@dataclass
+class Checkpoint:
+    """The saved workspace of the last step that finished. Stands in for
+    that step when the next step imports its workspace."""
+    workspace: str
+
+
+class TargetJournal:
+    """The journal of the steps run for one target.
+
+    Attributes:
+        target: The target the steps are run for.
+        steps: The index in the config of each step that matched the filters,
+            or None if the steps haven't been collected yet.
+        completed: How many of the steps have finished.
+        context: The context after the last step that finished.
+    """
+    def __init__(self, run: RunJournal, target: str, data: dict) -> None:
+        self.run = run
+        self.target = target
+        self.steps: Optional[List[int]] = data.get("steps")
+        self.completed: int = data.get("completed", 0)
+        self.context: Dict[str, Any] = data.get("context", {})
+        self._workspace: Optional[str] = data.get("workspace")
+
+    @property
+    def done(self) -> bool:
+        return self.steps is not None and self.completed == len(self.steps)
+
+    def restore_context(self, context: dict) -> None:
+        """Put the context saved when the last step finished into a
+        context."""
+        context.update(self.context)
+
+    def check_steps(self, steps: List[int]) -> None:
+        """Record the steps that matched the filters, or check they're the
+        same as when the run started.
+
+        Raises:
+            ValueError: If different steps matched when resuming.
+        """
+        if self.steps is None:
+            self.steps = list(steps)
+            self.run.save()
+        elif self.steps != list(steps):
+            raise ValueError(
+                f"Different steps matched for {self.target} than when run "
+                f"{self.run.run_id} started")
+
+    def checkpoint(self) -> Optional[Checkpoint]:
+        """Get the saved workspace of the last step that finished, or None if
+        no steps have finished."""
+        if self._workspace is None:
+            return None
+        return Checkpoint(path.join(self.run.folder, self._workspace))
+
+    def step_completed(self, step: BaseStep, completed: int,
+                       context: dict) -> None:
+        """Record that a step finished, keeping a snapshot of its workspace
+        and the context after it. 'completed' is how many of the steps have
+        finished with it. If the workspace can't be hardlinked, nothing is
+        recorded, and a resumed run carries on after the last step that
+        was."""
+        snapshot = path.join(self.run.snapshots_folder(step.workspace),
+                             self.target, str(completed))
+        if not _link_tree(step.workspace, snapshot):
+            return
+        previous_workspace = self._workspace
+        self.completed = completed
+        self._workspace = snapshot
+        self.context = _saveable_context(context)
+        self.run.save()
+
+        # we only need the workspace of the last step that finished
+        if previous_workspace is not None:
+            cleanup.remove_tree(path.join(self.run.folder, previous_workspace))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "steps": self.steps,
+            "completed": self.completed,
+            "context": self.context,
+            "workspace": self._workspace
+        }
+
+
+class RunJournal:
+    """The journal of a run of a command, i.e. a release.
+
+    Attributes:
+        run_id: The ID of the run, given to '--resume' to resume it.
+        folder: The folder the journal and saved workspaces are in.
+        command: The command that was run.
+        args: The arguments the command was run with.
+        options: The options used to filter steps.
+    """
+    def __init__(self, run_id: str, data: Dict[str, Any]) -> None:
+        self.run_id = run_id
+        self.folder = path.join(runs_dir(), run_id)
+        self.command: str = data["command"]
+        self.args: Dict[str, Any] = data["args"]
+        self.options: List[str] = data["options"]
+        self.config_hash: str = data["config_hash"]
+        self.created: float = data["created"]
+        self.snapshots: Optional[str] = data.get("snapshots")
+        self._targets = {
+            target: TargetJournal(self, target, target_data)
+            for target, target_data in data.get("targets", {}).items()
+        }
+        self._lock = threading.Lock()
+
+    def target(self, target: str) -> TargetJournal:
+        """Get the journal of a target, starting it if needed."""
+        with self._lock:
+            if target not in self._targets:
+                self._targets[target] = TargetJournal(self, target, {})
+            return self._targets[target]
+
+    def snapshots_folder(self, workspace: str) -> str:
+        """Get the folder snapshots of workspaces are kept in, putting it
+        next to the given workspace if there isn't one yet."""
+        with self._lock:
+            if self.snapshots is None:
+                self.snapshots = path.join(path.dirname(workspace),
+                                           f"toriicli-run-{self.run_id}")
+            return self.snapshots
+
+    def save(self) -> None:
+        with self._lock:
+            data = {
+                "version": 1,
+                "command": self.command,
+                "args": self.args,
+                "options": self.options,
+                "config_hash": self.config_hash,
+                "created": self.created,
+                "snapshots": self.snapshots,
+                "targets": {
+                    target: target_journal.to_dict()
+                    for target, target_journal in self._targets.items()
+                }
+            }
+            os.makedirs(self.folder, exist_ok=True)
+            journal_path = path.join(self.folder, JOURNAL_FILE_NAME)
+            temp_path = f"{journal_path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as journal_file:
+                json.dump(data, journal_file, indent=2)
+            os.replace(temp_path, journal_path)
+
+    def finish(self) -> None:
+        """Delete the journal and its snapshots, as the run finished."""
+        _remove(self.folder, self.snapshots)
+
+
+def runs_dir() -> str:
+    """Get the folder journals are kept in."""
+    return path.join(config.user_cache_dir(), "runs")
+
+
+def create(command: str, args: Dict[str, Any], options: List[str],
+           config_path: str) -> RunJournal:
+    """Start the journal of a new run. Journals of old runs that didn't
+    finish are deleted."""
+    _prune()
+    run_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-" \
+        f"{uuid.uuid4().hex[:6]}"
+    run = RunJournal(
+        run_id, {
+            "command": command,
+            "args": args,
+            "options": list(options),
+            "config_hash": hashing.hash_file(config_path),
+            "created": time.time()
+        })
+    run.save()
+    return run
+
+
+def load(run_id: str, command: str, config_path: str) -> RunJournal:
+    """Load the journal of a run to resume it.
+
+    Raises:
+        ValueError: If there was no such run, it was a different command, or
+            the config changed since it started.
+    """
+    if not re.fullmatch(r"[\w-]+", run_id):
+        raise ValueError(f"Invalid run ID '{run_id}'")
+    journal_path = path.join(runs_dir(), run_id, JOURNAL_FILE_NAME)
+    try:
+        with open(journal_path, "r") as journal_file:
+            run = RunJournal(run_id, json.load(journal_file))
+    except FileNotFoundError:
+        raise ValueError(f"No run to resume with ID '{run_id}'")
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        raise ValueError(f"Unable to read journal of run '{run_id}': {err}")
+
+    if run.command != command:
+        raise ValueError(f"Run '{run_id}' was a {run.command}, not a "
+                         f"{command}")
+    if run.config_hash != hashing.hash_file(config_path):
+        raise ValueError(f"Unable to resume run '{run_id}', as "
+                         f"{config_path} changed since it started")
+    return run
+
+
+def _prune() -> None:
+    if not path.isdir(runs_dir()):
+        return
+    oldest = time.time() - MAX_AGE_DAYS * 24 * 60 * 60
+    for entry in os.scandir(runs_dir()):
+        journal_path = path.join(entry.path, JOURNAL_FILE_NAME)
+        try:
+            if path.getmtime(journal_path) >= oldest:
+                continue
+        except OSError:
+            continue
+        try:
+            with open(journal_path, "r") as journal_file:
+                snapshots = json.load(journal_file).get("snapshots")
+        except (OSError, ValueError, AttributeError):
+            snapshots = None
+        logging.debug(f"Removing old run journal {entry.name}")
+        _remove(entry.path, snapshots)
+
+
+def _remove(folder: str, snapshots: Optional[str]) -> None:
+    if snapshots is not None:
+        cleanup.remove_tree(snapshots)
+    cleanup.remove_tree(folder)
+
+
+def _saveable_context(context: dict) -> Dict[str, Any]:
+    saveable = {}
+    for key, value in context.items():
+        if key in UNSAVED_CONTEXT_KEYS:
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            logging.warning(f"Unable to save '{key}' from the context in the "
+                            "run journal, it won't be there when resuming")
+            continue
+        saveable[key] = value
+    return saveable
+
+
+def _link_tree(src: str, dst: str) -> bool:
+    """Hardlink the files of a folder into another. Workspaces aren't changed
+    after their step finishes, so sharing files is safe. Nothing is copied,
+    so returns False if the files couldn't be linked."""
+    if path.exists(dst):
+        shutil.rmtree(dst)
+    os.makedirs(path.dirname(dst), exist_ok=True)
+    try:
+        shutil.copytree(src, dst, copy_function=os.link)
+    except (OSError, shutil.Error) as err:
+        logging.warning(f"Unable to snapshot workspace for the run journal, "
+                        f"the step won't be recorded: {err}")
+        shutil.rmtree(dst, ignore_errors=True)
+        return False
+    return True
@@ -0,0 +1,101 @@
+"""Limits on how many of certain things can happen at once across everything
+toriicli is running, i.e. when serving jobs or running a batch.
+
+Each resource has an optional limit on how many holders it can have at once,
+which is unlimited unless it's set. A resource can also be held with a key,
+in which case only one holder can have that key at a time, i.e. to only run
+Unity once per project.
+"""
+from contextlib import contextmanager
+import threading
+from typing import Dict, Iterator, Mapping, Optional
+
+UNITY = "unity"
+"""Running Unity."""
+
+COMPRESS = "compress"
+"""CPU-heavy work, like compressing archives and making deltas."""
+
+TRANSFER = "transfer"
+"""Transferring files to and from storage."""
+
+PROJECT = "project"
+"""Running a job in a project."""
+
+RESOURCES = [UNITY, COMPRESS, TRANSFER, PROJECT]
+
+_lock = threading.Lock()
+_limits: Dict[str, Optional[int]] = {}
+_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_key_locks: Dict[str, threading.Lock] = {}
+_holders: Dict[str, int] = {}
+
+
+def set_limit(resource: str, limit: Optional[int]) -> None:
+    """Set how many holders a resource can have at once, or None for
+    unlimited. Only affects holders that start after it's set.
+
+    Raises:
+        ValueError: If the limit was less than 1.
+    """
+    if limit is not None and limit < 1:
+        raise ValueError(f"Invalid limit for {resource}: {limit}")
+    with _lock:
+        _limits[resource] = limit
+        if limit is None:
+            _semaphores.pop(resource, None)
+        else:
+            _semaphores[resource] = threading.BoundedSemaphore(limit)
+
+
+def set_limits(limits: Mapping[str, Optional[int]]) -> None:
+    """Set the limits of several resources."""
+    for resource, limit in limits.items():
+        set_limit(resource, limit)
+
+
+def get_limits() -> Dict[str, Optional[int]]:
+    with _lock:
+        return {
+            resource: _limits.get(resource)
+            for resource in sorted(set(RESOURCES) | set(_limits))
+        }
+
+
+def holders() -> Dict[str, int]:
+    """Get how many holders each resource has right now."""
+    with _lock:
+        return dict(_holders)
+
+
+@contextmanager
+def hold(resource: str, key: Optional[str] = None) -> Iterator[None]:
+    """Hold a resource, waiting until it's under its limit. If a key is
+    given, also wait until nothing else holds the resource with that key."""
+    with _lock:
+        semaphore = _semaphores.get(resource)
+        key_lock = None
+        if key is not None:
+            key_lock = _key_locks.setdefault(f"{resource}:{key}",
+                                             threading.Lock())
+
+    # take the key first, so we don't use up the limit while waiting on it
+    if key_lock is not None:
+        key_lock.acquire()
+    try:
+        if semaphore is not None:
+            semaphore.acquire()
+        try:
+            with _lock:
+                _holders[resource] = _holders.get(resource, 0) + 1
+            try:
+                yield
+            finally:
+                with _lock:
+                    _holders[resource] -= 1
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+    finally:
+        if key_lock is not None:
+            key_lock.release()
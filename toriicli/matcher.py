@@ -0,0 +1,166 @@
+"""Matching files in a folder against include and exclude glob patterns."""
+from dataclasses import dataclass, field
+import os
+import re
+from typing import List, Optional, Pattern, Union
+
+Patterns = Union[str, List[str]]
+"""One or more glob patterns. Patterns starting with '!' exclude paths."""
+
+
+@dataclass
+class MatchResult:
+    """The paths in a folder that matched.
+
+    Attributes:
+        files: The relative path of each matching file.
+        dirs: The relative path of each matching folder. Every path under a
+            matching folder also matches, unless it's excluded.
+        byte_count: The total size of the matching files.
+    """
+    files: List[str] = field(default_factory=list)
+    dirs: List[str] = field(default_factory=list)
+    byte_count: int = 0
+
+    @property
+    def file_count(self) -> int:
+        return len(self.files)
+
+
+class Matcher:
+    """Matches relative paths against glob patterns.
+
+    Paths are matched with '/' as the separator. '*' and '?' match within a
+    single folder, and '**' matches any number of folders. A folder that
+    matches includes everything in it. Patterns starting with '!' exclude
+    paths, and everything in excluded folders.
+
+    Args:
+        patterns: The patterns to match, i.e. ['**', '!*.pdb'].
+
+    Raises:
+        ValueError: If there were no include patterns.
+    """
+    def __init__(self, patterns: Patterns) -> None:
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        includes = [p for p in patterns if not p.startswith("!")]
+        excludes = [p[1:] for p in patterns if p.startswith("!")]
+        if len(includes) == 0:
+            raise ValueError(f"No patterns to include in {patterns}")
+
+        self.patterns = list(patterns)
+        self._include = _compile(includes)
+        self._exclude = _compile(excludes) if len(excludes) > 0 else None
+
+        # the leading folders each include pattern needs, so we can skip
+        # folders that nothing could match inside of
+        self._include_prefixes = [
+            _compile_prefixes(pattern) for pattern in includes
+        ]
+
+    def matches(self, rel_path: str) -> bool:
+        """Check whether a path matches, ignoring the folders it's in."""
+        rel_path = rel_path.replace(os.sep, "/")
+        return self._include.fullmatch(rel_path) is not None \
+            and not self.excluded(rel_path)
+
+    def excluded(self, rel_path: str) -> bool:
+        return self._exclude is not None \
+            and self._exclude.fullmatch(rel_path) is not None
+
+    def walk(self, root: str) -> MatchResult:
+        """Find the files and folders in a folder that match, walking it
+        once. Excluded folders aren't walked."""
+        result = MatchResult()
+        self._walk(root, "", False, result)
+        return result
+
+    def _walk(self, folder: str, rel_folder: str, included: bool,
+              result: MatchResult) -> None:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                rel_path = rel_folder + entry.name
+                if self.excluded(rel_path):
+                    continue
+                entry_included = included or self._include.fullmatch(
+                    rel_path) is not None
+                if entry.is_dir():
+                    if entry_included:
+                        result.dirs.append(rel_path)
+                    if entry_included or self._could_match_in(rel_path):
+                        self._walk(entry.path, rel_path + "/", entry_included,
+                                   result)
+                elif entry_included:
+                    result.files.append(rel_path)
+                    result.byte_count += entry.stat().st_size
+
+    def _could_match_in(self, rel_folder: str) -> bool:
+        """Check whether any include pattern could match paths inside a
+        folder."""
+        depth = rel_folder.count("/") + 1
+        for prefixes in self._include_prefixes:
+            if prefixes is None:
+                return True  # the pattern has a '**' in the way
+            if len(prefixes) > depth \
+                    and prefixes[depth - 1].fullmatch(rel_folder):
+                return True
+        return False
+
+
+def _compile(patterns: List[str]) -> Pattern:
+    return re.compile("|".join(f"(?:{_translate(p)})" for p in patterns))
+
+
+def _compile_prefixes(pattern: str) -> Optional[List[Pattern]]:
+    """Compile the leading folders of a pattern, i.e. for 'a/b*/c' that's
+    'a' and 'a/b*'. Returns None if the pattern has a '**' in its folders, as
+    then it could match at any depth."""
+    parts = pattern.strip("/").split("/")
+    if "**" in parts[:-1]:
+        return None
+    return [
+        re.compile(_translate("/".join(parts[:i + 1])))
+        for i in range(len(parts))
+    ]
+
+
+def _translate(pattern: str) -> str:
+    """Translate a glob pattern into a regex."""
+    parts = pattern.strip("/").split("/")
+    regex = ""
+    for i, part in enumerate(parts):
+        last = i == len(parts) - 1
+        if part == "**":
+            regex += ".*" if last else "(?:.*/)?"
+            continue
+        regex += _translate_part(part)
+        if not last:
+            regex += "/"
+    return regex
+
+
+def _translate_part(part: str) -> str:
+    """Translate part of a glob pattern between slashes into a regex."""
+    regex = ""
+    i = 0
+    while i < len(part):
+        c = part[i]
+        i += 1
+        if c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[":
+            end = part.find("]", i + 1 if part[i:i + 1] in ("!", "]") else i)
+            if end == -1:
+                regex += "\\["
+                continue
+            chars = part[i:end].replace("\\", "\\\\")
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex += f"[{chars}]"
+            i = end + 1
+        else:
+            regex += re.escape(c)
+    return regex
@@ -0,0 +1,381 @@
+"""Recording metrics of builds and releases, for tracking them on dashboards.
+
+Metrics are written as JSON lines as they're recorded, one object per step,
+child process and run, and can also be written in the Prometheus textfile
+format once toriicli finishes. Steps record their wall time, the bytes and
+files that went in and out of their workspace, and the storage requests,
+retries and bytes transferred while they ran. Child processes (Unity, NuGet,
+butler) record how long they ran for, and butler pushes record how much they
+uploaded.
+
+Metrics are labelled with the target and step running on the current thread.
+Things recorded on other threads (i.e. in a pool of downloads) are counted
+towards the step started most recently.
+"""
+from __future__ import annotations
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+from os import path
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .process import ProcessResult
+
+_lock = threading.Lock()
+_local = threading.local()
+_jsonl_path: Optional[str] = None
+_prometheus_path: Optional[str] = None
+_command: Optional[str] = None
+_start_time = 0.0
+_active: List[StepMetrics] = []
+_steps: List[StepMetrics] = []
+_processes: List[Dict[str, Any]] = []
+_pushes: List[Dict[str, Any]] = []
+
+
+@dataclass
+class StepMetrics:
+    """The metrics of a step.
+
+    Attributes:
+        target: The target the step ran for.
+        step: The name of the step.
+        index: The position of the step in the pipeline.
+        wall_time: How many seconds the step took.
+        success: Whether the step succeeded.
+        bytes_in: The size of the files kept from the previous step.
+        files_in: How many files were kept from the previous step.
+        bytes_out: The size of the files in the workspace afterwards.
+        files_out: How many files were in the workspace afterwards.
+        bytes_downloaded: How many bytes were retrieved from storage.
+        bytes_uploaded: How many bytes were stored in storage.
+        requests: How many storage requests were made, by operation.
+        retries: How many storage requests were retried.
+    """
+    target: str
+    step: str
+    index: int
+    wall_time: float = 0.0
+    success: bool = False
+    bytes_in: int = 0
+    files_in: int = 0
+    bytes_out: int = 0
+    files_out: int = 0
+    bytes_downloaded: int = 0
+    bytes_uploaded: int = 0
+    requests: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    retries: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """How many bytes per second were transferred to and from storage,
+        or went through the workspace if nothing was transferred."""
+        if self.wall_time <= 0:
+            return 0.0
+        transferred = self.bytes_downloaded + self.bytes_uploaded
+        if transferred == 0:
+            transferred = self.bytes_in + self.bytes_out
+        return transferred / self.wall_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": "step",
+            "target": self.target,
+            "step": self.step,
+            "index": self.index,
+            "wall_time": self.wall_time,
+            "success": self.success,
+            "bytes_in": self.bytes_in,
+            "files_in": self.files_in,
+            "bytes_out": self.bytes_out,
+            "files_out": self.files_out,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_uploaded": self.bytes_uploaded,
+            "requests": dict(self.requests),
+            "retries": self.retries,
+            "throughput": self.throughput
+        }
+
+
+def enable(jsonl_path: Optional[str],
+           prometheus_path: Optional[str] = None,
+           command: Optional[str] = None) -> None:
+    """Start recording metrics, writing them as JSON lines to a file, and
+    optionally to a Prometheus textfile when finished."""
+    global _jsonl_path, _prometheus_path, _command, _start_time
+    _jsonl_path = jsonl_path
+    _prometheus_path = prometheus_path
+    _command = command
+    _start_time = time.monotonic()
+    with _lock:
+        # forget anything recorded by an earlier run in this process, i.e.
+        # when serving jobs
+        _steps.clear()
+        _processes.clear()
+        _pushes.clear()
+    if _jsonl_path is not None:
+        # start the file afresh for this run
+        open(_jsonl_path, "w").close()
+
+
+def enabled() -> bool:
+    return _jsonl_path is not None or _prometheus_path is not None
+
+
+@contextmanager
+def labels(target: str) -> Iterator[None]:
+    """Label metrics recorded on this thread with a target, i.e. while
+    Unity builds it."""
+    previous = getattr(_local, "target", None)
+    _local.target = target
+    try:
+        yield
+    finally:
+        _local.target = previous
+
+
+@contextmanager
+def step(target: str, name: str, index: int) -> Iterator[StepMetrics]:
+    """Record the metrics of a step while it runs. The step counts as
+    successful if the caller sets success on the metrics."""
+    metrics = StepMetrics(target, name, index)
+    previous = getattr(_local, "step", None)
+    _local.step = metrics
+    with _lock:
+        _active.append(metrics)
+    start_time = time.monotonic()
+    try:
+        with labels(target):
+            yield metrics
+    finally:
+        metrics.wall_time = time.monotonic() - start_time
+        _local.step = previous
+        with _lock:
+            _active.remove(metrics)
+            _steps.append(metrics)
+        _write(metrics.to_dict())
+
+
+def request(operation: str, retries: int = 0) -> None:
+    """Count a storage request, i.e. 's3.GetObject'."""
+    if not enabled():
+        return
+    with _lock:
+        metrics = _current_step()
+        if metrics is not None:
+            metrics.requests[operation] += 1
+            metrics.retries += retries
+
+
+def transferred(downloaded: int = 0, uploaded: int = 0) -> None:
+    """Count bytes transferred to or from storage."""
+    if not enabled():
+        return
+    with _lock:
+        metrics = _current_step()
+        if metrics is not None:
+            metrics.bytes_downloaded += downloaded
+            metrics.bytes_uploaded += uploaded
+
+
+def process(result: ProcessResult) -> None:
+    """Record how long a child process ran for."""
+    if not enabled():
+        return
+    with _lock:
+        metrics = _current_step()
+    target = getattr(_local, "target", None)
+    if target is None and metrics is not None:
+        target = metrics.target
+    record = {
+        "type": "process",
+        "target": target,
+        "step": None if metrics is None else metrics.step,
+        "program": path.basename(result.args[0]),
+        "wall_time": result.wall_time,
+        "cpu_time": result.cpu_time,
+        "returncode": result.returncode,
+        "timed_out": result.timed_out
+    }
+    with _lock:
+        _processes.append(record)
+    _write(record)
+
+
+def butler_push(channel: str, success: bool, wall_time: float,
+                uploaded_bytes: Optional[int],
+                patch_bytes: Optional[int]) -> None:
+    """Record a butler push to a channel, and how much it uploaded if butler
+    said."""
+    if not enabled():
+        return
+    metrics = getattr(_local, "step", None)
+    record = {
+        "type": "butler_push",
+        "target": getattr(_local, "target", None),
+        "step": None if metrics is None else metrics.step,
+        "channel": channel,
+        "success": success,
+        "wall_time": wall_time,
+        "uploaded_bytes": uploaded_bytes,
+        "patch_bytes": patch_bytes
+    }
+    with _lock:
+        _pushes.append(record)
+    _write(record)
+
+
+def finish(success: bool = True) -> None:
+    """Stop recording, writing the metrics of the whole run."""
+    global _jsonl_path, _prometheus_path
+    if not enabled():
+        return
+    wall_time = time.monotonic() - _start_time
+    _write({
+        "type": "run",
+        "command": _command,
+        "wall_time": wall_time,
+        "success": success
+    })
+    if _prometheus_path is not None:
+        try:
+            _write_prometheus(_prometheus_path, wall_time, success)
+        except OSError as err:
+            logging.error(f"Unable to write metrics to {_prometheus_path}: "
+                          f"{err}")
+    _jsonl_path = None
+    _prometheus_path = None
+
+
+def _current_step() -> Optional[StepMetrics]:
+    metrics = getattr(_local, "step", None)
+    if metrics is None and len(_active) > 0:
+        metrics = _active[-1]
+    return metrics
+
+
+def _write(record: Dict[str, Any]) -> None:
+    if _jsonl_path is None:
+        return
+    record["timestamp"] = time.time()
+    line = json.dumps(record) + "\n"
+    with _lock:
+        try:
+            with open(_jsonl_path, "a") as metrics_file:
+                metrics_file.write(line)
+        except OSError as err:
+            logging.error(f"Unable to write metrics to {_jsonl_path}: {err}")
+
+
+def _write_prometheus(prometheus_path: str, wall_time: float,
+                      success: bool) -> None:
+    """Write the metrics in the Prometheus textfile format. The file is
+    replaced in one go, so the node exporter never sees it half-written."""
+    lines = []
+
+    def metric(name: str, kind: str, help_text: str,
+               samples: List[tuple]) -> None:
+        lines.append(f"# HELP toriicli_{name} {help_text}")
+        lines.append(f"# TYPE toriicli_{name} {kind}")
+        for sample_labels, value in samples:
+            label_text = ",".join(f'{k}="{_escape(v)}"'
+                                  for k, v in sample_labels.items())
+            lines.append(f"toriicli_{name}{{{label_text}}} {value}")
+
+    with _lock:
+        steps = list(_steps)
+        processes = list(_processes)
+        pushes = list(_pushes)
+
+    def step_samples(attribute: str) -> List[tuple]:
+        return [(_step_labels(s), getattr(s, attribute)) for s in steps]
+
+    metric("run_duration_seconds", "gauge", "Wall time of the run.",
+           [({
+               "command": _command or ""
+           }, wall_time)])
+    metric("run_success", "gauge", "Whether the run succeeded.",
+           [({
+               "command": _command or ""
+           }, int(success))])
+    metric("step_duration_seconds", "gauge", "Wall time of each step.",
+           step_samples("wall_time"))
+    metric("step_success", "gauge", "Whether each step succeeded.",
+           [(_step_labels(s), int(s.success)) for s in steps])
+    metric("step_bytes_in", "gauge",
+           "Bytes kept from the previous step's workspace.",
+           step_samples("bytes_in"))
+    metric("step_files_in", "gauge",
+           "Files kept from the previous step's workspace.",
+           step_samples("files_in"))
+    metric("step_bytes_out", "gauge",
+           "Bytes in each step's workspace afterwards.",
+           step_samples("bytes_out"))
+    metric("step_files_out", "gauge",
+           "Files in each step's workspace afterwards.",
+           step_samples("files_out"))
+    metric("step_storage_bytes_total", "counter",
+           "Bytes transferred to and from storage by each step.",
+           [(dict(_step_labels(s), direction="download"), s.bytes_downloaded)
+            for s in steps] +
+           [(dict(_step_labels(s), direction="upload"), s.bytes_uploaded)
+            for s in steps])
+    metric("step_storage_requests_total", "counter",
+           "Storage requests made by each step.",
+           [(dict(_step_labels(s), operation=op), count) for s in steps
+            for op, count in sorted(s.requests.items())])
+    metric("step_storage_retries_total", "counter",
+           "Storage requests retried by each step.", step_samples("retries"))
+    metric("step_throughput_bytes_per_second", "gauge",
+           "Throughput of each step.", step_samples("throughput"))
+    metric("process_duration_seconds", "gauge",
+           "Wall time of each child process.", [({
+               "target": p["target"] or "",
+               "step": p["step"] or "",
+               "program": p["program"],
+               "index": str(i)
+           }, p["wall_time"]) for i, p in enumerate(processes)])
+
+    def push_samples(attribute: str) -> List[tuple]:
+        return [({
+            "target": p["target"] or "",
+            "step": p["step"] or "",
+            "channel": p["channel"]
+        }, p[attribute]) for p in pushes if p[attribute] is not None]
+
+    metric("butler_push_duration_seconds", "gauge",
+           "Wall time of each butler push.", push_samples("wall_time"))
+    metric("butler_push_success", "gauge",
+           "Whether each butler push succeeded.",
+           [(s_labels, int(value))
+            for s_labels, value in push_samples("success")])
+    metric("butler_push_uploaded_bytes",
+           "gauge", "Bytes uploaded by each butler push.",
+           push_samples("uploaded_bytes"))
+    metric("butler_push_patch_bytes", "gauge",
+           "Size of the patch made by each butler push.",
+           push_samples("patch_bytes"))
+
+    temp_path = f"{prometheus_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", newline="\n") as prometheus_file:
+        prometheus_file.write("\n".join(lines) + "\n")
+    os.replace(temp_path, prometheus_path)
+
+
+def _step_labels(metrics: StepMetrics) -> Dict[str, str]:
+    return {
+        "target": metrics.target,
+        "step": metrics.step,
+        "index": str(metrics.index)
+    }
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n",
+                                                    "\\n").replace('"', '\\"')
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 import logging
 import os
@@ -5,11 +6,13 @@ from os import path
 import pkg_resources
 import re
 import shutil
-import subprocess
-from typing import Tuple, List, Optional
+from typing import Dict, Tuple, List, Optional
+import zipfile
 
 import xmltodict
 
+from . import nuget_cache, process, sync
+
 PACKAGE_REGEX = re.compile(r"^([A-Za-z\.-]*)\.(\d+(?:\.\d+){2,3}).*$")
 """Regex to extract a name and version from a NuGet package folder name.
 i.e. for Newtonsoft.Json.12.0.1, would extract 'Newtonsoft.Json' 
@@ -17,6 +20,18 @@ and '12.0.1'.
 Also handles weird versioning, i.e. MoonSharp.2.0.0.0 extracts 'MoonSharp' and
 '2.0.0' (leaving out the last zero). Thanks, MoonSharp."""
 
+COPY_WORKERS = 8
+"""How many packages to copy into the project at once."""
+
+NUPKG_EXTENSION = ".nupkg"
+"""The extension of NuGet package files."""
+
+INSTALL_JOBS = 4
+"""How many NuGet installs to run at once by default."""
+
+PackageSpec = Tuple[str, Optional[str]]
+"""A package to install, as its name and version (or None for the latest)."""
+
 
 @dataclass
 class NuGetPackage:
@@ -25,6 +40,115 @@ class NuGetPackage:
     framework: str
 
 
+class PackageIndex:
+    """The packages in a project's packages.config, and the packages that
+    have been downloaded to its nuget-packages folder.
+
+    packages.config is parsed once, and changes to it are only written back
+    when save() is called. Package names are looked up case-insensitively, as
+    NuGet package IDs are.
+    """
+    def __init__(self, project_path: str) -> None:
+        self.project_path = project_path
+        self.config_path = path.join(project_path, "packages.config")
+        self.packages_path = path.join(project_path, "nuget-packages")
+        # the parsed <package> elements, kept so attributes we don't know
+        # about (i.e. developmentDependency) survive being saved
+        self._packages: Dict[str, Dict[str, str]] = {}
+        self._downloaded: Optional[Dict[str, Dict[str, str]]] = None
+        self._changed = False
+
+        with open(self.config_path, 'rb') as packages_config:
+            self._parsed = xmltodict.parse(packages_config,
+                                           force_list=("package"))
+
+        # handle empty packages.config
+        if self._parsed["packages"] is not None:
+            for package in self._parsed["packages"].get("package", []):
+                self._packages[package["@id"].lower()] = package
+
+    @property
+    def packages(self) -> List[NuGetPackage]:
+        """The packages in packages.config."""
+        return [_package_from_xml(p) for p in self._packages.values()]
+
+    def get(self, package_name: str) -> Optional[NuGetPackage]:
+        """Get a package from packages.config, or None if it wasn't there."""
+        package = self._packages.get(package_name.lower())
+        return None if package is None else _package_from_xml(package)
+
+    def __contains__(self, package_name: str) -> bool:
+        return package_name.lower() in self._packages
+
+    def add(self, package: NuGetPackage) -> None:
+        """Add a package to packages.config, replacing it if it was already
+        there."""
+        package_xml = self._packages.setdefault(package.name.lower(), {})
+        package_xml["@id"] = package.name
+        package_xml["@version"] = package.version
+        package_xml["@targetFramework"] = package.framework
+        self._changed = True
+
+    def remove(self, package_name: str) -> Optional[NuGetPackage]:
+        """Remove a package from packages.config. Returns the package, or
+        None if it wasn't there."""
+        package = self._packages.pop(package_name.lower(), None)
+        if package is None:
+            return None
+        self._changed = True
+        return _package_from_xml(package)
+
+    def find_downloaded(self,
+                        package_name: str,
+                        version: Optional[str] = None) -> Optional[str]:
+        """Find the folder a package was downloaded to in nuget-packages.
+        If no version is given, the newest downloaded version is used.
+
+        Returns None if the package hadn't been downloaded.
+        """
+        if self._downloaded is None:
+            self.refresh_downloaded()
+        versions = self._downloaded.get(package_name.lower(), {})
+        if version is not None:
+            return versions.get(version)
+        if len(versions) == 0:
+            return None
+        return versions[max(versions, key=_version_key)]
+
+    def refresh_downloaded(self) -> None:
+        """Rescan the nuget-packages folder, i.e. after installing
+        packages."""
+        self._downloaded = {}
+        if not path.isdir(self.packages_path):
+            return
+        for entry in os.scandir(self.packages_path):
+            match = PACKAGE_REGEX.fullmatch(entry.name)
+            if not entry.is_dir() or match is None:
+                continue
+            name, version = match.group(1), match.group(2)
+            self._downloaded.setdefault(name.lower(), {})[version] = entry.path
+
+    def save(self) -> None:
+        """Write any changes back to packages.config. The file is replaced in
+        one go, so it's never left half-written."""
+        if not self._changed:
+            return
+        if self._parsed["packages"] is None:
+            self._parsed["packages"] = {}
+        self._parsed["packages"]["package"] = list(self._packages.values())
+
+        temp_path = f"{self.config_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as packages_config:
+            packages_config.write(xmltodict.unparse(self._parsed, pretty=True))
+        os.replace(temp_path, self.config_path)
+        self._changed = False
+
+
+def _package_from_xml(package: Dict[str, str]) -> NuGetPackage:
+    return NuGetPackage(package["@id"], package["@version"],
+                        package["@targetFramework"])
+
+
 def create_config(config_path: str, exist_ok: bool) -> bool:
     """Create the NuGet config in a given path. Returns None if the file 
     already existed and exist_ok was set to False."""
@@ -57,22 +181,46 @@ def create_config(config_path: str, exist_ok: bool) -> bool:
     return True
 
 
-def restore_packages(project_path: str, project_name: str,
-                     project_install_path: str) -> bool:
+def restore_packages(project_path: str,
+                     project_name: str,
+                     project_install_path: str,
+                     target_framework: str,
+                     local_feed: Optional[str] = None,
+                     cache: Optional[nuget_cache.PackageCache] = None,
+                     limits: Optional[process.ResourceLimits] = None) -> bool:
     """Run a NuGet restore for packages in packages.config, and copy them
-    all over to the Torii project."""
-    # run NuGet restore to download the packages
-    success, exit_code = _run_restore(project_path, project_name)
-    if not success:
-        logging.error(f"nuget restore failed with exit code {exit_code}")
-        return False
+    all over to the Torii project.
+
+    If a local feed folder is given, packages are extracted from the .nupkg
+    files in it straight into the project instead, without running NuGet.
+
+    If a package cache is given, packages are linked into the project from
+    the cache, and NuGet is only run if some packages weren't cached.
+
+    If limits are given, they're applied to NuGet.
+    """
+    if local_feed is not None:
+        return _restore_from_feed(project_path,
+                                  PackageIndex(project_path).packages,
+                                  path.join(project_path, local_feed),
+                                  project_install_path, target_framework)
 
     # gather info about the packages from the packages config
-    packages = _gather_nuget_packages(project_path)
+    packages = PackageIndex(project_path).packages
+
+    # run NuGet restore to download the packages, unless we already have them
+    if cache is not None and all(package in cache for package in packages):
+        logging.info("All packages were in the NuGet package cache, skipping "
+                     "nuget restore")
+    else:
+        success, exit_code = _run_restore(project_path, project_name, limits)
+        if not success:
+            logging.error(f"nuget restore failed with exit code {exit_code}")
+            return False
 
     # copy the downloaded packages into the project
     success = _copy_packages_to_project(project_path, packages,
-                                        project_install_path)
+                                        project_install_path, cache)
     return success
 
 
@@ -80,41 +228,127 @@ def install_package(project_path: str, package_name: str,
                     version: Optional[str], target_framework: str,
                     project_install_path: str) -> bool:
     """Install a NuGet package to the Torii project."""
-    logging.info(f"Attempting to install NuGet package '{package_name}'")
-
-    # first check to see if it's already installed
-    if _package_installed(project_path, package_name):
-        logging.info(f"Package '{package_name}' was already installed!"
-                     " Doing nothing.")
+    return install_packages(project_path, [(package_name, version)],
+                            target_framework, project_install_path)
+
+
+def install_packages(project_path: str,
+                     requested: List[PackageSpec],
+                     target_framework: str,
+                     project_install_path: str,
+                     max_concurrency: int = INSTALL_JOBS,
+                     cache: Optional[nuget_cache.PackageCache] = None,
+                     limits: Optional[process.ResourceLimits] = None) -> bool:
+    """Install NuGet packages to the Torii project. The packages are
+    installed concurrently, and packages.config is written once at the end.
+
+    Args:
+        project_path: The path to the project.
+        requested: The name of each package, and the version to install (or
+            None for the latest).
+        target_framework: The .NET Framework version to find targets for.
+        project_install_path: Where in the project's Assets to put packages.
+        max_concurrency: How many packages to install at once.
+        cache: The package cache to add installed packages to, if any.
+        limits: Limits on the resources each NuGet process can use.
+
+    Returns:
+        bool: False if any package couldn't be installed. Packages that were
+            installed are kept either way.
+    """
+    index = PackageIndex(project_path)
+
+    # first check to see which are already installed
+    not_installed = {}
+    for package_name, version in requested:
+        if package_name in index:
+            logging.info(f"Package '{package_name}' was already installed!"
+                         " Doing nothing.")
+        else:
+            not_installed[package_name.lower()] = (package_name, version)
+    to_install = list(not_installed.values())
+    if len(to_install) == 0:
         return True
 
-    # install the package
-    success, exit_code = _run_install(project_path, package_name, version)
-    if not success:
-        logging.error(
-            f"nuget install {package_name} failed with exit code {exit_code}")
+    # install the packages
+    logging.info("Attempting to install NuGet package(s) " +
+                 ", ".join(f"'{name}'" for name, _ in to_install))
+    commands = [
+        process.Command(_install_args(project_path, name, version),
+                        on_output=process.log_lines(f"--> [{name}] "),
+                        limits=limits) for name, version in to_install
+    ]
+    results = process.run_many(commands, max_concurrency)
+    success = True
+    installed = []
+    for (package_name, version), result in zip(to_install, results):
+        if result.success:
+            installed.append((package_name, version))
+        else:
+            logging.error(f"nuget install {package_name} failed with exit "
+                          f"code {result.returncode}")
+            success = False
+
+    # get the package metadata from the installations
+    index.refresh_downloaded()
+
+    def get_package_data(spec: PackageSpec) -> Optional[NuGetPackage]:
+        package_name, version = spec
+        return _get_installed_package_data(index, package_name, version,
+                                           target_framework)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        installed_packages = list(executor.map(get_package_data, installed))
+    installed_packages = [pkg for pkg in installed_packages if pkg is not None]
+    success = success and len(installed_packages) == len(installed)
+    if len(installed_packages) == 0:
         return False
 
-    # get the package metadata from the installation
-    installed_package = _get_installed_package_data(project_path, package_name,
-                                                    target_framework)
-    if installed_package is None:
-        return False
+    # add these packages to packages.config
+    for package in installed_packages:
+        index.add(package)
+    index.save()
 
-    # add this package to packages.config
-    _add_to_packages_config(project_path, installed_package)
+    # now copy the new packages into the project
+    copied = _copy_packages_to_project(project_path, installed_packages,
+                                       project_install_path, cache)
+    return success and copied
 
-    # now copy the new package into the project
-    success = _copy_packages_to_project(project_path, [installed_package],
-                                        project_install_path)
-    return success
+
+def read_requirements(requirements_path: str) -> List[PackageSpec]:
+    """Read packages to install from a requirements file, with one
+    PACKAGE[@VERSION] per line. Blank lines, and lines starting with '#', are
+    ignored.
+
+    Raises:
+        OSError: If the file couldn't be read.
+    """
+    with open(requirements_path, "r") as requirements_file:
+        return [
+            parse_package_spec(line.strip()) for line in requirements_file
+            if line.strip() != "" and not line.strip().startswith("#")
+        ]
+
+
+def parse_package_spec(spec: str) -> PackageSpec:
+    """Parse a package given as PACKAGE[@VERSION] into its name and version.
+
+    Raises:
+        ValueError: If the package name or version was empty.
+    """
+    package_name, _, version = spec.partition("@")
+    if package_name == "" or spec.endswith("@"):
+        raise ValueError(f"Invalid package '{spec}', expected "
+                         "PACKAGE[@VERSION]")
+    return package_name, version or None
 
 
 def uninstall_package(project_path: str, package_name: str,
                       project_install_path: str) -> bool:
     """Uninstall a NuGet package from the Torii project."""
     # attempt to get package data from packages.config
-    package = _gather_nuget_package(project_path, package_name)
+    index = PackageIndex(project_path)
+    package = index.remove(package_name)
     if package is None:
         logging.error(f"Package '{package_name}' was not installed.")
         return False
@@ -123,14 +357,26 @@ def uninstall_package(project_path: str, package_name: str,
     _remove_package_from_project(project_path, package, project_install_path)
 
     # remove the package from packages.config
-    _remove_from_packages_config(project_path, package)
+    index.save()
 
     return True
 
 
-def _copy_packages_to_project(project_path: str, packages: List[NuGetPackage],
-                              path_in_project: str) -> bool:
-    for package in packages:
+def _copy_packages_to_project(
+        project_path: str,
+        packages: List[NuGetPackage],
+        path_in_project: str,
+        cache: Optional[nuget_cache.PackageCache] = None) -> bool:
+    """Sync the files of each package into the project, a few packages at a
+    time. Only files that changed are copied, so Unity doesn't reimport
+    packages that were already there.
+
+    If a package cache is given, packages are added to it if they weren't
+    already there, and linked into the project from it."""
+    if len(packages) == 0:
+        return True
+
+    def copy_package(package: NuGetPackage) -> sync.SyncResult:
         # get the path to the package files
         package_files_path = path.join(project_path, "nuget-packages",
                                        f"{package.name}.{package.version}",
@@ -140,20 +386,113 @@ def _copy_packages_to_project(project_path: str, packages: List[NuGetPackage],
         dst_path = path.join(project_path, "Assets", path_in_project,
                              package.name)
 
-        # remove the package if it already existed
-        if path.exists(dst_path):
-            shutil.rmtree(dst_path)
+        logging.info(f"Copying package '{package.name}' to project path "
+                     f"{path_in_project}...")
+        if cache is not None:
+            cached_path = cache.get(package) or cache.put(
+                package, package_files_path)
+            return nuget_cache.materialize(cached_path, dst_path)
+        return sync.sync_tree(package_files_path, dst_path)
+
+    success = True
+    with ThreadPoolExecutor(
+            max_workers=min(COPY_WORKERS, len(packages))) as executor:
+        futures = [executor.submit(copy_package, pkg) for pkg in packages]
+        for package, future in zip(packages, futures):
+            try:
+                result = future.result()
+                logging.info(f"Package '{package.name}': {result.copied} "
+                             f"copied, {result.unchanged} unchanged, "
+                             f"{result.removed} removed")
+            except OSError as err:
+                logging.error(f"Unable to copy '{package.name}': {err}")
+                success = False
+    return success
 
-        logging.info(
-            f"Copying package '{package.name}' to project path {path_in_project}..."
-        )
 
-        # copy the package files over
-        try:
-            shutil.copytree(package_files_path, dst_path)
-        except shutil.Error as err:
-            logging.error(f"Unable to copy: {err}")
-            return False
+def _restore_from_feed(project_path: str, packages: List[NuGetPackage],
+                       feed_path: str, path_in_project: str,
+                       target_framework: str) -> bool:
+    """Extract the lib files of each package's .nupkg from a local feed
+    straight into the project, a few packages at a time."""
+    if len(packages) == 0:
+        return True
+    logging.info(f"Restoring packages from local feed {feed_path}...")
+    feed = _index_feed(feed_path)
+
+    def extract_package(package: NuGetPackage) -> sync.SyncResult:
+        nupkg_path = _find_in_feed(feed, package)
+        if nupkg_path is None:
+            raise FileNotFoundError(f"No .nupkg for '{package.name}' "
+                                    f"{package.version} in {feed_path}")
+
+        # use the framework in packages.config if the package has it,
+        # otherwise pick the best one it does have
+        targets = _nupkg_targets(nupkg_path)
+        framework = package.framework
+        if framework.lower() not in (t.lower() for t in targets):
+            framework = _select_package_target(package.name, targets,
+                                               target_framework)
+            if framework is None:
+                raise FileNotFoundError(
+                    f"No usable target for '{package.name}'")
+
+        dst_path = path.join(project_path, "Assets", path_in_project,
+                             package.name)
+        logging.info(f"Extracting package '{package.name}' to project path "
+                     f"{path_in_project}...")
+        return sync.sync_zip(nupkg_path, f"lib/{framework}/", dst_path)
+
+    success = True
+    with ThreadPoolExecutor(
+            max_workers=min(COPY_WORKERS, len(packages))) as executor:
+        futures = [executor.submit(extract_package, pkg) for pkg in packages]
+        for package, future in zip(packages, futures):
+            try:
+                result = future.result()
+                logging.info(f"Package '{package.name}': {result.copied} "
+                             f"extracted, {result.unchanged} unchanged, "
+                             f"{result.removed} removed")
+            except (OSError, ValueError, zipfile.BadZipFile) as err:
+                logging.error(f"Unable to restore '{package.name}': {err}")
+                success = False
+    return success
+
+
+def _index_feed(feed_path: str) -> Dict[str, str]:
+    """Find every .nupkg in a local feed, keyed by its lowercase file name.
+    Handles both flat feeds, and feeds laid out as <id>/<version>/."""
+    feed = {}
+    for root, _, file_names in os.walk(feed_path):
+        for file_name in file_names:
+            if file_name.lower().endswith(NUPKG_EXTENSION):
+                feed[file_name.lower()] = path.join(root, file_name)
+    return feed
+
+
+def _find_in_feed(feed: Dict[str, str],
+                  package: NuGetPackage) -> Optional[str]:
+    """Find the .nupkg for a package in an indexed feed."""
+    versions = [package.version]
+    # NuGet drops a trailing zero revision from file names, i.e. 2.0.0.0
+    if package.version.count(".") == 3 and package.version.endswith(".0"):
+        versions.append(package.version[:-len(".0")])
+    for version in versions:
+        nupkg_name = f"{package.name}.{version}{NUPKG_EXTENSION}".lower()
+        if nupkg_name in feed:
+            return feed[nupkg_name]
+    return None
+
+
+def _nupkg_targets(nupkg_path: str) -> List[str]:
+    """Get the framework targets in the lib folder of a .nupkg."""
+    targets = set()
+    with zipfile.ZipFile(nupkg_path) as nupkg:
+        for name in nupkg.namelist():
+            parts = name.split("/")
+            if len(parts) > 2 and parts[0].lower() == "lib":
+                targets.add(parts[1])
+    return sorted(targets)
 
 
 def _remove_package_from_project(project_path: str, package: NuGetPackage,
@@ -177,25 +516,18 @@ def _remove_package_from_project(project_path: str, package: NuGetPackage,
 
 
 def _get_installed_package_data(
-        project_path: str, package_name: str,
+        index: PackageIndex, package_name: str, version: Optional[str],
         target_framework: str) -> Optional[NuGetPackage]:
     """Gets package metadata from an installed package.
     Returns NuGetPackage object."""
-    package_dir = path.join(project_path, "nuget-packages")
-    package_dirs = [
-        path.basename(f.path) for f in os.scandir(package_dir) if f.is_dir()
-    ]
-    installed_packages = [
-        pkg for pkg in package_dirs if pkg.startswith(package_name)
-    ]
-    if len(installed_packages) == 0:
+    package_path = index.find_downloaded(
+        package_name, version) or index.find_downloaded(package_name)
+    if package_path is None:
         logging.error(f"Unable to find installed package '{package_name}'")
         return None
-    installed_package = installed_packages[0]
-    version_match = PACKAGE_REGEX.fullmatch(installed_package)
+    version_match = PACKAGE_REGEX.fullmatch(path.basename(package_path))
     package_name = version_match.group(1)
     package_version = version_match.group(2)
-    package_path = path.join(package_dir, installed_package)
     package_framework = _find_appropriate_package_target(
         package_path, target_framework)
     if package_framework is None:
@@ -219,118 +551,65 @@ def _find_appropriate_package_target(package_path: str,
         if f.is_dir()
     ]
 
-    # filter to just .NET Framework targets
-    net_framework_targets = [
-        t for t in all_targets
-        if t.startswith("net") and "standard" not in t and "core" not in t
-    ]
+    return _select_package_target(path.basename(package_path), all_targets,
+                                  target_framework)
+
+
+def _select_package_target(package_name: str, targets: List[str],
+                           target_framework: str) -> Optional[str]:
+    """Pick the highest .NET Framework version <= the target version from a
+    package's targets.
+
+    Returns None if there was no version meeting this requirement."""
+    # filter to just .NET Framework targets, highest version first
+    net_framework_targets = []
+    for target in targets:
+        if not target.startswith("net") or "standard" in target \
+                or "core" in target:
+            continue
+        framework_num = _framework_number(target)
+        if framework_num is not None:
+            net_framework_targets.append((framework_num, target))
+    net_framework_targets.sort(reverse=True)
 
     # check for highest available version <= the target version
-    for framework_version_str in reversed(net_framework_targets):
-        # remove the 'net'
-        framework_version = framework_version_str[3:]
-
-        # remove '-client' if it's there (for .NET client profile)
-        if framework_version.endswith("-client"):
-            framework_version = framework_version[:-len("-client")]
-
-        # normalize versions like '46' to '460'
-        if len(framework_version) < 3:
-            to_add = 3 - len(framework_version)
-            framework_version += "0" * to_add
-
-        # perform the <= check easily by converting them to ints
-        target_num = int(target_framework)
-        framework_num = int(framework_version)
+    target_num = int(target_framework)
+    for framework_num, framework_version_str in net_framework_targets:
         if framework_num <= target_num:
             return framework_version_str
 
-    pkg_name = path.basename(package_path)
-    logging.error(f"Unable to find target for package {pkg_name} matching "
-                  f"<= {target_framework}")
+    logging.error(f"Unable to find target for package {package_name} "
+                  f"matching <= {target_framework}")
     return None
 
 
-def _add_to_packages_config(project_path: str, package: NuGetPackage) -> None:
-    """Update the NuGet packages.config file to include a new package."""
-    nuget_packages_config = path.join(project_path, "packages.config")
-    with open(nuget_packages_config, 'rb') as packages_config:
-        parsed = xmltodict.parse(packages_config, force_list=("package"))
-    new_package = {
-        "@id": package.name,
-        "@version": package.version,
-        "@targetFramework": package.framework
-    }
-
-    # handle empty packages.config
-    if parsed["packages"] is None:
-        parsed["packages"] = {"package": []}
+def _framework_number(target: str) -> Optional[int]:
+    """Get the version of a .NET Framework target as a number, i.e. 'net46'
+    is 460. Returns None if it wasn't a version we understand."""
+    # remove the 'net'
+    framework_version = target[3:]
 
-    parsed["packages"]["package"].append(new_package)
-    with open(nuget_packages_config, 'w') as packages_config:
-        packages_config.write(xmltodict.unparse(parsed, pretty=True))
+    # remove '-client' if it's there (for .NET client profile)
+    if framework_version.endswith("-client"):
+        framework_version = framework_version[:-len("-client")]
 
+    # normalize versions like '46' to '460'
+    if len(framework_version) < 3:
+        to_add = 3 - len(framework_version)
+        framework_version += "0" * to_add
 
-def _remove_from_packages_config(project_path: str,
-                                 package: NuGetPackage) -> None:
-    """Update the NuGet packages.config file to remove a package."""
-    nuget_packages_config = path.join(project_path, "packages.config")
-    with open(nuget_packages_config, 'rb') as packages_config:
-        parsed = xmltodict.parse(packages_config, force_list=("package"))
-    package_xml = {
-        "@id": package.name,
-        "@version": package.version,
-        "@targetFramework": package.framework
-    }
+    return int(framework_version) if framework_version.isdigit() else None
 
-    parsed["packages"]["package"].remove(package_xml)
 
-    with open(nuget_packages_config, 'w') as packages_config:
-        packages_config.write(xmltodict.unparse(parsed, pretty=True))
+def _version_key(version: str) -> Tuple[int, ...]:
+    """Make a version string sortable, i.e. so '1.10.0' > '1.9.0'."""
+    return tuple(int(part) for part in version.split("."))
 
 
-def _package_installed(project_path: str, package_name: str) -> bool:
-    """Check if a package is already installed."""
-    return _gather_nuget_package(project_path, package_name) is not None
-
-
-def _gather_nuget_package(project_path: str,
-                          package_name: str) -> Optional[NuGetPackage]:
-    """Get a NuGet package from the packages.config file."""
-    for pkg in _gather_nuget_packages(project_path):
-        if pkg.name == package_name:
-            return pkg
-    return None
-
-
-def _gather_nuget_packages(project_path: str) -> List[NuGetPackage]:
-    """Parse the NuGet packages.config file in the project to get a list
-    of packages."""
-    nuget_packages_config = path.join(project_path, "packages.config")
-    with open(nuget_packages_config, 'rb') as packages_config:
-        parsed = xmltodict.parse(packages_config)
-
-    # if packages.config is empty, return an empty list
-    if parsed["packages"] is None:
-        return []
-
-    packages = []
-
-    # handle packages.config with only one package
-    if isinstance(parsed["packages"]["package"], list):
-        for package in parsed["packages"]["package"]:
-            nuget_package = NuGetPackage(package["@id"], package["@version"],
-                                         package["@targetFramework"])
-            packages.append(nuget_package)
-    else:
-        package = parsed["packages"]["package"]
-        nuget_package = NuGetPackage(package["@id"], package["@version"],
-                                     package["@targetFramework"])
-        packages.append(nuget_package)
-    return packages
-
-
-def _run_restore(project_path: str, project_name: str) -> Tuple[bool, int]:
+def _run_restore(
+        project_path: str,
+        project_name: str,
+        limits: Optional[process.ResourceLimits] = None) -> Tuple[bool, int]:
     """Run a NuGet restore for the project.
 
     Returns a 2-tuple indicating whether the restore was a success, and the
@@ -340,35 +619,16 @@ def _run_restore(project_path: str, project_name: str) -> Tuple[bool, int]:
 
     solution_path = path.join(project_path, f"{project_name}.sln")
     args = ["nuget", "restore", solution_path]
-    proc = subprocess.Popen(args,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
-    for line in iter(proc.stdout.readline, b""):
-        logging.info(f"--> {line.decode('utf-8').rstrip()}")
-
-    proc.wait()
-
-    return proc.returncode == 0, proc.returncode
-
+    result = process.run(args, limits=limits)
+    return result.success, result.returncode
 
-def _run_install(project_path: str, package_name: str,
-                 version: Optional[str]) -> Tuple[bool, int]:
-    """Install a NuGet package for the project.
 
-    Returns a 2-tuple indicating whether the install was a success, and the
-    exit code of NuGet.
-    """
+def _install_args(project_path: str, package_name: str,
+                  version: Optional[str]) -> List[str]:
+    """Get the arguments to NuGet to install a package for the project."""
     args = [
         "nuget", "install", package_name, "-SolutionDirectory", project_path
     ]
     if version is not None:
         args += ["-Version", version]
-    proc = subprocess.Popen(args,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
-    for line in iter(proc.stdout.readline, b""):
-        logging.info(f"--> {line.decode('utf-8').rstrip()}")
-
-    proc.wait()
-
-    return proc.returncode == 0, proc.returncode
\ No newline at end of file
+    return args
@@ -0,0 +1,226 @@
+"""A machine-wide cache of NuGet packages, shared between projects.
+
+Each package is stored once per ID, version and framework, as the files from
+its lib/<framework> folder. Projects get the files by hardlinking (or
+reflinking, where the filesystem supports it) them from the cache into their
+Assets folder, so a package used by many projects only takes up space once.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+import json
+import logging
+import os
+from os import path
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, TYPE_CHECKING
+import uuid
+
+from . import config, sync
+
+if TYPE_CHECKING:
+    from .nuget import NuGetPackage
+
+DEFAULT_MAX_SIZE_MB = 2048
+"""The default size limit of the cache."""
+
+INDEX_FILE_NAME = "index.json"
+"""The name of the file in the cache recording what's in it."""
+
+
+@dataclass
+class CacheEntry:
+    """A package in the cache.
+
+    Attributes:
+        key: The ID, version and framework of the package, as a path.
+        size: How many bytes the package's files take up.
+        last_used: When the package was last used, as a Unix timestamp.
+    """
+    key: str
+    size: int
+    last_used: float
+
+
+class PackageCache:
+    """A cache of NuGet packages. Least recently used packages are removed
+    when the cache grows past its size limit.
+
+    Attributes:
+        root: The folder the cache is in.
+        max_size: The most bytes the cache can use.
+    """
+    def __init__(self,
+                 root: Optional[str] = None,
+                 max_size: int = DEFAULT_MAX_SIZE_MB * 1024 * 1024) -> None:
+        self.root = root or path.join(config.user_cache_dir(), "nuget")
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(path.join(self.root, "packages"), exist_ok=True)
+
+    def __contains__(self, package: NuGetPackage) -> bool:
+        return path.isdir(self._folder(_key(package)))
+
+    def get(self, package: NuGetPackage) -> Optional[str]:
+        """Get the folder of a cached package's files, marking it as used.
+        Returns None if the package wasn't cached."""
+        key = _key(package)
+        folder = self._folder(key)
+        if not path.isdir(folder):
+            return None
+        with self._lock:
+            entries = self._load_index()
+            entry = entries.get(key)
+            if entry is None:
+                entry = CacheEntry(key, _folder_size(folder), 0)
+                entries[key] = entry
+            entry.last_used = time.time()
+            self._save_index(entries)
+        return folder
+
+    def put(self, package: NuGetPackage, src_folder: str) -> str:
+        """Add a package's files to the cache, returning the folder they were
+        cached in.
+
+        Raises:
+            OSError: If the files couldn't be copied into the cache.
+        """
+        key = _key(package)
+        folder = self._folder(key)
+        if not path.isdir(folder):
+            # copy next to where it's going, then move it in one go, so
+            # nothing sees a half-copied package
+            temp_folder = path.join(self.root, "tmp", uuid.uuid4().hex)
+            shutil.copytree(src_folder, temp_folder)
+            os.makedirs(path.dirname(folder), exist_ok=True)
+            try:
+                os.rename(temp_folder, folder)
+            except OSError:
+                # someone else cached it first
+                shutil.rmtree(temp_folder, ignore_errors=True)
+                if not path.isdir(folder):
+                    raise
+
+        with self._lock:
+            entries = self._load_index()
+            entries[key] = CacheEntry(key, _folder_size(folder), time.time())
+            self._evict(entries, self.max_size, keep=key)
+            self._save_index(entries)
+        return folder
+
+    def entries(self) -> List[CacheEntry]:
+        """Get every package in the cache, most recently used first."""
+        with self._lock:
+            entries = self._load_index()
+        return sorted(entries.values(),
+                      key=lambda entry: entry.last_used,
+                      reverse=True)
+
+    def prune(self, max_size: Optional[int] = None) -> List[CacheEntry]:
+        """Remove least recently used packages until the cache is no bigger
+        than a size, or its size limit if not given. Returns the removed
+        packages."""
+        with self._lock:
+            entries = self._load_index()
+            removed = self._evict(
+                entries, self.max_size if max_size is None else max_size)
+            self._save_index(entries)
+        return removed
+
+    def _evict(self,
+               entries: Dict[str, CacheEntry],
+               max_size: int,
+               keep: Optional[str] = None) -> List[CacheEntry]:
+        removed = []
+        total_size = sum(entry.size for entry in entries.values())
+        by_last_used = sorted(entries.values(),
+                              key=lambda entry: entry.last_used)
+        for entry in by_last_used:
+            if total_size <= max_size:
+                break
+            if entry.key == keep:
+                continue
+            logging.info(f"Removing {entry.key} from NuGet package cache")
+            shutil.rmtree(self._folder(entry.key), ignore_errors=True)
+            del entries[entry.key]
+            total_size -= entry.size
+            removed.append(entry)
+        return removed
+
+    def _folder(self, key: str) -> str:
+        return path.join(self.root, "packages", *key.split("/"))
+
+    def _load_index(self) -> Dict[str, CacheEntry]:
+        try:
+            with open(path.join(self.root, INDEX_FILE_NAME),
+                      "r") as index_file:
+                index = json.load(index_file)
+            entries = {
+                key: CacheEntry(key, size, last_used)
+                for key, (size, last_used) in index["packages"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            entries = {}
+
+        # forget about packages that were deleted from the cache
+        return {
+            key: entry
+            for key, entry in entries.items() if path.isdir(self._folder(key))
+        }
+
+    def _save_index(self, entries: Dict[str, CacheEntry]) -> None:
+        index = {
+            "version": 1,
+            "packages": {
+                key: [entry.size, entry.last_used]
+                for key, entry in entries.items()
+            }
+        }
+        index_path = path.join(self.root, INDEX_FILE_NAME)
+        temp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(temp_path, index_path)
+
+
+def from_config(using: Optional[Mapping[str, Any]]) -> PackageCache:
+    """Make a PackageCache from the 'nuget_cache' config section.
+
+    Raises:
+        ValueError: If the size limit wasn't a number.
+    """
+    using = dict(using or {})
+    cache_path = using.get("path")
+    if cache_path is not None:
+        cache_path = path.expandvars(cache_path)
+    max_size_mb = using.get("max_size_mb", DEFAULT_MAX_SIZE_MB)
+    if not isinstance(max_size_mb, (int, float)):
+        raise ValueError(
+            f"Invalid 'max_size_mb' in 'nuget_cache' config: {max_size_mb}")
+    return PackageCache(cache_path, int(max_size_mb * 1024 * 1024))
+
+
+def materialize(cache_folder: str, dst: str) -> sync.SyncResult:
+    """Sync a cached package's files into a folder, linking them from the
+    cache."""
+    return sync.sync_tree(cache_folder, dst, copy_function=sync.link_file)
+
+
+def _key(package: NuGetPackage) -> str:
+    return "/".join([
+        package.name.lower(),
+        package.version.lower(),
+        package.framework.lower()
+    ])
+
+
+def _folder_size(folder: str) -> int:
+    size = 0
+    for root, _, file_names in os.walk(folder):
+        for file_name in file_names:
+            try:
+                size += os.lstat(path.join(root, file_name)).st_size
+            except OSError:
+                pass
+    return size
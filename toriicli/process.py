@@ -0,0 +1,361 @@
+from collections import deque
+from dataclasses import dataclass
+import functools
+import logging
+import os
+import queue
+import selectors
+import subprocess
+import threading
+import time
+from typing import Any, Callable, List, Mapping, Optional
+
+from . import metrics
+
+READ_SIZE = 64 * 1024
+"""The most bytes of a child process's output to read at once."""
+
+POLL_INTERVAL = 0.1
+"""How often (in seconds) to check whether child processes have exited."""
+
+OUTPUT_DRAIN_TIMEOUT = 5.0
+"""How long (in seconds) to wait for the rest of a process's output after it
+exits, when output is read on a thread."""
+
+OutputHandler = Callable[[bytes], None]
+"""Called with each chunk of output from a child process as it arrives, and
+with b"" once the output has ended."""
+
+
+@dataclass
+class ResourceLimits:
+    """Limits on the resources a child process can use. Only supported on
+    POSIX systems, where they're applied with setrlimit."""
+    cpu_seconds: Optional[int] = None
+    memory_bytes: Optional[int] = None
+    open_files: Optional[int] = None
+
+
+def limits_from_config(
+        using: Optional[Mapping[str, Any]]) -> Optional[ResourceLimits]:
+    """Make resource limits from the config, i.e. 'unity_build_limits'.
+    Takes 'cpu_seconds', 'memory_mb' and 'open_files'. Returns None if no
+    limits were given.
+
+    Raises:
+        ValueError: If a limit was unknown, or wasn't a positive whole number.
+    """
+    if not using:
+        return None
+    values = {}
+    for name, value in using.items():
+        if name not in ("cpu_seconds", "memory_mb", "open_files"):
+            raise ValueError(f"Unknown resource limit '{name}'")
+        if isinstance(value, bool) or not isinstance(value, int) \
+                or value < 1:
+            raise ValueError(f"Invalid resource limit '{name}': {value}")
+        values[name] = value
+    memory_mb = values.get("memory_mb")
+    return ResourceLimits(
+        values.get("cpu_seconds"),
+        None if memory_mb is None else memory_mb * 1024 * 1024,
+        values.get("open_files"))
+
+
+@dataclass
+class Command:
+    """A child process to run.
+
+    Attributes:
+        args: The program and its arguments.
+        on_output: Handles the process's combined stdout and stderr. Logs
+            each line by default.
+        timeout: How many seconds the process can run before it's killed.
+        limits: Limits on the resources the process can use.
+        cwd: The working directory of the process.
+    """
+    args: List[str]
+    on_output: Optional[OutputHandler] = None
+    timeout: Optional[float] = None
+    limits: Optional[ResourceLimits] = None
+    cwd: Optional[str] = None
+
+
+@dataclass
+class ProcessResult:
+    """The result of running a child process.
+
+    Attributes:
+        args: The program and its arguments.
+        returncode: The exit code of the process. Negative if it was killed
+            by a signal.
+        wall_time: How many seconds the process ran for.
+        cpu_time: How many seconds of CPU time the process used, or None if
+            that couldn't be measured on this platform.
+        timed_out: Whether the process was killed for running too long.
+    """
+    args: List[str]
+    returncode: int
+    wall_time: float
+    cpu_time: Optional[float]
+    timed_out: bool
+
+    @property
+    def success(self) -> bool:
+        return self.returncode == 0 and not self.timed_out
+
+
+def log_lines(prefix: str = "--> ") -> OutputHandler:
+    """Make an output handler that logs each line of output."""
+    partial_line = [b""]
+
+    def handler(chunk: bytes) -> None:
+        lines = (partial_line[0] + chunk).split(b"\n")
+        partial_line[0] = b"" if chunk == b"" else lines.pop()
+        for line in lines:
+            if line:
+                logging.info(
+                    f"{prefix}{line.decode('utf-8', 'replace').rstrip()}")
+
+    return handler
+
+
+def run(args: List[str],
+        on_output: Optional[OutputHandler] = None,
+        timeout: Optional[float] = None,
+        limits: Optional[ResourceLimits] = None,
+        cwd: Optional[str] = None) -> ProcessResult:
+    """Run a child process to completion. See Command for the arguments."""
+    return run_many([Command(args, on_output, timeout, limits, cwd)])[0]
+
+
+def run_many(commands: List[Command],
+             max_concurrency: Optional[int] = None) -> List[ProcessResult]:
+    """Run child processes concurrently, pumping their output without
+    blocking on any one of them.
+
+    Args:
+        commands: The child processes to run.
+        max_concurrency: The most processes to run at once. Defaults to
+            running all of them at once.
+
+    Returns:
+        List[ProcessResult]: The result of each command, in the same order.
+    """
+    if len(commands) == 0:
+        return []
+    runner = _SelectorRunner() if os.name == "posix" else _ThreadedRunner()
+    return runner.run(commands, max_concurrency or len(commands))
+
+
+class _Running:
+    """Book-keeping for a child process that's running."""
+    def __init__(self, index: int, command: Command,
+                 proc: subprocess.Popen) -> None:
+        self.index = index
+        self.command = command
+        self.on_output = command.on_output or log_lines()
+        self.proc = proc
+        self.start_time = time.monotonic()
+        self.deadline = None if command.timeout is None \
+            else self.start_time + command.timeout
+        self.output_ended = False
+        self.timed_out = False
+
+    def end_output(self) -> None:
+        if not self.output_ended:
+            self.output_ended = True
+            self.on_output(b"")
+
+    def result(self, returncode: int,
+               cpu_time: Optional[float]) -> ProcessResult:
+        return ProcessResult(self.command.args, returncode,
+                             time.monotonic() - self.start_time, cpu_time,
+                             self.timed_out)
+
+
+class _Runner:
+    """Runs child processes, leaving how output is pumped and how exited
+    processes are reaped to subclasses."""
+    def run(self, commands: List[Command],
+            max_concurrency: int) -> List[ProcessResult]:
+        results = [None] * len(commands)
+        pending = deque(enumerate(commands))
+        running = []
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and len(running) < max_concurrency:
+                    index, command = pending.popleft()
+                    running.append(self._start(index, command))
+
+                self._pump(self._wait_time(running))
+
+                for child in list(running):
+                    if child.deadline is not None and not child.timed_out \
+                            and time.monotonic() > child.deadline:
+                        logging.error(f"{child.command.args[0]} timed out "
+                                      f"after {child.command.timeout}s")
+                        child.timed_out = True
+                        child.proc.kill()
+
+                    result = self._reap(child)
+                    if result is not None:
+                        metrics.process(result)
+                        results[child.index] = result
+                        running.remove(child)
+        except BaseException:
+            # don't leave orphaned processes behind if we were interrupted
+            for child in running:
+                child.proc.kill()
+            raise
+        return results
+
+    def _popen(self, command: Command, **kwargs) -> subprocess.Popen:
+        return subprocess.Popen(command.args,
+                                stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT,
+                                cwd=command.cwd,
+                                **kwargs)
+
+    def _wait_time(self, running: List[_Running]) -> float:
+        deadlines = [c.deadline for c in running if c.deadline is not None]
+        if len(deadlines) == 0:
+            return POLL_INTERVAL
+        return max(0, min(POLL_INTERVAL, min(deadlines) - time.monotonic()))
+
+    def _start(self, index: int, command: Command) -> _Running:
+        raise NotImplementedError()
+
+    def _pump(self, timeout: float) -> None:
+        raise NotImplementedError()
+
+    def _reap(self, child: _Running) -> Optional[ProcessResult]:
+        raise NotImplementedError()
+
+
+class _SelectorRunner(_Runner):
+    """Runs child processes on POSIX, multiplexing their output with a
+    selector, and reaping them with wait4 to get their resource usage."""
+    def __init__(self) -> None:
+        self.selector = selectors.DefaultSelector()
+
+    def _start(self, index: int, command: Command) -> _Running:
+        preexec_fn = None
+        if command.limits is not None:
+            preexec_fn = functools.partial(_apply_limits, command.limits)
+        child = _Running(index, command,
+                         self._popen(command, preexec_fn=preexec_fn))
+        os.set_blocking(child.proc.stdout.fileno(), False)
+        self.selector.register(child.proc.stdout, selectors.EVENT_READ, child)
+        return child
+
+    def _pump(self, timeout: float) -> None:
+        if len(self.selector.get_map()) == 0:
+            time.sleep(timeout)
+            return
+        for key, _ in self.selector.select(timeout):
+            self._read(key.data)
+
+    def _read(self, child: _Running) -> bool:
+        """Read what output is available. Returns False if there was
+        none."""
+        try:
+            data = os.read(child.proc.stdout.fileno(), READ_SIZE)
+        except BlockingIOError:
+            return False
+        if data:
+            child.on_output(data)
+            return True
+
+        self._end_output(child)
+        return False
+
+    def _end_output(self, child: _Running) -> None:
+        if not child.output_ended:
+            self.selector.unregister(child.proc.stdout)
+            child.proc.stdout.close()
+            child.end_output()
+
+    def _reap(self, child: _Running) -> Optional[ProcessResult]:
+        pid, status, rusage = os.wait4(child.proc.pid, os.WNOHANG)
+        if pid == 0:
+            return None
+
+        # the process may have children of its own still holding its output
+        # open, so read what's left without waiting for the output to end
+        while not child.output_ended and self._read(child):
+            pass
+        self._end_output(child)
+
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+        child.proc.returncode = returncode
+        return child.result(returncode, rusage.ru_utime + rusage.ru_stime)
+
+
+class _ThreadedRunner(_Runner):
+    """Runs child processes on platforms without selectable pipes (Windows),
+    with a thread reading the output of each process."""
+    def __init__(self) -> None:
+        self.output = queue.Queue()
+
+    def _start(self, index: int, command: Command) -> _Running:
+        if command.limits is not None:
+            logging.warning("Resource limits are not supported on this "
+                            "platform, ignoring them")
+        child = _Running(index, command, self._popen(command))
+        child.reader = threading.Thread(target=self._read,
+                                        args=(child, child.proc.stdout),
+                                        daemon=True)
+        child.reader.start()
+        return child
+
+    def _read(self, child: _Running, stdout) -> None:
+        with stdout:
+            for chunk in iter(lambda: stdout.read1(READ_SIZE), b""):
+                self.output.put((child, chunk))
+        self.output.put((child, b""))
+
+    def _pump(self, timeout: float) -> None:
+        try:
+            item = self.output.get(timeout=timeout)
+            while True:
+                child, chunk = item
+                if not child.output_ended:
+                    if chunk:
+                        child.on_output(chunk)
+                    else:
+                        child.end_output()
+                item = self.output.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _reap(self, child: _Running) -> Optional[ProcessResult]:
+        returncode = child.proc.poll()
+        if returncode is None:
+            return None
+
+        # the reader may still have output to queue, so wait for it to reach
+        # the end, unless the process's own children are holding it open
+        child.reader.join(OUTPUT_DRAIN_TIMEOUT)
+        self._pump(0)
+        child.end_output()
+        return child.result(returncode, None)
+
+
+def _apply_limits(limits: ResourceLimits) -> None:
+    """Apply resource limits to the current process. Runs in the child
+    process before the program is executed."""
+    import resource
+    if limits.cpu_seconds is not None:
+        resource.setrlimit(resource.RLIMIT_CPU,
+                           (limits.cpu_seconds, limits.cpu_seconds))
+    if limits.memory_bytes is not None:
+        resource.setrlimit(resource.RLIMIT_AS,
+                           (limits.memory_bytes, limits.memory_bytes))
+    if limits.open_files is not None:
+        resource.setrlimit(resource.RLIMIT_NOFILE,
+                           (limits.open_files, limits.open_files))
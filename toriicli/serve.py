@@ -0,0 +1,406 @@
+"""Serving build, release and NuGet jobs from a long-running process.
+
+Jobs are queued over a small HTTP API (over TCP, or a Unix socket), and run by
+a pool of workers in this process. As the process stays up, project configs,
+compiled templates and storage clients are kept between jobs rather than set
+up again for each one. Only one job runs in a project at a time, and how many
+Unity builds, compressions and transfers happen at once across all jobs can
+be limited (see limits).
+
+The API:
+    GET /status: The state of the queue, workers and limits.
+    GET /jobs: Every job, most recent first.
+    POST /jobs: Queue a job, with a JSON body like
+        {"command": "build", "project": "/path/to/project", "args": []}.
+    GET /jobs/ID: A job, with the end of its log.
+    GET /jobs/ID/log: A job's whole log, as text.
+    DELETE /jobs/ID: Cancel a job, if it hasn't started yet.
+"""
+from __future__ import annotations
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+from os import path
+import queue
+import signal
+import socketserver
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional
+import uuid
+
+from . import limits
+
+JOB_COMMANDS = ["build", "release", "nuget"]
+"""The commands that can be run as jobs."""
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+MAX_LOG_LINES = 10000
+"""The most lines of a job's log to keep."""
+
+LOG_TAIL_LINES = 50
+"""How many lines of a job's log to include in its status."""
+
+MAX_FINISHED_JOBS = 500
+"""How many finished jobs to remember."""
+
+JobRunner = Callable[[List[str]], int]
+"""Runs toriicli with some arguments, returning its exit code."""
+
+
+@dataclass
+class Job:
+    """A command queued to run in a project.
+
+    Attributes:
+        id: The ID of the job.
+        command: The command to run, i.e. 'build'.
+        project: The path of the project to run it in.
+        args: The arguments to the command.
+        status: Whether the job is queued, running, or how it finished.
+        returncode: The exit code of the command, once it finished.
+        log: The most recent lines the job logged.
+    """
+    id: str
+    command: str
+    project: str
+    args: List[str]
+    status: str = QUEUED
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    returncode: Optional[int] = None
+    log: Deque[str] = field(
+        default_factory=lambda: deque(maxlen=MAX_LOG_LINES))
+
+    def to_dict(self, log_lines: int = 0) -> Dict[str, Any]:
+        job = {
+            "id": self.id,
+            "command": self.command,
+            "project": self.project,
+            "args": self.args,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "returncode": self.returncode
+        }
+        if log_lines > 0:
+            job["log"] = list(self.log)[-log_lines:]
+        return job
+
+
+class JobQueue:
+    """Queues jobs and runs them on a pool of worker threads.
+
+    Args:
+        run_job: Runs toriicli with the arguments for a job.
+        workers: How many jobs to run at once.
+    """
+    def __init__(self, run_job: JobRunner, workers: int) -> None:
+        self.run_job = run_job
+        self.workers = workers
+        self._queue: queue.Queue = queue.Queue()
+        self._jobs: Dict[str, Job] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._running: List[Job] = []
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name=f"toriicli-worker-{i}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stop the workers once they've finished the jobs they're
+        running. Queued jobs are cancelled."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == QUEUED:
+                    job.status = CANCELLED
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, command: str, project: str, args: List[str]) -> Job:
+        """Queue a job.
+
+        Raises:
+            ValueError: If the command, project or arguments were invalid.
+        """
+        if command not in JOB_COMMANDS:
+            raise ValueError(f"Invalid command '{command}', must be one of "
+                             f"{', '.join(JOB_COMMANDS)}")
+        if not isinstance(project, str) or not path.isabs(project) \
+                or not path.isdir(project):
+            raise ValueError(f"Project must be the absolute path to a "
+                             f"folder, got '{project}'")
+        if not isinstance(args, list) \
+                or not all(isinstance(arg, str) for arg in args):
+            raise ValueError("Arguments must be a list of strings")
+
+        job = Job(uuid.uuid4().hex[:12], command, path.normpath(project), args)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_finished()
+        self._queue.put(job)
+        logging.info(f"Queued job {job.id}: {command} {' '.join(args)} in "
+                     f"{job.project}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that hasn't started. Returns False if it had."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.status = CANCELLED
+            job.finished = time.time()
+            return True
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            running = [job.id for job in self._running]
+        return {
+            "workers": self.workers,
+            "jobs": counts,
+            "running": running,
+            "limits": limits.get_limits(),
+            "holders": limits.holders()
+        }
+
+    def ignore_thread(self) -> None:
+        """Mark the current thread as not running a job, i.e. one serving
+        the API, so what it logs doesn't go in a job's log."""
+        self._local.ignored = True
+
+    def current_job(self) -> Optional[Job]:
+        """Get the job running on this thread. Falls back to the only job
+        running, so things logged by threads a job started go to it too."""
+        if getattr(self._local, "ignored", False):
+            return None
+        job = getattr(self._local, "job", None)
+        if job is None:
+            with self._lock:
+                if len(self._running) == 1:
+                    job = self._running[0]
+        return job
+
+    def join(self) -> None:
+        """Wait until every job queued so far has finished or been
+        cancelled."""
+        self._queue.join()
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job) -> None:
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            job.status = RUNNING
+
+        # only one job at a time in a project, so they don't trip over
+        # each other's builds
+        with limits.hold(limits.PROJECT, job.project):
+            with self._lock:
+                job.started = time.time()
+                self._running.append(job)
+            self._local.job = job
+            try:
+                job.returncode = self.run_job(
+                    ["--project-path", job.project, job.command] + job.args)
+            except Exception:
+                logging.exception(f"Job {job.id} failed")
+                job.returncode = 1
+            finally:
+                logging.info(f"Job {job.id} finished with exit code "
+                             f"{job.returncode}")
+                self._local.job = None
+                with self._lock:
+                    self._running.remove(job)
+                    job.finished = time.time()
+                    job.status = SUCCEEDED if job.returncode == 0 \
+                        else FAILED
+
+    def _forget_finished(self) -> None:
+        finished = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in (SUCCEEDED, FAILED, CANCELLED)
+        ]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+
+class JobLogHandler(logging.Handler):
+    """Adds what's logged while a job runs to the job's log."""
+    def __init__(self, job_queue: JobQueue) -> None:
+        super().__init__(logging.INFO)
+        self.job_queue = job_queue
+
+    def emit(self, record: logging.LogRecord) -> None:
+        job = self.job_queue.current_job()
+        if job is None:
+            return
+        message = record.getMessage()
+        if record.levelno >= logging.ERROR:
+            message = f"ERROR: {message}"
+        job.log.extend(message.splitlines() or [""])
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Handles requests to the API. See the module docs."""
+    job_queue: JobQueue = None
+
+    def setup(self) -> None:
+        self.job_queue.ignore_thread()
+        super().setup()
+
+    def do_GET(self) -> None:
+        parts = self._path_parts()
+        if parts == ["status"]:
+            self._send_json(200, self.job_queue.status())
+        elif parts == ["jobs"]:
+            self._send_json(200,
+                            [job.to_dict() for job in self.job_queue.jobs()])
+        elif len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.job_queue.get(parts[1])
+            if job is None:
+                self._send_json(404, {"error": f"No job '{parts[1]}'"})
+            elif len(parts) == 2:
+                self._send_json(200, job.to_dict(LOG_TAIL_LINES))
+            elif parts[2] == "log":
+                self._send(200, "text/plain; charset=utf-8",
+                           "\n".join(list(job.log)) + "\n")
+            else:
+                self._send_json(404, {"error": "Not found"})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self) -> None:
+        if self._path_parts() != ["jobs"]:
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("Body must be a JSON object")
+            job = self.job_queue.submit(body.get("command"),
+                                        body.get("project"),
+                                        body.get("args", []))
+        except ValueError as err:
+            self._send_json(400, {"error": str(err)})
+            return
+        self._send_json(202, job.to_dict())
+
+    def do_DELETE(self) -> None:
+        parts = self._path_parts()
+        if len(parts) != 2 or parts[0] != "jobs":
+            self._send_json(404, {"error": "Not found"})
+        elif self.job_queue.get(parts[1]) is None:
+            self._send_json(404, {"error": f"No job '{parts[1]}'"})
+        elif not self.job_queue.cancel(parts[1]):
+            self._send_json(409, {"error": "Job already started"})
+        else:
+            self._send_json(200, self.job_queue.get(parts[1]).to_dict())
+
+    def address_string(self) -> str:
+        # Unix socket clients don't have an address
+        return self.client_address[0] if self.client_address else "local"
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(f"{self.address_string()} {format % args}")
+
+    def _path_parts(self) -> List[str]:
+        return [part for part in self.path.split("?")[0].split("/") if part]
+
+    def _send_json(self, status: int, body: Any) -> None:
+        self._send(status, "application/json", json.dumps(body))
+
+    def _send(self, status: int, content_type: str, body: str) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(job_queue: JobQueue,
+          host: str,
+          port: int,
+          socket_path: Optional[str] = None) -> None:
+    """Serve the API for a job queue until interrupted, running its
+    workers."""
+    handler = type("RequestHandler", (_RequestHandler, ),
+                   {"job_queue": job_queue})
+    if socket_path is not None:
+        if path.exists(socket_path):
+            os.remove(socket_path)
+        server = _UnixHTTPServer(socket_path, handler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        address = f"http://{host}:{server.server_address[1]}"
+
+    job_queue.ignore_thread()
+    log_handler = JobLogHandler(job_queue)
+    logging.getLogger().addHandler(log_handler)
+    job_queue.start()
+    logging.info(f"Serving jobs on {address} with {job_queue.workers} "
+                 "worker(s)")
+
+    # stop the same way on SIGTERM as on Ctrl+C
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Stopping, waiting for running jobs to finish...")
+    finally:
+        server.server_close()
+        job_queue.stop()
+        logging.getLogger().removeHandler(log_handler)
+        if socket_path is not None and path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def _interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt()
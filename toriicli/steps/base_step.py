@@ -1,6 +1,7 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
-import glob
+from functools import lru_cache
+import logging
 import tempfile
 from typing import Mapping, Any
 import os
@@ -10,6 +11,7 @@ import shutil
 from jinja2 import Template
 
 from . import schemas
+from .. import cleanup, matcher
 
 
 class BaseStep(ABC):
@@ -22,11 +24,14 @@ class BaseStep(ABC):
         filter: The conditions upon which this step should be run.
         workspace: The TemporaryDirectory used to store this step's files.
     """
-    def __init__(self, keep: str, context: dict,
+    def __init__(self, keep: matcher.Patterns, context: dict,
                  filter: schemas.StepFilter) -> None:
         self.workspace = tempfile.mkdtemp()
         self.context = context
-        self.keep = self.template(keep)
+        if isinstance(keep, str):
+            self.keep = self.template(keep)
+        else:
+            self.keep = [self.template(pattern) for pattern in keep]
         self.filter = filter
 
     @abstractmethod
@@ -35,30 +40,37 @@ class BaseStep(ABC):
         raise NotImplementedError()
 
     def cleanup(self) -> None:
-        """Clean up after running this step. Deletes the workspace."""
-        shutil.rmtree(self.workspace)
+        """Clean up after running this step. Deletes the workspace in the
+        background."""
+        cleanup.remove_tree(self.workspace)
 
     def template(self, string: str) -> str:
         """Template a string using this step's context."""
         if string is None:
             return None
         expanded_vars = path.expandvars(string)
-        return Template(expanded_vars).render(**self.context)
+        return _compile_template(expanded_vars).render(**self.context)
 
-    def use_workspace(self, step: BaseStep) -> None:
+    def use_workspace(self, step: BaseStep) -> matcher.MatchResult:
         """Copy things from the workspace of another step into this step.
-        Will filter based on glob pattern in self.keep.
+        Will filter based on the glob patterns in self.keep. Returns the files
+        and folders that were copied.
         """
-        glob_expr = path.join(step.workspace, self.keep)
-        for file in glob.iglob(glob_expr):
-            path_in_workspace = path.relpath(file, step.workspace)
-            path_in_new_workspace = path.join(self.workspace,
-                                              path_in_workspace)
+        matches = matcher.Matcher(self.keep).walk(step.workspace)
+        for rel_dir in matches.dirs:
+            os.makedirs(path.join(self.workspace, rel_dir), exist_ok=True)
+        for rel_file in matches.files:
+            path_in_new_workspace = path.join(self.workspace, rel_file)
+            os.makedirs(path.dirname(path_in_new_workspace), exist_ok=True)
+            shutil.copy2(path.join(step.workspace, rel_file),
+                         path_in_new_workspace)
+        logging.info(f"Kept {matches.file_count} file(s) "
+                     f"({matches.byte_count} bytes) from the previous step")
+        return matches
 
-            if path_in_workspace == ".":
-                continue
 
-            if path.isdir(file):
-                shutil.copytree(file, path_in_new_workspace)
-            else:
-                shutil.copy(file, path_in_new_workspace)
+@lru_cache(maxsize=1024)
+def _compile_template(string: str) -> Template:
+    """Compile a template, reusing it if the same string was compiled
+    before, as the same values are templated for every target and run."""
+    return Template(string)
@@ -1,42 +1,185 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import json
 import logging
 from os import path
-import subprocess
-from typing import List, Optional
+import re
+from typing import Any, List, Mapping, Optional, Union
 
 from . import base_step, schemas
+from .. import limits, metrics, process
+
+PUSH_CONCURRENCY = 4
+"""How many channels to push to at once."""
+
+SIZE_PATTERN = r"(\d+(?:\.\d+)?) ?([kKMGTPE]i?B|B)"
+"""A size as butler prints it, i.e. '1.5 MiB'."""
+
+PATCH_SIZE_RE = re.compile(SIZE_PATTERN + r" patch")
+UPLOADED_RE = re.compile(r"(?:[Uu]ploaded|[Ss]ent|[Pp]ushed) " + SIZE_PATTERN)
+FRESH_DATA_RE = re.compile(r"added " + SIZE_PATTERN + r" fresh data")
+
+_UNIT_POWERS = {"": 0, "K": 1, "M": 2, "G": 3, "T": 4, "P": 5, "E": 6}
+
+
+@dataclass
+class Push:
+    """A push of a directory to a channel.
+
+    Attributes:
+        channel: The channel to push to.
+        directory: The directory to push.
+    """
+    channel: str
+    directory: str
 
 
 class ButlerStep(base_step.BaseStep):
+    """Push files in the workspace to itch.io channels with butler. Pushes to
+    several channels run at once, up to a limit."""
     def __init__(self,
                  keep: str,
                  context: dict,
                  filter: schemas.StepFilter,
-                 directory: str,
                  user: str,
                  game: str,
-                 channel: str,
-                 user_version: Optional[str] = None) -> None:
+                 directory: Optional[str] = None,
+                 channel: Optional[str] = None,
+                 channels: Optional[list] = None,
+                 user_version: Optional[str] = None,
+                 concurrency: int = PUSH_CONCURRENCY,
+                 limits: Optional[dict] = None) -> None:
         super().__init__(keep, context, filter)
-        self.directory = path.join(self.workspace, self.template(directory))
         self.user = self.template(user)
         self.game = self.template(game)
-        self.channel = self.template(channel)
         self.user_version = self.template(user_version)
+        if (channel is None) == (channels is None):
+            raise ValueError("One of 'channel' or 'channels' must be given "
+                             "to butler step")
+        if channel is not None:
+            channels = [channel]
+        if not isinstance(channels, list) or len(channels) == 0:
+            raise ValueError("'channels' of butler step must be a list")
+        if concurrency < 1:
+            raise ValueError("'concurrency' of butler step must be at "
+                             "least 1")
+        self.concurrency = concurrency
+        self.limits = process.limits_from_config(limits)
+        self.pushes = [self._make_push(c, directory) for c in channels]
 
     def perform(self) -> bool:
         logging.info("--> Running butler...")
+        outputs = [_PushOutput(push.channel) for push in self.pushes]
+        commands = [
+            process.Command(self._butler_args(push),
+                            on_output=output,
+                            limits=self.limits)
+            for push, output in zip(self.pushes, outputs)
+        ]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = list(executor.map(_run_push, commands))
+
+        success = True
+        for push, output, result in zip(self.pushes, outputs, results):
+            metrics.butler_push(push.channel, result.success, result.wall_time,
+                                output.uploaded_bytes, output.patch_bytes)
+            if output.uploaded_bytes is not None:
+                metrics.transferred(uploaded=output.uploaded_bytes)
+            if not result.success:
+                logging.error(f"butler push to {push.channel} failed with "
+                              f"exit code {result.returncode}")
+                success = False
+        return success
+
+    def _make_push(self, channel: Union[str, Mapping[str, Any]],
+                   directory: Optional[str]) -> Push:
+        if isinstance(channel, Mapping):
+            directory = channel.get("directory", directory)
+            channel = channel.get("channel")
+        if not isinstance(channel, str):
+            raise ValueError("Each of the 'channels' of butler step must be "
+                             "a channel, or have a 'channel'")
+        if directory is None:
+            raise ValueError(f"Missing 'directory' to push to channel "
+                             f"'{channel}' in butler step")
+        return Push(self.template(channel),
+                    path.join(self.workspace, self.template(directory)))
+
+    def _butler_args(self, push: Push) -> List[str]:
         butler_args = [
-            "butler", "push", self.directory,
-            f"{self.user}/{self.game}:{self.channel}"
+            "butler", "--json", "push", push.directory,
+            f"{self.user}/{self.game}:{push.channel}"
         ]
         if self.user_version is not None:
             butler_args += ["--userversion", self.user_version]
-        proc = subprocess.Popen(butler_args,
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.STDOUT)
-        for line in iter(proc.stdout.readline, b""):
-            logging.info(f"--> {line.decode('utf-8').rstrip()}")
-
-        proc.wait()
-        return True
\ No newline at end of file
+        return butler_args
+
+
+def _run_push(command: process.Command) -> process.ProcessResult:
+    """Run a butler push, holding a transfer for as long as it runs, so each
+    push counts towards the limit on transfers."""
+    with limits.hold(limits.TRANSFER):
+        return process.run_many([command])[0]
+
+
+class _PushOutput:
+    """Handles the JSON lines butler prints with '--json', logging its
+    messages and picking out how much it uploaded."""
+    def __init__(self, channel: str) -> None:
+        self.channel = channel
+        self.uploaded_bytes: Optional[int] = None
+        self.patch_bytes: Optional[int] = None
+        self._fresh_bytes: Optional[int] = None
+        self._partial_line = b""
+
+    def __call__(self, chunk: bytes) -> None:
+        lines = (self._partial_line + chunk).split(b"\n")
+        self._partial_line = b"" if chunk == b"" else lines.pop()
+        for line in lines:
+            line = line.decode("utf-8", "replace").strip()
+            if line:
+                self._handle_line(line)
+        if chunk == b"" and self.uploaded_bytes is None:
+            # butler uploads the patch, or all the fresh data on the first
+            # push to a channel
+            self.uploaded_bytes = self.patch_bytes \
+                if self.patch_bytes is not None else self._fresh_bytes
+
+    def _handle_line(self, line: str) -> None:
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            # not everything butler prints is JSON, i.e. crashes
+            logging.info(f"--> [{self.channel}] {line}")
+            return
+
+        text = message.get("message")
+        if not isinstance(text, str):
+            # progress updates are too frequent to log
+            return
+        self._read_sizes(text)
+        if message.get("level") == "error":
+            logging.error(f"[{self.channel}] {text}")
+        else:
+            logging.info(f"--> [{self.channel}] {text}")
+
+    def _read_sizes(self, text: str) -> None:
+        match = PATCH_SIZE_RE.search(text)
+        if match is not None:
+            self.patch_bytes = _parse_size(*match.groups())
+        match = UPLOADED_RE.search(text)
+        if match is not None:
+            self.uploaded_bytes = _parse_size(*match.groups())
+        match = FRESH_DATA_RE.search(text)
+        if match is not None:
+            self._fresh_bytes = _parse_size(*match.groups())
+
+
+def _parse_size(number: str, unit: str) -> int:
+    """Parse a size like butler prints it, i.e. ('1.5', 'MiB')."""
+    base = 1024 if "i" in unit else 1000
+    power = _UNIT_POWERS[unit[:-1].rstrip("i").upper()]
+    return int(float(number) * base**power)
@@ -0,0 +1,54 @@
+from __future__ import annotations
+import hashlib
+import logging
+from os import path
+from typing import Optional
+
+from . import base_step, schemas
+from .. import hashing, matcher
+
+CONTEXT_KEY = "checksums"
+"""The key in the context that the hashes of files are put under."""
+
+
+class ChecksumStep(base_step.BaseStep):
+    """Hash every file in the workspace, and write the hashes to a manifest
+    file in the workspace in the format of sha256sum. The hashes are also put
+    in the context under 'checksums', keyed by path, so steps after this can
+    use them."""
+    def __init__(self,
+                 keep: str,
+                 context: dict,
+                 filter: schemas.StepFilter,
+                 algorithm: str = "sha256",
+                 manifest: Optional[str] = None) -> None:
+        super().__init__(keep, context, filter)
+        if algorithm not in hashlib.algorithms_available:
+            raise ValueError(f"Unknown hash algorithm '{algorithm}'")
+        self.algorithm = algorithm
+        self.manifest = self.template(manifest or f"{algorithm.upper()}SUMS")
+
+    def perform(self) -> bool:
+        logging.info("--> Running checksum...")
+        files = [
+            rel_path
+            for rel_path in matcher.Matcher("**").walk(self.workspace).files
+            if rel_path != self.manifest
+        ]
+        digests = hashing.hash_files(
+            [path.join(self.workspace, rel_path) for rel_path in files],
+            self.algorithm)
+        checksums = {
+            rel_path: digests[path.join(self.workspace, rel_path)]
+            for rel_path in files
+        }
+
+        with open(path.join(self.workspace, self.manifest), "w",
+                  newline="\n") as manifest_file:
+            for rel_path in sorted(checksums):
+                manifest_file.write(f"{checksums[rel_path]}  {rel_path}\n")
+
+        self.context[CONTEXT_KEY] = checksums
+        logging.info(f"--> Hashed {len(checksums)} file(s) into "
+                     f"{self.manifest}")
+        return True
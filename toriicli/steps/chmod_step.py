@@ -28,3 +28,4 @@ class ChmodStep(base_step.BaseStep):
         permissions = functools.reduce(operator.or_, permissions_bits,
                                        st.st_mode)
         os.chmod(path_to_file, permissions)
+        return True
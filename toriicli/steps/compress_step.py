@@ -5,6 +5,7 @@ import shutil
 import tempfile
 
 from . import base_step, schemas
+from .. import limits
 
 
 class CompressStep(base_step.BaseStep):
@@ -16,7 +17,8 @@ class CompressStep(base_step.BaseStep):
 
     def perform(self) -> bool:
         logging.info("--> Running compress...")
-        with tempfile.TemporaryDirectory() as temp_dir:
+        with tempfile.TemporaryDirectory() as temp_dir, \
+                limits.hold(limits.COMPRESS):
             archive_path = shutil.make_archive(path.join(
                 temp_dir, self.archive_name),
                                                self.format,
@@ -24,3 +26,4 @@ class CompressStep(base_step.BaseStep):
             archive_name = path.basename(archive_path)
             shutil.copy(path.join(temp_dir, archive_name),
                         path.join(self.workspace, archive_name))
+        return True
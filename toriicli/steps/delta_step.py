@@ -0,0 +1,61 @@
+from __future__ import annotations
+import logging
+from os import path
+import shutil
+import tempfile
+from typing import Any, Mapping, Optional
+
+from . import base_step, import_step, schemas
+from .. import delta, limits
+
+
+class DeltaStep(base_step.BaseStep):
+    """Make a patch from the previous build to the build in the workspace, so
+    players only need to download what changed. The previous build is
+    imported with any storage backend, like the import step.
+
+    The patch is written to a folder in the workspace, containing a binary
+    delta of each changed file, new files in full, and a manifest. Deltas are
+    made in parallel, one process per core."""
+    def __init__(self,
+                 keep: str,
+                 context: dict,
+                 filter: schemas.StepFilter,
+                 previous: Mapping[str, Any],
+                 output: str = "patch",
+                 workers: Optional[int] = None) -> None:
+        super().__init__(keep, context, filter)
+        if not isinstance(previous, Mapping):
+            raise ValueError(
+                "'previous' in delta step must be the 'using' section of an "
+                "import step")
+        self.previous = import_step.ImportStep("**", context, filter,
+                                               **previous)
+        self.output = self.template(output)
+        self.workers = workers
+
+    def perform(self) -> bool:
+        logging.info("--> Running delta...")
+        if not self.previous.perform():
+            return False
+
+        # make the patch outside of the workspace, so it's not diffed too
+        patch_root = tempfile.mkdtemp()
+        try:
+            with limits.hold(limits.COMPRESS):
+                result = delta.make_patch(self.previous.workspace,
+                                          self.workspace, patch_root,
+                                          self.workers)
+            shutil.move(patch_root, path.join(self.workspace, self.output))
+        finally:
+            shutil.rmtree(patch_root, ignore_errors=True)
+
+        logging.info(f"--> Patched {len(result.patched)} file(s), added "
+                     f"{len(result.added)}, removed {len(result.removed)} "
+                     f"({result.unchanged} unchanged), patch is "
+                     f"{result.patch_size} bytes")
+        return True
+
+    def cleanup(self) -> None:
+        super().cleanup()
+        self.previous.cleanup()
@@ -2,9 +2,11 @@ from __future__ import annotations
 import logging
 import os
 from os import path
+from typing import Optional
 
 from . import base_step, schemas
-from ..storage import make_provider
+from .. import limits
+from ..storage import make_provider, manifest as _manifest
 
 
 class ExportStep(base_step.BaseStep):
@@ -13,6 +15,7 @@ class ExportStep(base_step.BaseStep):
                  context: dict,
                  filter: schemas.StepFilter,
                  path_prefix: str = "",
+                 manifest: Optional[str] = None,
                  **kwargs) -> None:
         super().__init__(keep, context, filter)
         backend = kwargs.pop("backend", None)
@@ -22,15 +25,27 @@ class ExportStep(base_step.BaseStep):
         for k, v in kwargs.items():
             kwargs[k] = self.template(v)
         self.path_prefix = self.template(path_prefix)
+        self.manifest = self.template(manifest) or None
         self.provider = make_provider(backend, **kwargs)
 
     def perform(self) -> bool:
         logging.info("--> Running export...")
+        export_manifest = _manifest.Manifest()
         for root, _, files in os.walk(self.workspace):
             for file in files:
                 file_path = path.join(root, file)
-                key = path.relpath(file_path, start=self.workspace)
-                key = "/".join([self.path_prefix, key])
-                with open(file_path, 'rb') as file_handle:
+                name = path.relpath(file_path, start=self.workspace)
+                key = "/".join([self.path_prefix, name])
+                with open(file_path, 'rb') as file_handle, \
+                        limits.hold(limits.TRANSFER):
                     self.provider.store(file_handle, key)
-        return True
\ No newline at end of file
+                if self.manifest is not None:
+                    # manifests are the same whichever OS wrote them
+                    export_manifest.add_file(name.replace(os.sep, "/"),
+                                             file_path)
+
+        if self.manifest is not None:
+            manifest_key = "/".join([self.path_prefix, self.manifest])
+            logging.info(f"--> Writing manifest {manifest_key}")
+            self.provider.store(export_manifest.dumps(), manifest_key)
+        return True
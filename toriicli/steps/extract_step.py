@@ -0,0 +1,154 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import logging
+import os
+from os import path
+import shutil
+import tarfile
+import threading
+from typing import Optional
+import zipfile
+
+from . import base_step, schemas
+from .. import hashing, limits, sync
+from ..storage import make_provider
+
+EXTRACT_WORKERS = 8
+"""How many zip members to extract at once."""
+
+ZIP_EXTENSIONS = (".zip", )
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz",
+                  ".txz")
+
+
+class ExtractStep(base_step.BaseStep):
+    """Extract an archive from storage into the workspace, streaming it from
+    the backend rather than downloading it first, so only the extracted files
+    take up disk space.
+
+    Tar archives (compressed or not) are decompressed as they stream in. Zip
+    files are read with range requests, so their members can be extracted in
+    parallel."""
+    def __init__(self,
+                 keep: str,
+                 context: dict,
+                 filter: schemas.StepFilter,
+                 key: str,
+                 folder: Optional[str] = None,
+                 format: Optional[str] = None,
+                 workers: int = EXTRACT_WORKERS,
+                 **kwargs) -> None:
+        super().__init__(keep, context, filter)
+        backend = kwargs.pop("backend", None)
+        if backend is None:
+            raise ValueError(
+                "Missing 'backend' in 'using' section of extract step")
+        for k, v in kwargs.items():
+            kwargs[k] = self.template(v)
+        self.key = self.template(key)
+        self.folder = self.template(folder)
+        self.format = format or _guess_format(self.key)
+        if self.format is None:
+            raise ValueError(f"Unable to tell the archive format of "
+                             f"'{self.key}', give it with 'format'")
+        if self.format not in ("zip", "tar"):
+            raise ValueError(f"Unable to extract archive format "
+                             f"'{self.format}', must be 'zip' or 'tar'")
+        self.workers = workers
+        self.provider = make_provider(backend, **kwargs)
+
+    def perform(self) -> bool:
+        logging.info("--> Running extract...")
+        dst = self.workspace
+        if self.folder is not None:
+            dst = path.join(self.workspace, sync.safe_relpath(self.folder))
+        os.makedirs(dst, exist_ok=True)
+
+        with limits.hold(limits.TRANSFER):
+            if self.format == "zip":
+                count = self._extract_zip(dst)
+            else:
+                count = self._extract_tar(dst)
+        logging.info(f"--> Extracted {count} file(s) from {self.key}")
+        return True
+
+    def _extract_tar(self, dst: str) -> int:
+        count = 0
+        with closing(self.provider.open(self.key)) as stream, \
+                tarfile.open(fileobj=stream, mode="r|*") as archive:
+            # members have to be extracted in order, as the archive can only
+            # be read forwards
+            for member in archive:
+                rel_path = sync.safe_relpath(member.name)
+                member_path = path.join(dst, rel_path)
+                if member.isdir():
+                    os.makedirs(member_path, exist_ok=True)
+                elif member.isfile():
+                    os.makedirs(path.dirname(member_path), exist_ok=True)
+                    with archive.extractfile(member) as member_file, \
+                            open(member_path, "wb") as out_file:
+                        shutil.copyfileobj(member_file, out_file,
+                                           hashing.HASH_BUFFER_SIZE)
+                    os.chmod(member_path, member.mode & 0o755 | 0o600)
+                    os.utime(member_path, (member.mtime, member.mtime))
+                    count += 1
+                elif hasattr(tarfile, "data_filter"):
+                    # let tarfile check links don't point outside the folder
+                    archive.extract(member, dst, filter="data")
+                else:
+                    logging.warning(
+                        f"Skipping '{member.name}' in {self.key}, as links "
+                        "can't be extracted safely on this Python version")
+        return count
+
+    def _extract_zip(self, dst: str) -> int:
+        with self.provider.open_seekable(self.key) as archive_file, \
+                zipfile.ZipFile(archive_file) as archive:
+            members = {}
+            for info in archive.infolist():
+                rel_path = sync.safe_relpath(info.filename)
+                if info.is_dir():
+                    os.makedirs(path.join(dst, rel_path), exist_ok=True)
+                else:
+                    members[rel_path] = info
+
+        # ZipFile isn't safe to read from on several threads, so each thread
+        # opens its own
+        local = threading.local()
+        opened = []
+        opened_lock = threading.Lock()
+
+        def extract_member(rel_path: str) -> None:
+            if not hasattr(local, "archive"):
+                archive_file = self.provider.open_seekable(self.key)
+                local.archive = zipfile.ZipFile(archive_file)
+                with opened_lock:
+                    opened.append((local.archive, archive_file))
+            info = members[rel_path]
+            member_path = path.join(dst, rel_path)
+            os.makedirs(path.dirname(member_path), exist_ok=True)
+            with local.archive.open(info) as member_file, \
+                    open(member_path, "wb") as out_file:
+                shutil.copyfileobj(member_file, out_file,
+                                   hashing.HASH_BUFFER_SIZE)
+            mode = info.external_attr >> 16
+            if mode & 0o111:
+                os.chmod(member_path, mode & 0o755 | 0o600)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(extract_member, members))
+        finally:
+            for archive, archive_file in opened:
+                archive.close()
+                archive_file.close()
+        return len(members)
+
+
+def _guess_format(key: str) -> Optional[str]:
+    if key.lower().endswith(ZIP_EXTENSIONS):
+        return "zip"
+    if key.lower().endswith(TAR_EXTENSIONS):
+        return "tar"
+    return None
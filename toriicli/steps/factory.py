@@ -1,14 +1,18 @@
 from __future__ import annotations
 from typing import Mapping, Any
 
-from . import schemas, import_step, export_step, compress_step, base_step, chmod_step, butler_step
+from . import schemas, import_step, export_step, compress_step, base_step, chmod_step, butler_step, promote_step, checksum_step, delta_step, extract_step
 
 STEPS_IMPL = {
     "import": import_step.ImportStep,
     "export": export_step.ExportStep,
     "compress": compress_step.CompressStep,
     "chmod": chmod_step.ChmodStep,
-    "butler": butler_step.ButlerStep
+    "butler": butler_step.ButlerStep,
+    "promote": promote_step.PromoteStep,
+    "checksum": checksum_step.ChecksumStep,
+    "delta": delta_step.DeltaStep,
+    "extract": extract_step.ExtractStep
 }
 
 
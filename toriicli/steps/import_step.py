@@ -6,7 +6,8 @@ import shutil
 from typing import Optional
 
 from . import base_step, schemas
-from ..storage import make_provider
+from .. import limits
+from ..storage import make_provider, manifest as _manifest
 
 
 class ImportStep(base_step.BaseStep):
@@ -15,24 +16,49 @@ class ImportStep(base_step.BaseStep):
                  context: dict,
                  filter: schemas.StepFilter,
                  key: Optional[str] = None,
+                 manifest: Optional[str] = None,
+                 verify: bool = True,
                  **kwargs) -> None:
         super().__init__(keep, context, filter)
         backend = kwargs.pop("backend", None)
         if backend is None:
             raise ValueError(
                 "Missing 'backend' in 'using' section of import step")
+        if key is not None and manifest is not None:
+            raise ValueError(
+                "Only one of 'key' or 'manifest' can be given to import step")
         for k, v in kwargs.items():
             kwargs[k] = self.template(v)
         self.key = self.template(key)
+        self.manifest = self.template(manifest)
+        self.verify = verify
         self.provider = make_provider(backend, **kwargs)
 
     def perform(self) -> bool:
         logging.info("--> Running import...")
-        if self.key is None:
+        if self.manifest is not None:
+            self._import_from_manifest()
+        elif self.key is None:
             for obj in self.provider.ls():
                 file_path = path.join(self.workspace, obj)
-                self.provider.retrieve(obj, file_path)
+                self._retrieve(obj, file_path)
         else:
             file_path = path.join(self.workspace, path.basename(self.key))
-            self.provider.retrieve(self.key, file_path)
-        return True
\ No newline at end of file
+            self._retrieve(self.key, file_path)
+        return True
+
+    def _retrieve(self, key: str, file_path: str) -> None:
+        with limits.hold(limits.TRANSFER):
+            self.provider.retrieve(key, file_path)
+
+    def _import_from_manifest(self) -> None:
+        """Import every file listed in the manifest, rather than listing the
+        container to find them."""
+        import_manifest = _manifest.load(self.provider, self.manifest)
+        for name in import_manifest.files:
+            file_path = path.join(self.workspace, *name.split("/"))
+            self._retrieve(_manifest.sibling_key(self.manifest, name),
+                           file_path)
+            if self.verify and not import_manifest.verify(name, file_path):
+                raise ValueError(
+                    f"File '{name}' did not match manifest {self.manifest}")
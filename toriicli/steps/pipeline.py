@@ -0,0 +1,93 @@
+from __future__ import annotations
+import logging
+from typing import List, Optional
+
+from . import base_step, schemas
+from .. import journal as _journal, matcher, metrics
+from ..build import build_def
+
+
+def run_steps(step_defs: List[schemas.Step],
+              context: dict,
+              bd: build_def.BuildDef,
+              options: List[str],
+              first_step: Optional[base_step.BaseStep] = None,
+              journal: Optional[_journal.TargetJournal] = None) -> bool:
+    """Run the steps that match the filters for a build def. Each step uses
+    the workspace of the step before it, and is made just before it runs, so
+    steps can add values to the context for the steps after them. The
+    workspaces of all of the steps are cleaned up afterwards, even if a step
+    failed.
+
+    Args:
+        step_defs: The steps from the config.
+        context: The context to template the steps' values with.
+        bd: The build def the steps are running for.
+        options: The options given on the command line, used for filtering.
+        first_step: An optional step to run before the others.
+        journal: An optional journal to record each step in as it finishes.
+            If steps already finished in it, they're skipped, and the steps
+            after them use the workspace of the last one.
+
+    Returns:
+        bool: False if a step failed, in which case the steps after it are
+            not run.
+    """
+    steps_run = [] if first_step is None else [first_step]
+    try:
+        # get the steps we're running for this build def, based on the filters
+        logging.info("Collecting steps...")
+        steps_to_run = [
+            (i, step) for i, step in enumerate(step_defs)
+            if step.filter is None or step.filter.match(bd, options)
+        ]
+
+        previous_step = first_step
+        completed = 0
+        if journal is not None:
+            journal.check_steps([i for i, _ in steps_to_run])
+            completed = journal.completed
+            if completed > 0:
+                logging.info(f"Skipping {completed} step(s) that already "
+                             "finished")
+                previous_step = journal.checkpoint()
+                steps_to_run = steps_to_run[completed:]
+
+        logging.info("Running steps...")
+        # the first step is skipped if we're carrying on from the journal
+        if first_step is not None and previous_step is first_step \
+                and not first_step.perform():
+            logging.error(f"Step {type(first_step).__name__} failed")
+            return False
+
+        # now run each of the steps
+        for index, step_def in steps_to_run:
+            with metrics.step(bd.target, step_def.step, index) as step_metrics:
+                # make each step just before it runs, so its values can be
+                # templated with anything the steps before it added to the
+                # context
+                step = step_def.get_implementation(context)
+                steps_run.append(step)
+
+                # make sure we import the workspace of the step before this
+                if previous_step is not None:
+                    kept = step.use_workspace(previous_step)
+                    step_metrics.bytes_in = kept.byte_count
+                    step_metrics.files_in = kept.file_count
+
+                step_metrics.success = step.perform()
+                if metrics.enabled():
+                    output = matcher.Matcher("**").walk(step.workspace)
+                    step_metrics.bytes_out = output.byte_count
+                    step_metrics.files_out = output.file_count
+            if not step_metrics.success:
+                logging.error(f"Step {type(step).__name__} failed")
+                return False
+            completed += 1
+            if journal is not None:
+                journal.step_completed(step, completed, context)
+            previous_step = step
+        return True
+    finally:
+        # now clean up all the steps we ran
+        [step.cleanup() for step in steps_run]
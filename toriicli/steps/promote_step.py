@@ -0,0 +1,63 @@
+from __future__ import annotations
+import logging
+from typing import Any, Mapping, Optional
+
+from . import base_step, schemas
+from .. import limits
+from ..storage import make_provider, manifest as _manifest
+from ..storage.provider import StorageProvider
+
+
+class PromoteStep(base_step.BaseStep):
+    def __init__(self,
+                 keep: str,
+                 context: dict,
+                 filter: schemas.StepFilter,
+                 source: Mapping[str, Any],
+                 destination: Mapping[str, Any],
+                 key: Optional[str] = None,
+                 manifest: Optional[str] = None,
+                 path_prefix: str = "") -> None:
+        super().__init__(keep, context, filter)
+        if (key is None) == (manifest is None):
+            raise ValueError(
+                "Exactly one of 'key' or 'manifest' must be given to "
+                "promote step")
+        self.key = self.template(key)
+        self.manifest = self.template(manifest)
+        self.path_prefix = self.template(path_prefix)
+        self.source = self._make_provider("source", source)
+        self.destination = self._make_provider("destination", destination)
+
+    def perform(self) -> bool:
+        logging.info("--> Running promote...")
+        if self.key is not None:
+            self._copy(self.key, self._dest_key(self.key))
+            return True
+
+        promote_manifest = _manifest.load(self.source, self.manifest)
+        for name in promote_manifest.files:
+            self._copy(_manifest.sibling_key(self.manifest, name),
+                       _manifest.join_key(self.path_prefix, name))
+
+        # copy the manifest last, so it's only there if everything else is
+        self._copy(self.manifest, self._dest_key(self.manifest))
+        return True
+
+    def _copy(self, key: str, dest_key: str) -> None:
+        logging.info(f"--> Copying {key} to {dest_key}")
+        with limits.hold(limits.TRANSFER):
+            self.source.copy(key, self.destination, dest_key)
+
+    def _dest_key(self, key: str) -> str:
+        return _manifest.join_key(self.path_prefix, key.rsplit("/", 1)[-1])
+
+    def _make_provider(self, name: str,
+                       using: Mapping[str, Any]) -> StorageProvider:
+        using = dict(using)
+        backend = using.pop("backend", None)
+        if backend is None:
+            raise ValueError(f"Missing 'backend' in '{name}' of promote step")
+        for k, v in using.items():
+            using[k] = self.template(v)
+        return make_provider(backend, **using)
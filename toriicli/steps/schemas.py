@@ -2,9 +2,10 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Mapping, Any, List
 
-from marshmallow import Schema, fields, post_load, validate
+from marshmallow import Schema, fields, post_load, validate, ValidationError
 
 from . import base_step, factory
+from .. import matcher
 from ..build import build_def
 
 
@@ -33,12 +34,23 @@ class StepFilterSchema(Schema):
         return StepFilter(**data)
 
 
+class PatternsField(fields.Field):
+    """A glob pattern, or a list of them."""
+    def _deserialize(self, value, attr, data, **kwargs):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, list) and len(value) > 0 \
+                and all(isinstance(v, str) for v in value):
+            return value
+        raise ValidationError("Must be a string or a list of strings.")
+
+
 @dataclass
 class Step:
     step: str
     filter: StepFilter
     using: Mapping[str, Any]
-    keep: str
+    keep: matcher.Patterns
 
     def get_implementation(self, context: dict) -> base_step.BaseStep:
         """Get this step's implementation."""
@@ -57,7 +69,7 @@ class StepSchema(Schema):
                            required=False,
                            allow_none=False,
                            missing={})
-    keep = fields.Str(required=False, allow_none=False, missing="**")
+    keep = PatternsField(required=False, allow_none=False, missing="**")
 
     @post_load
     def make_step(self, data, **kwargs):
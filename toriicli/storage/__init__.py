@@ -1,3 +1,6 @@
+import threading
+from typing import Dict, Optional, Tuple
+
 from . import provider, local_provider, s3_provider
 
 PROVIDERS_MAP = {
@@ -7,6 +10,20 @@ PROVIDERS_MAP = {
 """Map provider names to implementations. Used in make_provider() factory
 function."""
 
+_shared: Optional[Dict[Tuple, provider.StorageProvider]] = None
+_shared_lock = threading.Lock()
+
+
+def share_providers() -> None:
+    """Share providers made with the same arguments from now on, rather than
+    making a new one each time. Providers keep their connections and clients
+    (i.e. boto3 sessions) open, so sharing them saves setting them up again in
+    long-running processes."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = {}
+
 
 def make_provider(provider_type: str, **kwargs) -> provider.StorageProvider:
     """Make a StorageProvider from a provider type. Call with the arguments
@@ -26,6 +43,14 @@ def make_provider(provider_type: str, **kwargs) -> provider.StorageProvider:
         TypeError: If the wrong arguments were given in kwargs.
     """
     try:
-        return PROVIDERS_MAP[provider_type](**kwargs)
+        provider_class = PROVIDERS_MAP[provider_type]
     except KeyError:
-        raise ValueError(f"Invalid storage provider_type '{provider_type}'")
\ No newline at end of file
+        raise ValueError(f"Invalid storage provider_type '{provider_type}'")
+    if _shared is None:
+        return provider_class(**kwargs)
+
+    key = (provider_type, ) + tuple(sorted(kwargs.items()))
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = provider_class(**kwargs)
+        return _shared[key]
\ No newline at end of file
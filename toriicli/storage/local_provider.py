@@ -1,10 +1,16 @@
+from __future__ import annotations
 from io import IOBase
 import os
 from os import path
 import shutil
-from typing import Generator, Union
+from typing import BinaryIO, Generator, Union
+import uuid
 
 from . import provider
+from .. import metrics
+
+TEMP_SUFFIX = ".toriicli-tmp"
+"""The suffix of files being written, which aren't listed."""
 
 
 class LocalStorageProvider(provider.StorageProvider):
@@ -19,18 +25,12 @@ class LocalStorageProvider(provider.StorageProvider):
     def store(self, data: Union[IOBase, str, bytes], key: str) -> None:
         self._ensure_container()
         file_path = path.join(self.container, key)
-        os.makedirs(path.dirname(file_path), exist_ok=True)
-        if issubclass(type(data), IOBase):
-            with open(file_path, "wb") as file_handle:
-                shutil.copyfileobj(data, file_handle)
-        elif type(data) == str:
-            with open(file_path, "w") as file_handle:
-                file_handle.write(data)
-        elif type(data) == bytes:
-            with open(file_path, "wb") as file_handle:
-                file_handle.write(data)
-        else:
-            raise TypeError(f"invalid data type '{type(data)}'")
+        temp_path = self._write_temp(data, file_path)
+        # replace the file in one go, so anything reading it never sees it
+        # half-written
+        os.replace(temp_path, file_path)
+        metrics.request("local.store")
+        metrics.transferred(uploaded=path.getsize(file_path))
 
     def retrieve(self, key: str, filename: str) -> None:
         self._ensure_container()
@@ -38,13 +38,113 @@ class LocalStorageProvider(provider.StorageProvider):
         with open(path.join(self.container, key), "rb") as file_handle, \
                 open(filename, "wb") as out_file_handle:
             shutil.copyfileobj(file_handle, out_file_handle)
+        metrics.request("local.retrieve")
+        metrics.transferred(downloaded=path.getsize(filename))
+
+    def store_if_absent(self, data: Union[str, bytes], key: str) -> bool:
+        self._ensure_container()
+        file_path = path.join(self.container, key)
+        temp_path = self._write_temp(data, file_path)
+        try:
+            # linking fails if the file exists, and makes it already written
+            os.link(temp_path, file_path)
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(temp_path)
+        metrics.request("local.store")
+        metrics.transferred(uploaded=len(data))
+        return True
+
+    def delete(self, key: str) -> None:
+        file_path = path.join(self.container, key)
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            return
+        metrics.request("local.delete")
+
+        # remove folders left empty, as there are no folders in other
+        # backends to delete
+        folder = path.dirname(file_path)
+        while path.normpath(folder) != path.normpath(self.container):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = path.dirname(folder)
+
+    def exists(self, key: str) -> bool:
+        return path.isfile(path.join(self.container, key))
+
+    def open(self, key: str) -> BinaryIO:
+        return open(path.join(self.container, key), "rb")
+
+    def size(self, key: str) -> int:
+        return path.getsize(path.join(self.container, key))
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        with open(path.join(self.container, key), "rb") as file_handle:
+            file_handle.seek(start)
+            data = file_handle.read(length)
+        metrics.request("local.read_range")
+        metrics.transferred(downloaded=len(data))
+        return data
+
+    def open_seekable(self, key: str) -> BinaryIO:
+        # local files can be seeked already
+        return self.open(key)
+
+    def copy(self, key: str, dest: provider.StorageProvider,
+             dest_key: str) -> None:
+        if not isinstance(dest, LocalStorageProvider):
+            super().copy(key, dest, dest_key)
+            return
 
-    def ls(self) -> Generator[str, None, None]:
         self._ensure_container()
-        for dirpath, _, filenames in os.walk(self.container):
+        dest_path = path.join(dest.container, dest_key)
+        os.makedirs(path.dirname(dest_path), exist_ok=True)
+        shutil.copyfile(path.join(self.container, key), dest_path)
+
+    def ls(self, prefix: str = "") -> Generator[str, None, None]:
+        self._ensure_container()
+        # only walk the folder the prefix is in
+        folder = path.join(self.container, path.dirname(prefix))
+        for dirpath, _, filenames in os.walk(folder):
             for filename in filenames:
+                if filename.endswith(TEMP_SUFFIX):
+                    continue
                 full_path = path.join(dirpath, filename)
-                yield path.relpath(full_path, self.container)
+                key = path.relpath(full_path,
+                                   self.container).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    yield key
 
     def _ensure_container(self) -> None:
-        os.makedirs(self.container, exist_ok=True)
\ No newline at end of file
+        os.makedirs(self.container, exist_ok=True)
+
+    def _write_temp(self, data: Union[IOBase, str, bytes],
+                    file_path: str) -> str:
+        """Write data to a temporary file next to a path, returning the path
+        of the temporary file."""
+        os.makedirs(path.dirname(file_path), exist_ok=True)
+        if not (issubclass(type(data), IOBase) or type(data) in (str, bytes)):
+            raise TypeError(f"invalid data type '{type(data)}'")
+        # made like any other file rather than with mkstemp, which only lets
+        # its owner read it
+        temp_path = f"{file_path}.{uuid.uuid4().hex[:8]}{TEMP_SUFFIX}"
+        try:
+            if type(data) == str:
+                with open(temp_path, "x") as file_handle:
+                    file_handle.write(data)
+            else:
+                with open(temp_path, "xb") as file_handle:
+                    if type(data) == bytes:
+                        file_handle.write(data)
+                    else:
+                        shutil.copyfileobj(data, file_handle)
+        except BaseException:
+            if path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return temp_path
@@ -0,0 +1,111 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+import json
+import os
+from os import path
+import tempfile
+from typing import Dict, List
+
+from . import provider
+from .. import hashing
+
+MANIFEST_VERSION = 1
+"""The version of the manifest format, stored in each manifest."""
+
+
+def join_key(*parts: str) -> str:
+    """Join parts of a storage key together with '/', ignoring empty parts."""
+    return "/".join(part.strip("/") for part in parts if part)
+
+
+def sibling_key(key: str, name: str) -> str:
+    """Get the key of a file named relative to the 'directory' of another
+    key, keeping its leading '/' if it has one, as export steps write."""
+    return key.rsplit("/", 1)[0] + "/" + name if "/" in key else name
+
+
+@dataclass
+class ManifestEntry:
+    size: int
+    sha256: str
+    mtime: int
+
+
+@dataclass
+class ManifestDiff:
+    added: List[str]
+    removed: List[str]
+    changed: List[str]
+
+
+@dataclass
+class Manifest:
+    """An index of the files that were exported together, stored alongside
+    them so they can be found without listing the storage container.
+
+    Keys in the manifest are relative to the directory the manifest is
+    stored in.
+
+    Attributes:
+        files: Map of keys to the metadata of the file stored there.
+    """
+    files: Dict[str, ManifestEntry] = field(default_factory=dict)
+
+    def add_file(self, key: str, file_path: str) -> ManifestEntry:
+        """Add a file on disk to the manifest under the given key."""
+        st = os.stat(file_path)
+        entry = ManifestEntry(st.st_size, hashing.hash_file(file_path),
+                              int(st.st_mtime))
+        self.files[key] = entry
+        return entry
+
+    def verify(self, key: str, file_path: str) -> bool:
+        """Check that a file on disk matches the entry for a key."""
+        entry = self.files[key]
+        if os.stat(file_path).st_size != entry.size:
+            return False
+        return hashing.hash_file(file_path) == entry.sha256
+
+    def diff(self, other: Manifest) -> ManifestDiff:
+        """Work out what changed going from this manifest to another."""
+        added = [key for key in other.files if key not in self.files]
+        removed = [key for key in self.files if key not in other.files]
+        changed = [
+            key for key, entry in other.files.items()
+            if key in self.files and self.files[key].sha256 != entry.sha256
+        ]
+        return ManifestDiff(sorted(added), sorted(removed), sorted(changed))
+
+    def dumps(self) -> str:
+        """Serialize the manifest to a compact JSON string."""
+        files = {
+            key: [entry.size, entry.sha256, entry.mtime]
+            for key, entry in sorted(self.files.items())
+        }
+        data = {"version": MANIFEST_VERSION, "files": files}
+        return json.dumps(data, separators=(",", ":"))
+
+    @staticmethod
+    def loads(data: str) -> Manifest:
+        """Deserialize a manifest from a JSON string.
+
+        Raises:
+            ValueError: If the data was not a valid manifest.
+        """
+        parsed = json.loads(data)
+        if parsed.get("version") != MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported manifest version '{parsed.get('version')}'")
+        return Manifest({
+            key: ManifestEntry(*values)
+            for key, values in parsed["files"].items()
+        })
+
+
+def load(storage: provider.StorageProvider, key: str) -> Manifest:
+    """Retrieve and parse the manifest stored at a key in a provider."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manifest_path = path.join(temp_dir, path.basename(key))
+        storage.retrieve(key, manifest_path)
+        with open(manifest_path, "r") as manifest_file:
+            return Manifest.loads(manifest_file.read())
@@ -1,6 +1,14 @@
+from __future__ import annotations
 from abc import ABC, abstractmethod
+import io
 from io import IOBase
-from typing import Generator, ContextManager, Union
+from os import path
+import tempfile
+from typing import BinaryIO, Generator, ContextManager, Union
+
+RANGE_BUFFER_SIZE = 64 * 1024
+"""How many bytes to read at once when reading a blob in ranges. Reads bigger
+than this go straight to the backend."""
 
 
 class StorageProvider(ABC):
@@ -26,10 +34,149 @@ class StorageProvider(ABC):
         raise NotImplementedError()
 
     @abstractmethod
-    def ls(self) -> Generator[str, None, None]:
+    def ls(self, prefix: str = "") -> Generator[str, None, None]:
         """List blobs within a container.
 
+        Args:
+            prefix: Only list blobs with keys starting with this.
+
         Yields:
             str: The names of blobs within the container.
         """
-        raise NotImplementedError()
\ No newline at end of file
+        raise NotImplementedError()
+
+    def store_if_absent(self, data: Union[str, bytes], key: str) -> bool:
+        """Store a piece of data at a given key, only if nothing is stored
+        there yet. Checking and storing happen as one operation, so if many
+        processes try to store the same key, only one of them does.
+
+        Args:
+            data: The data to store.
+            key: The path within the container to store it in.
+
+        Returns:
+            bool: False if something was already stored at the key.
+        """
+        raise NotImplementedError()
+
+    def delete(self, key: str) -> None:
+        """Delete a blob. Does nothing if there's no blob at the key.
+
+        Args:
+            key: The key within the container to delete.
+        """
+        raise NotImplementedError()
+
+    def exists(self, key: str) -> bool:
+        """Check whether a blob exists at a given key.
+
+        By default this lists the container, providers should override it
+        with something cheaper if they can.
+
+        Args:
+            key: The key within the container to check.
+        """
+        return any(obj == key for obj in self.ls())
+
+    def open(self, key: str) -> BinaryIO:
+        """Open a blob to stream its data, without downloading it first. The
+        stream can only be read forwards.
+
+        Args:
+            key: The key within the container to stream.
+        """
+        raise NotImplementedError()
+
+    def size(self, key: str) -> int:
+        """Get the size of a blob in bytes.
+
+        Args:
+            key: The key within the container to get the size of.
+        """
+        raise NotImplementedError()
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        """Read part of a blob.
+
+        Args:
+            key: The key within the container to read from.
+            start: The offset of the first byte to read.
+            length: How many bytes to read. Fewer are returned at the end of
+                the blob.
+        """
+        raise NotImplementedError()
+
+    def open_seekable(self, key: str) -> BinaryIO:
+        """Open a blob as a seekable file, which reads it in ranges as
+        needed rather than downloading all of it.
+
+        Args:
+            key: The key within the container to open.
+        """
+        return io.BufferedReader(RangeReader(self, key),
+                                 buffer_size=RANGE_BUFFER_SIZE)
+
+    def copy(self, key: str, dest: StorageProvider, dest_key: str) -> None:
+        """Copy a blob from this provider to a key in another provider.
+
+        By default this streams the blob through a local temporary file.
+        Providers that can copy without the data leaving the backend (i.e.
+        between two buckets in the same service) should override this.
+
+        Args:
+            key: The key within this container to copy from.
+            dest: The provider to copy the blob to.
+            dest_key: The key within the destination container to copy to.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_path = path.join(temp_dir, "blob")
+            self.retrieve(key, file_path)
+            with open(file_path, "rb") as file_handle:
+                dest.store(file_handle, dest_key)
+
+
+class RangeReader(io.RawIOBase):
+    """A seekable, read-only file over a blob, which reads the blob in ranges
+    with StorageProvider.read_range.
+
+    Args:
+        provider: The provider the blob is in.
+        key: The key of the blob.
+    """
+    def __init__(self, provider: StorageProvider, key: str) -> None:
+        super().__init__()
+        self.provider = provider
+        self.key = key
+        self.length = provider.size(key)
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.length + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if self.position < 0:
+            raise ValueError("Negative seek position")
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        size = min(len(buffer), self.length - self.position)
+        if size <= 0:
+            return 0
+        data = self.provider.read_range(self.key, self.position, size)
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
@@ -1,9 +1,19 @@
+from __future__ import annotations
 from io import IOBase
-from typing import Generator, Union
+import os
+from os import path
+from typing import BinaryIO, Generator, Union
 
 import boto3
+from botocore.exceptions import ClientError
 
 from . import provider
+from .. import metrics
+
+IF_NONE_MATCH_PARAM = "ToriiIfNoneMatch"
+"""Passed to put_object to make it a conditional write. botocore only knows
+about 'IfNoneMatch' from 1.35.10, which needs a newer Python than we support,
+so the header is added by hand."""
 
 
 class S3StorageProvider(provider.StorageProvider):
@@ -18,24 +28,34 @@ class S3StorageProvider(provider.StorageProvider):
         container (str): The S3 bucket we're using for storage.
     """
     def __init__(self, region: str, endpoint: str, container: str):
+        self.region = region
+        self.endpoint = endpoint
         self.container = container
         self.session = boto3.session.Session()
         self.client = self.session.client("s3",
                                           region_name=region,
                                           endpoint_url=endpoint)
+        self.client.meta.events.register("after-call.s3", _record_request)
+        self.client.meta.events.register("before-parameter-build.s3.PutObject",
+                                         _take_if_none_match)
+        self.client.meta.events.register("before-call.s3.PutObject",
+                                         _add_if_none_match)
 
     def store(self,
               data: Union[IOBase, str, bytes],
               key: str,
               acl: str = None) -> None:
         if issubclass(type(data), IOBase):
+            start = data.tell()
             self.client.upload_fileobj(data, self.container, key)
+            metrics.transferred(uploaded=data.tell() - start)
         elif type(data) == str:
-            self.client.put_object(Body=data.encode("utf-8"),
-                                   Bucket=self.container,
-                                   Key=key)
+            body = data.encode("utf-8")
+            self.client.put_object(Body=body, Bucket=self.container, Key=key)
+            metrics.transferred(uploaded=len(body))
         elif type(data) == bytes:
             self.client.put_object(Body=data, Bucket=self.container, Key=key)
+            metrics.transferred(uploaded=len(data))
         else:
             raise TypeError(f"invalid data type '{type(data)}'")
 
@@ -43,8 +63,89 @@ class S3StorageProvider(provider.StorageProvider):
             self.client.put_object_acl(Bucket=self.container, Key=key, ACL=acl)
 
     def retrieve(self, key: str, filename: str) -> None:
+        os.makedirs(path.dirname(filename), exist_ok=True)
         self.client.download_file(self.container, key, filename)
+        metrics.transferred(downloaded=path.getsize(filename))
+
+    def store_if_absent(self, data: Union[str, bytes], key: str) -> bool:
+        body = data.encode("utf-8") if type(data) == str else data
+        try:
+            self.client.put_object(Body=body,
+                                   Bucket=self.container,
+                                   Key=key,
+                                   **{IF_NONE_MATCH_PARAM: "*"})
+        except ClientError as err:
+            # a conflict means another conditional write to the key is in
+            # progress, which will win
+            if err.response["Error"]["Code"] in ("PreconditionFailed",
+                                                 "ConditionalRequestConflict"):
+                return False
+            raise
+        metrics.transferred(uploaded=len(body))
+        return True
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.container, Key=key)
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.container, Key=key)
+            return True
+        except ClientError as err:
+            if err.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return False
+            raise
+
+    def open(self, key: str) -> BinaryIO:
+        return self.client.get_object(Bucket=self.container, Key=key)["Body"]
+
+    def size(self, key: str) -> int:
+        return self.client.head_object(Bucket=self.container,
+                                       Key=key)["ContentLength"]
+
+    def read_range(self, key: str, start: int, length: int) -> bytes:
+        if length <= 0:
+            return b""
+        response = self.client.get_object(
+            Bucket=self.container,
+            Key=key,
+            Range=f"bytes={start}-{start + length - 1}")
+        data = response["Body"].read()
+        metrics.transferred(downloaded=len(data))
+        return data
+
+    def copy(self, key: str, dest: provider.StorageProvider,
+             dest_key: str) -> None:
+        if not isinstance(dest, S3StorageProvider) \
+                or dest.endpoint != self.endpoint:
+            super().copy(key, dest, dest_key)
+            return
+
+        # managed copy happens server-side, and switches to multipart
+        # UploadPartCopy for large objects
+        copy_source = {"Bucket": self.container, "Key": key}
+        self.client.copy(copy_source, dest.container, dest_key)
+
+    def ls(self, prefix: str = "") -> Generator[str, None, None]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.container, Prefix=prefix):
+            yield from [obj["Key"] for obj in page.get("Contents", [])]
+
+
+def _take_if_none_match(params, context, **kwargs) -> None:
+    """Take our conditional write parameter out before botocore validates
+    the parameters of a request."""
+    if IF_NONE_MATCH_PARAM in params:
+        context["if_none_match"] = params.pop(IF_NONE_MATCH_PARAM)
+
+
+def _add_if_none_match(params, context, **kwargs) -> None:
+    """Send the conditional write parameter of a request as its header."""
+    if "if_none_match" in context:
+        params["headers"]["If-None-Match"] = context["if_none_match"]
+
 
-    def ls(self) -> Generator[str, None, None]:
-        objects = self.client.list_objects_v2(Bucket=self.container)
-        yield from [obj["Key"] for obj in objects["Contents"]]
\ No newline at end of file
+def _record_request(http_response, parsed, model, **kwargs) -> None:
+    """Count each request made to S3, and how many times it was retried."""
+    retries = parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+    metrics.request(f"s3.{model.name}", retries)
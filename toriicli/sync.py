@@ -0,0 +1,252 @@
+"""Incrementally syncing one folder to another."""
+from dataclasses import dataclass
+import errno
+import os
+from os import path
+import shutil
+import stat
+from typing import Callable, Set, Tuple
+from urllib.parse import unquote
+import zipfile
+import zlib
+
+from . import hashing
+
+CopyFunction = Callable[[str, str], None]
+"""Copies a file from a source path to a destination path, like
+shutil.copy2."""
+
+FICLONE = 0x40049409
+"""The Linux ioctl for making a copy-on-write clone of a file."""
+
+REFLINK_UNSUPPORTED_ERRORS = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL)
+"""Errors from cloning a file that mean the filesystem doesn't support it,
+rather than that this one clone failed (i.e. across filesystems)."""
+
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+"""The permission bits that let a file be written to."""
+
+# whether to try cloning files, until we find the filesystem doesn't support it
+_reflink_supported = hasattr(os, "uname") and os.uname().sysname == "Linux"
+
+META_EXTENSION = ".meta"
+"""The extension of the files Unity generates alongside assets."""
+
+
+@dataclass
+class SyncResult:
+    """What syncing a folder did.
+
+    Attributes:
+        copied: How many files were copied because they were new or changed.
+        unchanged: How many files were left alone.
+        removed: How many files were removed from the destination.
+    """
+    copied: int = 0
+    unchanged: int = 0
+    removed: int = 0
+
+
+def link_file(src: str, dst: str) -> None:
+    """Make a file at dst with the contents of src, sharing its storage if
+    possible. Tries a copy-on-write clone, and falls back to copying. Files
+    are only hardlinked if src is read-only, as writing to a hardlink would
+    change src too."""
+    if _try_reflink(src, dst):
+        return
+    if os.stat(src).st_mode & WRITE_BITS == 0:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def _try_reflink(src: str, dst: str) -> bool:
+    global _reflink_supported
+    if not _reflink_supported:
+        return False
+    try:
+        import fcntl
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        shutil.copystat(src, dst)
+        return True
+    except ImportError:
+        _reflink_supported = False
+        return False
+    except OSError as err:
+        # don't keep trying if the filesystem doesn't support it
+        if err.errno in REFLINK_UNSUPPORTED_ERRORS:
+            _reflink_supported = False
+        if path.lexists(dst):
+            os.remove(dst)
+        return False
+
+
+def sync_tree(src: str,
+              dst: str,
+              copy_function: CopyFunction = shutil.copy2) -> SyncResult:
+    """Make a destination folder match a source folder, only copying files
+    that are new or changed.
+
+    A file is unchanged if its size and modification time match the source,
+    or failing that, if its contents hash the same. Unchanged files aren't
+    touched, so their modification times are kept. Files not in the source are
+    removed from the destination, apart from Unity .meta files for assets that
+    are still there, so assets keep their GUIDs.
+
+    Raises:
+        OSError: If a file couldn't be copied or removed.
+    """
+    if not path.isdir(src):
+        raise FileNotFoundError(f"No such folder: '{src}'")
+
+    src_files, src_dirs = _walk(src)
+
+    def same_file(rel_path: str, dst_file: str) -> bool:
+        return _same_file(path.join(src, rel_path), dst_file)
+
+    def copy_file(rel_path: str, dst_file: str) -> None:
+        copy_function(path.join(src, rel_path), dst_file)
+
+    return _sync(src_files, src_dirs, dst, same_file, copy_file)
+
+
+def sync_zip(zip_path: str, prefix: str, dst: str) -> SyncResult:
+    """Make a destination folder match the files under a folder in a zip
+    file, only extracting files that are new or changed. Works like
+    sync_tree, with files compared by size and CRC.
+
+    Args:
+        zip_path: The path to the zip file.
+        prefix: The folder in the zip file to extract, i.e. 'lib/net46/'.
+            Matched case-insensitively.
+        dst: The folder to extract to.
+
+    Raises:
+        OSError: If a file couldn't be extracted or removed.
+        ValueError: If the zip file was invalid, or had unsafe paths in it.
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        members = {}
+        for info in archive.infolist():
+            if info.is_dir() or \
+                    not info.filename.lower().startswith(prefix.lower()):
+                continue
+            rel_path = safe_relpath(unquote(info.filename[len(prefix):]))
+            members[rel_path] = info
+        if len(members) == 0:
+            raise FileNotFoundError(
+                f"No files in '{zip_path}' under '{prefix}'")
+
+        dirs = set()
+        for rel_path in members:
+            parent = path.dirname(rel_path)
+            while parent != "":
+                dirs.add(parent)
+                parent = path.dirname(parent)
+
+        def same_file(rel_path: str, dst_file: str) -> bool:
+            info = members[rel_path]
+            return os.stat(dst_file).st_size == info.file_size \
+                and _crc32(dst_file) == info.CRC
+
+        def extract_file(rel_path: str, dst_file: str) -> None:
+            with archive.open(members[rel_path]) as member, \
+                    open(dst_file, "wb") as out_file:
+                shutil.copyfileobj(member, out_file, hashing.HASH_BUFFER_SIZE)
+
+        return _sync(set(members), dirs, dst, same_file, extract_file)
+
+
+def _sync(src_files: Set[str], src_dirs: Set[str], dst: str,
+          same_file: Callable[[str, str], bool],
+          write_file: Callable[[str, str], None]) -> SyncResult:
+    """Sync files into a destination folder. Checks whether each file in the
+    destination is the same with same_file, and writes it with write_file if
+    not. Both are called with the relative path of a file in the source, and
+    a path in the destination."""
+    result = SyncResult()
+    dst_files, dst_dirs = _walk(dst) if path.isdir(dst) else (set(), set())
+
+    for rel_dir in sorted(src_dirs - dst_dirs):
+        os.makedirs(path.join(dst, rel_dir), exist_ok=True)
+    os.makedirs(dst, exist_ok=True)
+
+    for rel_path in sorted(src_files):
+        dst_file = path.join(dst, rel_path)
+        if rel_path in dst_files and same_file(rel_path, dst_file):
+            result.unchanged += 1
+            continue
+
+        # copy alongside and replace, so the file is never half-written
+        temp_file = f"{dst_file}.{os.getpid()}.tmp"
+        try:
+            write_file(rel_path, temp_file)
+            os.replace(temp_file, dst_file)
+        finally:
+            if path.lexists(temp_file):
+                os.remove(temp_file)
+        result.copied += 1
+
+    src_assets = src_files | src_dirs
+    for rel_path in dst_files - src_files:
+        if rel_path.endswith(META_EXTENSION) \
+                and rel_path[:-len(META_EXTENSION)] in src_assets:
+            continue
+        os.remove(path.join(dst, rel_path))
+        result.removed += 1
+
+    # remove folders that aren't in the source, deepest first, as long as
+    # they're empty now
+    for rel_dir in sorted(dst_dirs - src_dirs, reverse=True):
+        try:
+            os.rmdir(path.join(dst, rel_dir))
+        except OSError:
+            pass
+
+    return result
+
+
+def _walk(folder: str) -> Tuple[Set[str], Set[str]]:
+    """Get the relative paths of every file and folder in a folder."""
+    files: Set[str] = set()
+    dirs: Set[str] = set()
+    for root, dir_names, file_names in os.walk(folder):
+        rel_root = path.relpath(root, folder)
+        for dir_name in dir_names:
+            dirs.add(path.normpath(path.join(rel_root, dir_name)))
+        for file_name in file_names:
+            files.add(path.normpath(path.join(rel_root, file_name)))
+    return files, dirs
+
+
+def _same_file(src_file: str, dst_file: str) -> bool:
+    src_stat = os.stat(src_file)
+    dst_stat = os.stat(dst_file)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
+    return hashing.hash_file(src_file) == hashing.hash_file(dst_file)
+
+
+def _crc32(file_path: str) -> int:
+    crc = 0
+    with open(file_path, "rb") as f_handle:
+        for chunk in iter(lambda: f_handle.read(hashing.HASH_BUFFER_SIZE),
+                          b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def safe_relpath(rel_path: str) -> str:
+    """Normalise a relative path from an archive, making sure it can't point
+    outside of the folder it's extracted to."""
+    normalised = path.normpath(rel_path)
+    if path.isabs(normalised) or path.splitdrive(normalised)[0] != "" \
+            or normalised == ".." or normalised.startswith(".." + os.sep):
+        raise ValueError(f"Unsafe path in archive: '{rel_path}'")
+    return normalised